@@ -0,0 +1,194 @@
+"""
+Asyncio front ends for Client and Server.
+
+The link is driven bit by bit with sleeps in between, so a call into
+Client or Server blocks its thread for the whole exchange. Here that work
+runs on a thread of its own and the event loop only ever awaits it.
+
+AsyncClient sends requests from one link thread (a single-worker
+executor). Requests made while the link is busy queue up and go out
+together as one batch (see Client.batch) as soon as it is free, so many
+coroutines can have requests in flight at once:
+
+    async with AsyncClient(framed=True) as client:
+        a, b = await asyncio.gather(client.get("/data/a"), client.get("/data/b"))
+        await client.post("/data/c", {"value": 1}, timeout=5)
+
+A timeout or a cancellation drops a request that is still queued. One that
+is already on the link cannot be called back mid-transmission; it finishes
+in the background and its response is discarded. close() cancels every
+request and releases the pins, waiting at most CLOSE_TIMEOUT seconds for
+a batch that is still on the link.
+
+AsyncServer receives on its own thread and runs the Server's handlers
+there. Handlers registered with AsyncServer.route() are coroutines that run
+on the event loop instead, so they can use the rest of the asyncio program:
+
+    server = AsyncServer(framed=True)
+
+    @server.route("GET", "/sensors/{name}")
+    async def read_sensor(request, name):
+        return Response(200, json.dumps(await sensors.read(name)).encode())
+
+    await server.serve()
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+from client import Client, get_request, list_request, post_request
+from server import Server
+
+MAX_BATCH = 16       # Queued requests sent in one transmission
+CLOSE_TIMEOUT = 5.0  # Seconds close() waits for the batch on the link
+
+
+class AsyncClient:
+    def __init__(self, client=None, max_batch=MAX_BATCH, **kwargs):
+        """Wrap client, or a new Client(**kwargs)."""
+        self.client = client if client is not None else Client(**kwargs)
+        self.max_batch = max_batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="link")
+        self._pending = deque()   # (Request, asyncio.Future) not yet sent
+        self._sending = []        # ... on the link now
+        self._sender = None
+
+    async def get(self, path, headers=None, timeout=None):
+        """Send a GET request."""
+        return await self.request(get_request(path, headers), timeout)
+
+    async def post(self, path, data, headers=None, timeout=None):
+        """Send a POST request with JSON data."""
+        return await self.request(post_request(path, data, headers), timeout)
+
+    async def list(self, prefix, limit=None, after=None, values=False, timeout=None):
+        """List the keys under prefix, one page per call (see Client.list)."""
+        return await self.request(list_request(prefix, limit, after, values), timeout)
+
+    async def request(self, request, timeout=None):
+        """Queue a Request for the link and return the parsed response.
+        Raises asyncio.TimeoutError if there is none within timeout seconds."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((request, future))
+        if self._sender is None:
+            self._sender = asyncio.create_task(self._send_pending())
+        return await asyncio.wait_for(future, timeout)
+
+    async def _send_pending(self):
+        """Send queued requests in batches until the queue is empty."""
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending:
+                batch = []
+                while self._pending and len(batch) < self.max_batch:
+                    request, future = self._pending.popleft()
+                    if not future.done():   # Skip cancelled and timed out requests
+                        batch.append((request, future))
+                if not batch:
+                    continue
+                self._sending = batch
+                try:
+                    responses = await loop.run_in_executor(
+                        self._executor, self.client.batch, [request for request, _ in batch])
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), response in zip(batch, responses):
+                    if not future.done():
+                        future.set_result(response)
+        finally:
+            self._sending = []
+            self._sender = None
+
+    async def close(self, timeout=CLOSE_TIMEOUT):
+        """Cancel every request, then release the pins once the link is idle,
+        or after timeout seconds if a batch is stuck on it."""
+        for _, future in list(self._pending) + self._sending:
+            future.cancel()
+        self._pending.clear()
+        if self._sender is not None:
+            self._sender.cancel()
+        loop = asyncio.get_running_loop()
+        idle = loop.run_in_executor(self._executor, self.client.cleanup)
+        try:
+            await asyncio.wait_for(idle, timeout)
+        except asyncio.TimeoutError:
+            # Closing the transport under the stuck batch makes it fail
+            print("Link still busy, releasing it anyway")
+            await loop.run_in_executor(None, self.client.cleanup)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class AsyncServer:
+    def __init__(self, server=None, **kwargs):
+        """Wrap server, or a new Server(**kwargs)."""
+        self.server = server if server is not None else Server(**kwargs)
+        self._loop = None
+        self._done = None
+
+    def route(self, method, pattern):
+        """Decorator registering a coroutine handler(request, **params) that
+        returns a Response. It runs on the event loop serve() runs on."""
+        def register(handler):
+            self.server.router.add(method, pattern, self._blocking(handler))
+            return handler
+        return register
+
+    def _blocking(self, handler):
+        """Wrap a coroutine handler for the receiving thread, which waits
+        for it on the event loop."""
+        def call(request, **params):
+            future = asyncio.run_coroutine_threadsafe(handler(request, **params), self._loop)
+            return future.result()
+        return call
+
+    async def serve(self):
+        """Answer requests until stop() is called, the task is cancelled or
+        receiving fails (the error is raised here)."""
+        self._loop = asyncio.get_running_loop()
+        self._done = self._loop.create_future()
+        self.server.running = True
+        print("Server started. Waiting for requests...")
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+        try:
+            await self._done
+        finally:
+            self.server.running = False
+
+    def stop(self):
+        """Stop serving. A receive already waiting on the link ends after
+        the next request."""
+        self.server.running = False
+        if self._done is not None:
+            self._loop.call_soon_threadsafe(self._finish, None)
+
+    def close(self):
+        """Release the pins."""
+        self.server.cleanup()
+
+    def _receive_loop(self):
+        error = None
+        try:
+            while self.server.running:
+                self.server.receive_message()
+        except Exception as e:
+            error = e
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._finish, error)
+
+    def _finish(self, error):
+        if self._done.done():
+            return
+        if error is None:
+            self._done.set_result(None)
+        else:
+            self._done.set_exception(error)
@@ -0,0 +1,302 @@
+"""
+Selective-repeat ARQ on top of the framed GPIO link.
+
+Lets the clock run at the fastest rate that is *mostly* correct: frames that
+fail their CRC are dropped by the decoder and sent again, instead of every
+bit paying for the slowest safe delay.
+
+Because the link is half-duplex the sender works in bursts:
+1. Send every frame in the window that is new or known to be lost.
+   The last frame of the burst carries FLAG_POLL.
+2. Turn the line around and wait for an ACK frame.
+   The ACK holds the next sequence number the receiver needs (cumulative)
+   and a bitmap of the 32 frames after it that already arrived (selective).
+3. Frames the ACK does not cover are resent in the next burst. If no ACK
+   arrives within the retransmit timeout, the whole window is resent.
+
+The timeout adapts to the measured ACK round trip (RFC 6298 style). Until
+the first ACK it is a few times what a full burst and its ACK take at the
+link's bit period, as at 1 ms a bit a burst of 4 KiB frames takes minutes.
+The end of a transfer is an empty frame with FLAG_FIN, sequenced like data.
+
+Usage (with Comm(framed=True) on both boards):
+    python arq.py send FILE
+    python arq.py recv OUTFILE
+"""
+
+from dataclasses import dataclass, field
+import argparse
+import struct
+import time
+from connection import Frame, FrameHeader, FRAME_PAYLOAD, HEADER, TRAILER
+
+FLAG_ACK = 0x01   # Payload is an ACK
+FLAG_POLL = 0x02  # Last frame of a burst, receiver should ACK now
+FLAG_FIN = 0x04   # End of transfer
+
+ACK = struct.Struct(">HI")  # cumulative seq, selective bitmap
+SACK_BITS = 32
+SEQ_MOD = 1 << 16
+
+DEFAULT_WINDOW = 8
+MIN_RTO = 0.05
+MAX_RTO = 10.0
+INITIAL_RTO = 1.0   # Least seconds to wait for the first ACK
+RTO_MARGIN = 2      # ... otherwise this many full bursts
+MAX_RETRIES = 10
+
+
+def encode_ack(cumulative, received):
+    """Build ACK payload for the next expected seq and a set of later seqs."""
+    bitmap = 0
+    for seq in received:
+        offset = (seq - cumulative - 1) % SEQ_MOD
+        if offset < SACK_BITS:
+            bitmap |= 1 << offset
+    return ACK.pack(cumulative % SEQ_MOD, bitmap)
+
+
+def decode_ack(payload):
+    """Return (cumulative, set of selectively acked seqs) from an ACK payload."""
+    cumulative, bitmap = ACK.unpack(payload)
+    selective = {(cumulative + 1 + i) % SEQ_MOD
+                 for i in range(SACK_BITS) if bitmap >> i & 1}
+    return cumulative, selective
+
+
+@dataclass
+class ArqStats:
+    payload_bytes: int = 0
+    frames_sent: int = 0
+    retransmissions: int = 0
+    timeouts: int = 0
+    started: float = field(default_factory=time.monotonic)
+    finished: float = 0.0
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def goodput(self):
+        """Delivered payload bytes per second."""
+        return self.payload_bytes / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def retransmit_ratio(self):
+        """Share of sent frames that were retransmissions."""
+        return self.retransmissions / self.frames_sent if self.frames_sent else 0.0
+
+    def __str__(self):
+        return (f"{self.payload_bytes} bytes in {self.elapsed:.2f}s "
+                f"({self.goodput:.0f} B/s goodput), "
+                f"{self.frames_sent} frames, {self.retransmissions} retransmitted "
+                f"({self.retransmit_ratio:.1%}), {self.timeouts} timeouts")
+
+
+class RetransmitTimer:
+    """Adaptive retransmit timeout from smoothed ACK round-trip times."""
+
+    def __init__(self, initial=INITIAL_RTO, minimum=MIN_RTO, maximum=MAX_RTO):
+        self.rto = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.srtt = None
+        self.rttvar = None
+
+    def sample(self, rtt):
+        """Fold in a round-trip measurement (never from a retransmission)."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(self.maximum, max(self.minimum, self.srtt + 4 * self.rttvar))
+
+    def backoff(self):
+        self.rto = min(self.maximum, self.rto * 2)
+
+
+class ArqSender:
+    def __init__(self, link, window=DEFAULT_WINDOW, chunk_size=FRAME_PAYLOAD,
+                 max_retries=MAX_RETRIES, initial_rto=None):
+        """link needs send_frames(frames), receive_frame(timeout) and
+        bit_period_us. initial_rto defaults to a few burst times, see
+        burst_seconds()."""
+        if not 1 <= window <= SACK_BITS:
+            raise ValueError(f"window must be between 1 and {SACK_BITS}")
+        self.link = link
+        self.window = window
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        if initial_rto is None:
+            initial_rto = max(INITIAL_RTO, RTO_MARGIN * self.burst_seconds())
+        self.timer = RetransmitTimer(initial_rto, maximum=max(MAX_RTO, initial_rto))
+        self.stats = ArqStats()
+
+    def burst_seconds(self):
+        """Time on the line for a full window of frames and the ACK, at the
+        link's bit period."""
+        framing = HEADER.size + TRAILER.size
+        size = self.window * (self.chunk_size + framing) + framing + ACK.size
+        return size * 8 * self.link.bit_period_us / 1_000_000
+
+    def send(self, data):
+        """Reliably deliver data, returning the transfer statistics."""
+        data = memoryview(bytes(data))
+        chunks = [data[i:i + self.chunk_size] for i in range(0, len(data), self.chunk_size)]
+        chunks.append(b"")  # FIN
+        self.stats = ArqStats(payload_bytes=len(data))
+
+        acked = [False] * len(chunks)
+        sent = [0] * len(chunks)  # transmissions per chunk
+        base = 0
+        retries = 0
+
+        while base < len(chunks):
+            # New or lost frames in the window
+            burst = [i for i in range(base, min(base + self.window, len(chunks)))
+                     if not acked[i]]
+            frames = [self._frame(i, chunks[i], i == len(chunks) - 1) for i in burst]
+            frames[-1].header.flags |= FLAG_POLL
+
+            for i in burst:
+                if sent[i]:
+                    self.stats.retransmissions += 1
+                sent[i] += 1
+            self.stats.frames_sent += len(frames)
+            fresh = all(sent[i] == 1 for i in burst)
+
+            self.link.send_frames(frames)
+            start = time.monotonic()
+            try:
+                cumulative, selective = self._wait_ack(self.timer.rto)
+            except TimeoutError:
+                self.stats.timeouts += 1
+                retries += 1
+                if retries > self.max_retries:
+                    if base == len(chunks) - 1:
+                        break  # Only the FIN is unconfirmed, the data got through
+                    raise RuntimeError("Peer stopped acknowledging frames")
+                self.timer.backoff()
+                continue
+
+            retries = 0
+            if fresh:
+                # Karn's rule: only time bursts without retransmissions
+                self.timer.sample(time.monotonic() - start)
+
+            # Mark everything the ACK covers, then slide the window
+            for i in range(base, min(base + SACK_BITS + 1, len(chunks))):
+                offset = (i - cumulative) % SEQ_MOD
+                if offset >= SEQ_MOD // 2 or (i % SEQ_MOD) in selective:
+                    acked[i] = True
+            while base < len(chunks) and acked[base]:
+                base += 1
+
+        self.stats.finished = time.monotonic()
+        return self.stats
+
+    def _frame(self, index, chunk, last):
+        flags = FLAG_FIN if last else 0
+        return Frame(FrameHeader(seq=index % SEQ_MOD, flags=flags), bytes(chunk))
+
+    def _wait_ack(self, timeout):
+        """Wait for an ACK frame, ignoring anything else the peer sends."""
+        deadline = time.monotonic() + timeout
+        while True:
+            frame = self.link.receive_frame(timeout=max(0.0, deadline - time.monotonic()))
+            if frame.header.flags & FLAG_ACK:
+                return decode_ack(frame.payload)
+
+
+class ArqReceiver:
+    def __init__(self, link, window=DEFAULT_WINDOW, linger=2.0):
+        """link needs send_frames(frames) and receive_frame(timeout).
+        linger is how long to keep re-acknowledging a FIN after the transfer."""
+        self.link = link
+        self.window = window
+        self.linger = linger
+        self.duplicates = 0
+
+    def receive(self):
+        """Receive one transfer and return its payload."""
+        expected = 0  # Unwrapped index of the next frame to deliver
+        pending = {}
+        out = bytearray()
+        finished = False
+
+        while not finished:
+            frame = self.link.receive_frame()
+            if frame.header.flags & FLAG_ACK:
+                continue
+
+            seq = frame.header.seq
+            if (seq - expected) % SEQ_MOD < self.window and seq not in pending:
+                pending[seq] = frame
+            else:
+                # Already delivered or buffered, the ACK will say so
+                self.duplicates += 1
+
+            # Deliver whatever is now in order
+            while expected % SEQ_MOD in pending:
+                ready = pending.pop(expected % SEQ_MOD)
+                expected += 1
+                if ready.header.flags & FLAG_FIN:
+                    finished = True
+                    break
+                out += ready.payload
+
+            if frame.header.flags & FLAG_POLL:
+                self._ack(expected, pending)
+
+        self._linger(expected)
+        return bytes(out)
+
+    def _ack(self, expected, pending):
+        ack = Frame(FrameHeader(flags=FLAG_ACK), encode_ack(expected, pending))
+        self.link.send_frames([ack])
+
+    def _linger(self, expected):
+        """Answer retransmitted FINs in case our last ACK was lost."""
+        deadline = time.monotonic() + self.linger
+        while time.monotonic() < deadline:
+            try:
+                frame = self.link.receive_frame(timeout=deadline - time.monotonic())
+            except TimeoutError:
+                return
+            if frame.header.flags & FLAG_POLL:
+                self._ack(expected, {})
+
+
+def main():
+    from comm import Comm
+    from waveform import DEFAULT_BIT_PERIOD_US
+
+    parser = argparse.ArgumentParser(description='Reliable file transfer over GPIO pins')
+    parser.add_argument('mode', choices=['send', 'recv'])
+    parser.add_argument('filename')
+    parser.add_argument('-p', '--bit-period', type=int, default=DEFAULT_BIT_PERIOD_US,
+                      help='Bit period in microseconds')
+    parser.add_argument('-w', '--window', type=int, default=DEFAULT_WINDOW,
+                      help='Frames in flight before waiting for an ACK')
+    args = parser.parse_args()
+
+    comm = Comm(waveform=True, notify=True, framed=True, bit_period_us=args.bit_period)
+    try:
+        if args.mode == 'send':
+            with open(args.filename, 'rb') as f:
+                data = f.read()
+            stats = ArqSender(comm, window=args.window).send(data)
+            print(f"Sent {stats}")
+        else:
+            data = ArqReceiver(comm, window=args.window).receive()
+            with open(args.filename, 'wb') as f:
+                f.write(data)
+            print(f"Wrote {len(data)} bytes to {args.filename}")
+    finally:
+        comm.cleanup()
+
+if __name__ == "__main__":
+    main()
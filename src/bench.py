@@ -0,0 +1,489 @@
+"""
+Benchmarks for the GPIO link.
+
+Link benchmarks run like timing_test.py on a single Pi: the sender drives
+the pins and a notification receiver on the same pins decodes what actually
+appeared on them, so no second board is needed. Make sure the pigpio daemon
+is running: sudo pigpiod
+
+    python bench.py ddr --periods 1000 500 250 100
+    python bench.py messages
+    python bench.py storage --records 100000
+    python bench.py parse --sizes 1000 100000 1000000
+    python bench.py mux --rate 100000 --bulk 65536
+    python bench.py bus --nodes 1 2 4 8
+    python bench.py workers --workers 0 1 4 --handler-ms 20
+    python bench.py transport --requests 2000 --bit-error-rates 1e-5 1e-4
+"""
+
+from collections import deque
+from contextlib import redirect_stdout
+import argparse
+import os
+import queue
+import random
+import shutil
+import tempfile
+import threading
+import time
+from connection import Connection
+from notify import NotifyReceiver
+from messages import (TEXT, BINARY, Request, Response, DynamicTable,
+                      encode_request, encode_response, decode_request)
+from compression import ACCEPT, compress
+from storage import LogStorage, MEMORY, WRITTEN, SYNCED
+from mux import Mux, BULK, INTERACTIVE, ROUND_BYTES
+from bus import BusNode, SimulatedBus, SERVER_ADDRESS
+from workers import WorkerPool, DEFAULT_QUEUE_SIZE
+from transport import PipeTransport, SocketTransport
+from comm import Comm
+from client import Client
+from server import Server
+from arq import ArqSender, ArqReceiver
+
+CLOCK_PIN = 24
+IDLE_TIMEOUT = 0.5   # Seconds without data that end a transfer
+
+
+def test_pattern(size):
+    """Known pseudo-random payload."""
+    return random.Random(0).randbytes(size)
+
+
+def loopback_transfer(data, data_pins, clock_pin=CLOCK_PIN, **kwargs):
+    """Send data as a waveform while decoding the same pins.
+    kwargs go to Connection. Returns (seconds, received bytes)."""
+    conn = Connection(data_pins[0], clock_pin, waveform=True,
+                      data_pins=data_pins, **kwargs)
+    receiver = NotifyReceiver(conn.pi, data_pins[0], clock_pin, conn.lanes,
+                              ddr=conn.ddr)
+    received = bytearray()
+    elapsed = []
+
+    def send():
+        start = time.perf_counter()
+        conn.send_bytes(data)
+        elapsed.append(time.perf_counter() - start)
+
+    try:
+        receiver.begin()
+        # Read while sending, the notification pipe only buffers so much
+        sender = threading.Thread(target=send)
+        sender.start()
+        while len(received) < len(data):
+            chunk = receiver.read(timeout=IDLE_TIMEOUT)
+            if not chunk and not sender.is_alive():
+                break
+            received += chunk
+        sender.join()
+    finally:
+        receiver.close()
+        conn.cleanup()
+    return elapsed[0], bytes(received)
+
+
+def byte_errors(sent, received):
+    """Wrong or missing bytes."""
+    wrong = sum(a != b for a, b in zip(sent, received))
+    return wrong + max(0, len(sent) - len(received))
+
+
+def bench_ddr(args):
+    """Compare SDR and DDR at the same clock period, i.e. the same edge rate."""
+    data = test_pattern(args.size)
+    print(f"{'mode':<5} {'clock us':>8} {'edges/s':>9} {'bytes/s':>9} {'errors':>7}")
+    for period in args.periods:
+        for ddr in (False, True):
+            seconds, received = loopback_transfer(data, args.data_pins,
+                                                  bit_period_us=period, ddr=ddr)
+            mode = "DDR" if ddr else "SDR"
+            print(f"{mode:<5} {period:>8} {2_000_000 // period:>9} "
+                  f"{len(data) / seconds:>9.0f} {byte_errors(data, received):>7}")
+
+
+def typical_exchanges():
+    """Requests and responses like the client and server exchange."""
+    body = b'{"value": 21.5}'
+    record = (b'{"id": 3, "name": "greenhouse", "type": "temperature", '
+              b'"value": 21.5, "unit": "C", "timestamp": 1700000000}')
+    post_headers = {'Content-Type': 'application/json', 'Content-Length': str(len(body))}
+    return [
+        ("GET /", Request("GET", "/"), Response(200, b"Server is running")),
+        ("GET /data/temp", Request("GET", "/data/temp"), Response(200, body)),
+        ("POST /data/temp", Request("POST", "/data/temp", post_headers, body),
+         Response(200, b"Data stored at /data/temp")),
+        ("GET /data/record", Request("GET", "/data/record"), Response(200, record)),
+        ("GET /data/record 304",
+         Request("GET", "/data/record", {'If-None-Match': '"5d1c07e2"', 'A-IM': 'merge-patch'}),
+         Response(304, b"", {'ETag': '"5d1c07e2"'})),
+        ("GET /missing", Request("GET", "/missing"),
+         Response(400, b"Path not found: /missing")),
+    ]
+
+
+def compact_size(request, response, tables):
+    """Binary size with compression, using and updating a connection's tables."""
+    request_headers = dict(request.headers, **{'Accept-Encoding': ACCEPT})
+    body, coding = compress(response.body, ACCEPT)
+    response_headers = dict(response.headers, **{'Accept-Encoding': ACCEPT})
+    if coding:
+        response_headers['Content-Encoding'] = coding
+    request = Request(request.method, request.path, request_headers, request.body)
+    response = Response(response.status, body, response_headers)
+    return (len(encode_request(request, BINARY, tables[0]))
+            + len(encode_response(response, BINARY, tables[1])))
+
+
+def bench_messages(args):
+    """Bytes on the wire per request/response pair.
+    'compact' is binary with compression on a connection that has already
+    made the same exchange once, so the header tables are warm."""
+    print(f"{'exchange':<22} {'text':>6} {'binary':>6} {'compact':>7} {'saved':>6}")
+    for name, request, response in typical_exchanges():
+        text, binary = [len(encode_request(request, encoding))
+                        + len(encode_response(response, encoding))
+                        for encoding in (TEXT, BINARY)]
+        tables = (DynamicTable(), DynamicTable())
+        compact_size(request, response, tables)
+        compact = compact_size(request, response, tables)
+        print(f"{name:<22} {text:>6} {binary:>6} {compact:>7} {1 - compact / text:>6.0%}")
+
+
+def legacy_parse_request(message):
+    """The server's original request parser, kept for comparison: decode,
+    split into lines and rebuild the body line by line."""
+    lines = message.decode('utf-8').strip().split('\n')
+    method, path, version = lines[0].strip().split()
+    headers = {}
+    body = ""
+    in_body = False
+    for line in lines[1:]:
+        if not in_body and line.strip() == "":
+            in_body = True
+            continue
+        if in_body:
+            body += line + "\n"
+        elif ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip()] = value.strip()
+    return method, path, headers, body
+
+
+def bench_parse(args):
+    """Text request parsing time for large, many-line bodies."""
+    line = b'{"id": 12345, "name": "sensor", "value": 21.5, "unit": "C"},\n'
+    print(f"{'body bytes':>10} {'legacy ms':>10} {'parser ms':>10} {'speedup':>8}")
+    for size in args.sizes:
+        body = line * max(1, size // len(line))
+        message = encode_request(Request("POST", "/data/bulk", {
+            'Content-Type': 'application/json', 'Content-Length': str(len(body))}, body))
+        legacy = min(timed(legacy_parse_request, message)[0] for _ in range(args.repeat))
+        parsed = min(timed(decode_request, message)[0] for _ in range(args.repeat))
+        print(f"{len(body):>10} {legacy * 1000:>10.3f} {parsed * 1000:>10.3f} "
+              f"{legacy / parsed:>7.1f}x")
+
+
+class SimulatedLink:
+    """One end of an in-process link that takes as long as bits_per_second
+    says to carry each transmission, for benchmarks of scheduling rather
+    than of the pins. Has Comm's send_frames() and receive_frame()."""
+
+    def __init__(self, bits_per_second):
+        self.bits_per_second = bits_per_second
+        self.inbox = queue.Queue()
+        self.peer = None
+
+    @classmethod
+    def pair(cls, bits_per_second):
+        a, b = cls(bits_per_second), cls(bits_per_second)
+        a.peer, b.peer = b, a
+        return a, b
+
+    def send_frames(self, frames):
+        size = sum(len(frame.encode()) for frame in frames)
+        time.sleep(size * 8 / self.bits_per_second)
+        for frame in frames:
+            self.peer.inbox.put(frame)
+
+    def receive_frame(self, timeout=None):
+        try:
+            return self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Timed out waiting for a frame") from None
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def bench_mux(args):
+    """Latency of small requests while a bulk transfer runs, first come
+    first served vs the weighted fair scheduler."""
+    print(f"{'scheduler':<10} {'requests':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'bulk s':>7}")
+    for fair in (False, True):
+        client_link, server_link = SimulatedLink.pair(args.rate)
+        server = Mux(server_link, initiator=False, handler=lambda message: b"ok",
+                     round_bytes=args.round_bytes).start()
+        client = Mux(client_link, fair=fair, round_bytes=args.round_bytes).start()
+        start = time.perf_counter()
+        bulk = client.request(test_pattern(args.bulk), BULK)
+        latencies = []
+        while not bulk.done():
+            seconds, _ = timed(client.send_message, b"GET /data/temp", INTERACTIVE)
+            latencies.append(seconds)
+            time.sleep(args.interval)
+        bulk.result()
+        bulk_seconds = time.perf_counter() - start
+        client.stop()
+        server.stop()
+        name = "fair" if fair else "fifo"
+        print(f"{name:<10} {len(latencies):>8} {percentile(latencies, 0.5) * 1000:>8.0f} "
+              f"{percentile(latencies, 0.99) * 1000:>8.0f} {max(latencies) * 1000:>8.0f} "
+              f"{bulk_seconds:>7.2f}")
+
+
+def run_bus(count, args, handler, pool=None):
+    """Load a bus of count clients for args.seconds, each keeping args.depth
+    requests outstanding. Returns the requests done per client and the bus."""
+    bus = SimulatedBus(args.rate)
+    ring = [SERVER_ADDRESS] + list(range(1, count + 1))
+    server = BusNode(bus.port(), SERVER_ADDRESS, ring, handler=handler, pool=pool)
+    clients = [BusNode(bus.port(), address, ring) for address in ring[1:]]
+    for node in clients + [server]:
+        node.start()
+    request = test_pattern(args.size)
+    done = [0] * count
+    deadline = time.perf_counter() + args.seconds
+
+    def load(index):
+        # Keep depth requests outstanding, so a node always has one
+        # queued when the token arrives
+        pending = deque(clients[index].request(request) for _ in range(args.depth))
+        while time.perf_counter() < deadline:
+            pending.popleft().result()
+            done[index] += 1
+            pending.append(clients[index].request(request))
+        for future in pending:
+            future.result()
+
+    threads = [threading.Thread(target=load, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for node in clients + [server]:
+        node.stop()
+    return done, bus
+
+
+def bench_bus(args):
+    """Per-node and total throughput as client nodes are added to a bus."""
+    print(f"{'nodes':>5} {'req/s':>8} {'node min':>9} {'node max':>9} {'kB/s':>8} "
+          f"{'bus use':>8} {'collisions':>10}")
+    for count in args.nodes:
+        done, bus = run_bus(count, args, handler=lambda message, source: b"ok")
+        total = sum(done) / args.seconds
+        print(f"{count:>5} {total:>8.1f} {min(done) / args.seconds:>9.1f} "
+              f"{max(done) / args.seconds:>9.1f} {total * args.size / 1000:>8.1f} "
+              f"{bus.utilisation:>8.0%} {bus.collisions:>10}")
+
+
+def bench_workers(args):
+    """Bus server with a slow handler, run on the bus thread vs a worker pool."""
+    def slow(message, source=None):
+        time.sleep(args.handler_ms / 1000)
+        return b"ok"
+
+    print(f"{'workers':>7} {'req/s':>8} {'bus use':>8} {'max queue':>9} {'wait p99 ms':>11} "
+          f"{'handler p99 ms':>14}")
+    for workers in args.workers:
+        pool = WorkerPool(slow, workers, args.queue_size) if workers else None
+        done, bus = run_bus(args.clients, args, handler=slow, pool=pool)
+        stats = pool.stats if pool else {}
+        if pool:
+            pool.close()
+        print(f"{workers or 'inline':>7} {sum(done) / args.seconds:>8.1f} "
+              f"{bus.utilisation:>8.0%} {stats.get('max_queued', '-'):>9} "
+              f"{stats.get('wait_ms_p99', 0):>11.1f} {stats.get('handler_ms_p99', 0):>14.1f}")
+
+
+def serve_until_closed(server):
+    """Answer requests until the peer closes the transport."""
+    try:
+        while True:
+            server.receive_message()
+    except ConnectionError:
+        pass
+
+
+def bench_transport(args):
+    """Client and Server over pipe and socket transports, then ARQ file
+    transfers over a pipe with injected bit errors."""
+    print(f"{'transport':<16} {'format':<14} {'req/s':>8}")
+    formats = [("text", False, TEXT), ("framed text", True, TEXT),
+               ("framed binary", True, BINARY)]
+    for transport in (PipeTransport, SocketTransport):
+        for name, framed, encoding in formats:
+            client_end, server_end = transport.pair(byte_latency=args.byte_latency)
+            server = Server(transport=server_end, framed=framed)
+            client = Client(transport=client_end, framed=framed, encoding=encoding)
+            thread = threading.Thread(target=serve_until_closed, args=(server,))
+            thread.start()
+            # The banners would measure the terminal, not the link
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                seconds, _ = timed(lambda: [client.post(f"/data/{i % 10}", {"value": i})
+                                            if i % 4 == 0 else client.get(f"/data/{i % 10}")
+                                            for i in range(args.requests)])
+                client.cleanup()
+                thread.join()
+            server.cleanup()
+            print(f"{transport.__name__:<16} {name:<14} {args.requests / seconds:>8.0f}")
+
+    if not args.bit_error_rates:
+        return
+    print()
+    print(f"{'bit errors':>10} {'goodput kB/s':>12} {'retransmit':>10} {'flipped':>8} "
+          f"{'CRC drops':>9}")
+    data = test_pattern(args.transfer)
+    for rate in args.bit_error_rates:
+        sender_end, receiver_end = PipeTransport.pair(byte_latency=args.byte_latency,
+                                                      bit_error_rate=rate, seed=1)
+        # The pipe's pace, so ArqSender times its first ACK for this line
+        bit_period_us = args.byte_latency * 1_000_000 / 8
+        sender = Comm(transport=sender_end, framed=True, bit_period_us=bit_period_us)
+        receiver = Comm(transport=receiver_end, framed=True, bit_period_us=bit_period_us)
+        received = []
+        thread = threading.Thread(target=lambda: received.append(ArqReceiver(receiver).receive()))
+        thread.start()
+        stats = ArqSender(sender, chunk_size=args.chunk_size).send(data)
+        thread.join()
+        ok = received == [data]
+        errors = sender.frame_decoder.crc_errors + receiver.frame_decoder.crc_errors
+        print(f"{rate:>10.0e} {stats.goodput / 1000:>12.1f} {stats.retransmit_ratio:>10.1%} "
+              f"{sender_end.bit_errors + receiver_end.bit_errors:>8} {errors:>9}"
+              f"{'' if ok else '  (data differs)'}")
+        sender.cleanup()
+        receiver.cleanup()
+
+
+def timed(function, *args, **kwargs):
+    """Return (seconds, result)."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_storage(args):
+    """Startup from a snapshot, recovery from the log, and POST rates at
+    each durability level."""
+    directory = tempfile.mkdtemp(prefix="bench-storage-")
+    value = {"data": "x" * args.value_size}
+    try:
+        # No snapshots until we ask for one
+        options = dict(snapshot_records=2 * args.records + 1, lazy_bytes=args.lazy_bytes)
+        store = LogStorage(directory, durability=MEMORY, **options)
+        for i in range(args.records):
+            store[f"/data/{i}"] = dict(value, id=i)
+        seconds, _ = timed(store.close)
+        print(f"snapshot of {args.records} values: {seconds:.3f} s")
+
+        seconds, store = timed(LogStorage, directory, **options)
+        print(f"warm start from snapshot:   {seconds:.3f} s")
+        seconds, _ = timed(store.__getitem__, f"/data/{args.records - 1}")
+        print(f"first read of a value:      {seconds * 1e6:.0f} us")
+
+        # Rewrite everything so the next start has the whole log to replay
+        for i in range(args.records):
+            store.put(f"/data/{i}", dict(value, id=-i), MEMORY)
+        store.close(snapshot=False)
+        seconds, store = timed(LogStorage, directory, **options)
+        print(f"recovery, {args.records} log records: {seconds:.3f} s")
+
+        for durability in (MEMORY, WRITTEN, SYNCED):
+            count = min(args.records, 1000)
+            seconds, _ = timed(lambda: [store.put(f"/post/{i}", value, durability)
+                                        for i in range(count)])
+            print(f"{durability:<8} POSTs/s: {count / seconds:>9.0f}")
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the GPIO link')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ddr = commands.add_parser('ddr', help='SDR vs DDR at equal edge rates')
+    ddr.add_argument('--periods', type=int, nargs='+', default=[1000, 500, 250, 100],
+                     help='Clock periods in microseconds')
+    ddr.add_argument('--size', type=int, default=4096, help='Bytes per transfer')
+    ddr.add_argument('-d', '--data-pins', type=int, nargs='+', default=[23],
+                     help='Data lane GPIOs (at most 4 for DDR)')
+    ddr.set_defaults(run=bench_ddr)
+
+    messages = commands.add_parser('messages', help='Text vs binary message sizes')
+    messages.set_defaults(run=bench_messages)
+
+    storage = commands.add_parser('storage', help='Storage startup and recovery times')
+    storage.add_argument('--records', type=int, default=100000, help='Values to store')
+    storage.add_argument('--value-size', type=int, default=200, help='Bytes per value')
+    storage.add_argument('--lazy-bytes', type=int, default=1024,
+                         help='Values this large are read from the snapshot on demand')
+    storage.set_defaults(run=bench_storage)
+
+    parse = commands.add_parser('parse', help='Text request parser vs the original one')
+    parse.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                       help='Body sizes in bytes')
+    parse.add_argument('--repeat', type=int, default=5, help='Best of this many runs')
+    parse.set_defaults(run=bench_parse)
+
+    mux = commands.add_parser('mux', help='Small-request latency during a bulk transfer')
+    mux.add_argument('--rate', type=int, default=100000, help='Simulated link bits per second')
+    mux.add_argument('--bulk', type=int, default=65536, help='Bulk transfer bytes')
+    mux.add_argument('--interval', type=float, default=0.05,
+                     help='Seconds between small requests')
+    mux.add_argument('--round-bytes', type=int, default=ROUND_BYTES,
+                     help='Data bytes each side sends before handing over the line')
+    mux.set_defaults(run=bench_mux)
+
+    bus = commands.add_parser('bus', help='Throughput as nodes share a bus')
+    bus.add_argument('--nodes', type=int, nargs='+', default=[1, 2, 4, 8],
+                     help='Client node counts to try')
+    bus.add_argument('--rate', type=int, default=1000000, help='Simulated bus bits per second')
+    bus.add_argument('--size', type=int, default=512, help='Request bytes')
+    bus.add_argument('--seconds', type=float, default=3.0, help='Seconds per node count')
+    bus.add_argument('--depth', type=int, default=2, help='Requests each node keeps outstanding')
+    bus.set_defaults(run=bench_bus)
+
+    workers = commands.add_parser('workers', help='Slow handlers on a worker pool')
+    workers.add_argument('--workers', type=int, nargs='+', default=[0, 1, 4],
+                         help='Pool sizes to try; 0 runs the handler on the bus thread')
+    workers.add_argument('--clients', type=int, default=4, help='Client nodes')
+    workers.add_argument('--handler-ms', type=float, default=20.0,
+                         help='Milliseconds each request spends in the handler')
+    workers.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                         help='Requests that may wait for a worker')
+    workers.add_argument('--rate', type=int, default=1000000, help='Simulated bus bits per second')
+    workers.add_argument('--size', type=int, default=512, help='Request bytes')
+    workers.add_argument('--seconds', type=float, default=3.0, help='Seconds per pool size')
+    workers.add_argument('--depth', type=int, default=2,
+                         help='Requests each client keeps outstanding')
+    workers.set_defaults(run=bench_workers)
+
+    transport = commands.add_parser('transport', help='Client and Server over pipes and sockets')
+    transport.add_argument('--requests', type=int, default=2000, help='Requests per format')
+    transport.add_argument('--byte-latency', type=float, default=0.0,
+                           help='Seconds added per byte sent')
+    transport.add_argument('--bit-error-rates', type=float, nargs='*', default=[1e-5, 1e-4],
+                           help='Bit error rates to run ARQ transfers at')
+    transport.add_argument('--transfer', type=int, default=200000, help='ARQ transfer bytes')
+    transport.add_argument('--chunk-size', type=int, default=256, help='ARQ frame payload bytes')
+    transport.set_defaults(run=bench_transport)
+
+    args = parser.parse_args()
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Multi-drop bus: one server and several client boards on shared lines.
+
+Comm assumes one peer on the other end of the wires. On a bus every node
+hears every frame, so each frame's payload starts with a bus header:
+
+    destination (1) | source (1) | kind (1) | data
+
+    DATA    a chunk of a message from source to destination
+    LAST    the final chunk; the message is complete
+    TOKEN   the destination may now use the bus
+
+Destination BROADCAST reaches every node. A node ignores frames that are
+not addressed to it.
+
+Arbitration is token passing, so two nodes never drive the lines at once
+and no collision detection is needed. The holder sends up to quantum bytes
+of data and then, in the same transmission, the token to the next node; a
+node with nothing to send passes the token straight on. Clients always hand
+the token back to the server, which polls them in ring order:
+
+    server -> 1 -> server -> 2 -> server -> 3 -> server -> 1 ...
+
+so each request is answered in the server's next turn, and every client
+has the same time to queue its next request before its turn comes round.
+The server creates a new token if the bus stays silent for longer than
+any node can hold it (a node was unplugged while holding it, say). That is
+worked out from the port's bit period: on slow lines a single token hold
+takes seconds, and a new token sent during one would collide with it.
+
+Fairness: every client gets one turn per rotation, and the server shares
+its own turns between clients with pending responses one chunk at a time,
+so a client with a large response cannot starve the others.
+
+A node works over anything with send_frames(), receive_frame() and a
+bit_period_us, such as a framed Comm. To put a Server on the bus, give its
+node handler=server.process_message, which keeps the header tables of each
+client apart, or pool=server.worker_pool() to run requests from different
+clients side by side (see workers.py).
+SimulatedBus gives several nodes in one process, timed by the bit rate, and
+counts busy time so bus utilisation can be measured as nodes are added.
+"""
+
+from collections import deque
+from concurrent.futures import Future
+import queue
+import struct
+import threading
+import time
+from connection import HEADER, TRAILER, Frame, FrameHeader
+
+BUS_HEADER = struct.Struct(">BBB")   # destination, source, kind
+
+DATA = 1
+LAST = 2
+TOKEN = 3
+
+SERVER_ADDRESS = 0
+BROADCAST = 0xFF
+
+CHUNK_SIZE = 1024        # Largest data chunk per frame
+QUANTUM = 4096           # Data bytes a node sends per token hold
+TOKEN_TIMEOUT = 0.5      # Least seconds of silence before the server makes a new token
+TOKEN_MARGIN = 2         # ... otherwise this many longest token holds
+READ_TIMEOUT = 0.1       # Seconds per receive, so the node thread can stop
+
+
+class BusNode:
+    def __init__(self, port, address, ring, handler=None, quantum=QUANTUM, pool=None,
+                 token_timeout=None):
+        """port carries the frames; ring lists every address on the bus,
+        server first, clients in polling order. A node with a handler answers each
+        complete message with handler(message, source) -> response bytes; other
+        nodes send requests with send_message(). With pool, a
+        workers.WorkerPool, the pool's handler answers instead, on its own
+        threads and in order per client, while this node keeps the bus
+        moving. token_timeout is the silence in seconds after which the
+        server makes a new token; by default it is derived from the port's
+        bit_period_us (see hold_seconds)."""
+        if address not in ring or not 0 <= address < BROADCAST:
+            raise ValueError(f"Bad bus address: {address}")
+        self.port = port
+        self.address = address
+        self.ring = list(ring)
+        self.handler = handler
+        self.quantum = quantum
+        self.pool = pool
+        if token_timeout is None:
+            token_timeout = max(TOKEN_TIMEOUT, TOKEN_MARGIN * self.hold_seconds())
+        self.token_timeout = token_timeout
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.bytes_sent = 0
+        self.token_holds = 0
+
+        self._outbox = {}          # destination -> deque of bytearrays to send
+        self._order = deque()      # Destinations in scheduling order
+        self._inbox = {}           # source -> bytearray being received
+        self._waiting = {}         # destination -> deque of Futures for responses
+        self._seq = 0
+        self._polled = 0           # Server: clients polled so far
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    @property
+    def is_server(self):
+        return self.address == self.ring[0]
+
+    def hold_seconds(self):
+        """Longest a node can keep the bus: quantum bytes of data, the most
+        frames they can be cut into and the token, at the port's bit
+        period."""
+        frames = self.quantum // CHUNK_SIZE + len(self.ring) + 1
+        size = self.quantum + frames * (HEADER.size + TRAILER.size + BUS_HEADER.size)
+        return size * 8 * self.port.bit_period_us / 1_000_000
+
+    def _next_address(self):
+        """Where the token goes after our turn."""
+        if not self.is_server:
+            return self.ring[0]
+        clients = self.ring[1:] or self.ring
+        address = clients[self._polled % len(clients)]
+        self._polled += 1
+        return address
+
+    def request(self, message, destination=SERVER_ADDRESS):
+        """Queue a message for the next token. Returns a Future that
+        resolves to the response."""
+        future = Future()
+        with self._lock:
+            self._waiting.setdefault(destination, deque()).append(future)
+            self._queue(destination, message)
+        return future
+
+    def send_message(self, message, destination=SERVER_ADDRESS, timeout=None):
+        """Send a message and wait for its response."""
+        return self.request(message, destination).result(timeout)
+
+    def start(self):
+        """Serve the bus in a background thread. The server sends the first
+        token."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def _queue(self, destination, message):
+        if destination not in self._outbox:
+            self._outbox[destination] = deque()
+            self._order.append(destination)
+        self._outbox[destination].append(bytearray(message))
+
+    # Bus side
+
+    def _run(self):
+        if self.is_server:
+            self._take_turn()
+        silent_since = time.monotonic()
+        while self._running:
+            try:
+                frame = self.port.receive_frame(READ_TIMEOUT)
+            except TimeoutError:
+                if (self.is_server
+                        and time.monotonic() - silent_since > self.token_timeout):
+                    print("Bus: token lost, sending a new one")
+                    self._take_turn()
+                    silent_since = time.monotonic()
+                continue
+            silent_since = time.monotonic()
+            if self._handle(frame.payload):
+                self._take_turn()
+
+    def _handle(self, payload):
+        """Take in one frame. Returns True when we were given the token."""
+        if len(payload) < BUS_HEADER.size:
+            return False
+        destination, source, kind = BUS_HEADER.unpack_from(payload)
+        if destination not in (self.address, BROADCAST):
+            return False
+        if kind == TOKEN:
+            return True
+        self._inbox.setdefault(source, bytearray()).extend(payload[BUS_HEADER.size:])
+        if kind == LAST:
+            self._deliver(source, bytes(self._inbox.pop(source)))
+        return False
+
+    def _deliver(self, source, message):
+        self.messages_received += 1
+        if self.pool is not None:
+            # Blocks while the pool's queue is full, holding the token
+            future = self.pool.submit(source, message)
+            future.add_done_callback(lambda done: self._reply(source, done))
+            return
+        if self.handler is not None:
+            response = self.handler(message, source)
+            with self._lock:
+                self._queue(source, response)
+            return
+        with self._lock:
+            waiting = self._waiting.get(source)
+            future = waiting.popleft() if waiting else None
+        if future is not None:
+            future.set_result(message)
+
+    def _reply(self, source, future):
+        """Queue the response a pool worker produced."""
+        # The pool reports a failed handler; still answer the client
+        response = b"" if future.exception() else future.result()
+        with self._lock:
+            self._queue(source, response)
+
+    def _take_turn(self):
+        """Send up to quantum bytes, then pass the token on."""
+        self.token_holds += 1
+        with self._lock:
+            frames = self._schedule()
+        frames.append(self._frame(self._next_address(), TOKEN))
+        self.port.send_frames(frames)
+
+    def _schedule(self):
+        """Data frames for one token hold: one chunk per destination in turn."""
+        frames = []
+        budget = self.quantum
+        while budget > 0 and self._order:
+            destination = self._order.popleft()
+            pending = self._outbox[destination]
+            message = pending[0]
+            size = min(len(message), CHUNK_SIZE, budget)
+            data = bytes(message[:size])
+            del message[:size]
+            budget -= size
+            self.bytes_sent += size
+            if message:
+                frames.append(self._frame(destination, DATA, data))
+            else:
+                frames.append(self._frame(destination, LAST, data))
+                pending.popleft()
+                self.messages_sent += 1
+            if pending:
+                self._order.append(destination)
+            else:
+                del self._outbox[destination]
+        return frames
+
+    def _frame(self, destination, kind, data=b""):
+        frame = Frame(FrameHeader(seq=self._seq),
+                      BUS_HEADER.pack(destination, self.address, kind) + data)
+        self._seq = (self._seq + 1) & 0xFFFF
+        return frame
+
+
+class SimulatedBus:
+    """Shared medium for BusNodes in one process. A transmission takes as
+    long as bits_per_second says and reaches every other port. Overlapping
+    transmissions are counted as collisions."""
+
+    def __init__(self, bits_per_second):
+        self.bits_per_second = bits_per_second
+        self.busy_seconds = 0.0
+        self.bytes = 0
+        self.collisions = 0
+        self.started = time.monotonic()
+        self._ports = []
+        self._lock = threading.Lock()
+
+    def port(self):
+        port = _BusPort(self)
+        self._ports.append(port)
+        return port
+
+    @property
+    def utilisation(self):
+        """Fraction of the time since creation that the bus was carrying data."""
+        return self.busy_seconds / max(time.monotonic() - self.started, 1e-9)
+
+    def _transmit(self, sender, frames):
+        size = sum(len(frame.encode()) for frame in frames)
+        if not self._lock.acquire(blocking=False):
+            self.collisions += 1
+            self._lock.acquire()
+        try:
+            seconds = size * 8 / self.bits_per_second
+            time.sleep(seconds)
+            self.busy_seconds += seconds
+            self.bytes += size
+        finally:
+            self._lock.release()
+        for port in self._ports:
+            if port is not sender:
+                for frame in frames:
+                    port.inbox.put(frame)
+
+
+class _BusPort:
+    def __init__(self, bus):
+        self.bus = bus
+        self.inbox = queue.Queue()
+
+    @property
+    def bit_period_us(self):
+        return 1_000_000 / self.bus.bits_per_second
+
+    def send_frames(self, frames):
+        self.bus._transmit(self, frames)
+
+    def receive_frame(self, timeout=None):
+        try:
+            return self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Timed out waiting for a frame") from None
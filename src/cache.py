@@ -0,0 +1,161 @@
+"""
+Response caches and JSON merge patches for conditional GETs.
+
+The server tags every stored value with an ETag. The client keeps the last
+response per path in a size-bounded LRU and sends If-None-Match on the next
+GET, so an unchanged value costs a tiny 304 Not Modified instead of the
+whole body. With "A-IM: merge-patch" the server may instead answer 226 IM
+Used with an RFC 7386 JSON merge patch against the client's cached version,
+when that is smaller than the new value.
+
+The server uses the same LRUCache for its encoded responses, so repeated
+GETs of an unchanged value skip serialising, compressing and encoding.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import json
+import zlib
+
+MERGE_PATCH = "merge-patch"
+DEFAULT_CACHE_BYTES = 64 * 1024
+
+
+@dataclass
+class CachedResponse:
+    etag: str
+    response: dict     # Parsed response as returned by Client._parse_response
+
+    @property
+    def size(self):
+        return len(self.response['body'])
+
+
+def make_etag(body):
+    """Strong ETag for a body, bytes or an iterable of bytes chunks. Derived
+    from the content, so it stays valid across server restarts."""
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        body = [body]
+    crc = 0
+    for chunk in body:
+        crc = zlib.crc32(chunk, crc)
+    return f'"{crc:08x}"'
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match value names etag (or is "*")."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class LRUCache:
+    """Mapping that evicts least recently used entries beyond max_bytes.
+    sizeof(value) gives the size charged for each entry. Counts hits,
+    misses and evictions; see stats."""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        self.pop(key)
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return  # Would evict everything else and still not fit
+        self._entries[key] = value
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= self.sizeof(evicted)
+            self.evictions += 1
+
+    def pop(self, key):
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self.bytes -= self.sizeof(value)
+        return value
+
+    def remove_if(self, predicate):
+        """Drop every entry whose key satisfies predicate."""
+        for key in [key for key in self._entries if predicate(key)]:
+            self.pop(key)
+
+    @property
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.bytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def make_merge_patch(old, new):
+    """Return a merge patch turning old into new, or None if there is none
+    worth sending (not both objects, or a null value that a patch would
+    read as a deletion)."""
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return None
+    patch = {}
+    for key in old.keys() - new.keys():
+        patch[key] = None
+    for key, value in new.items():
+        if key in old and old[key] == value:
+            continue
+        if value is None:
+            return None
+        if key in old and isinstance(value, dict) and isinstance(old[key], dict):
+            value = make_merge_patch(old[key], value)
+            if value is None:
+                return None
+        elif _has_null(value):
+            return None
+        patch[key] = value
+    return patch
+
+
+def _has_null(value):
+    if value is None:
+        return True
+    if isinstance(value, dict):
+        return any(_has_null(v) for v in value.values())
+    return False
+
+
+def apply_merge_patch(target, patch):
+    """RFC 7386: apply a merge patch to a JSON value."""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+def patch_body(old_body, patch_body):
+    """Apply a JSON merge patch body to a cached JSON body (both str)."""
+    return json.dumps(apply_merge_patch(json.loads(old_body), json.loads(patch_body)))
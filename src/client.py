@@ -1,95 +1,237 @@
 """
 Client implementation using the GPIO communication protocol.
-Supports sending HTTP-like requests.
+Supports sending HTTP-like requests, as text or in the compact binary
+encoding from messages.py. In framed mode bodies are compressed both ways
+(see compression.py).
+
+GET responses that carry an ETag are kept in a size-bounded LRU cache and
+revalidated with If-None-Match, so polling an unchanged value costs only a
+304 Not Modified (see cache.py).
+
+Large bodies can be streamed in framed mode: post_stream() sends a body
+chunk by chunk as an iterable produces it, and get_stream() returns the
+body as an iterator of chunks read off the link as they arrive.
 """
 
-from comm import Comm
+from dataclasses import replace
+from comm import Comm, Stream
+from messages import (TEXT, BINARY, CHUNKED, Request, DynamicTable, encode_request,
+                      decode_response, encode_text_request, encoding_of, header)
+from compression import ACCEPT, compress, decompress
+from cache import (MERGE_PATCH, DEFAULT_CACHE_BYTES, CachedResponse, LRUCache,
+                   patch_body)
+from transport import SocketTransport
+from textparser import MessageParser
+from urllib.parse import urlencode
+import argparse
 import time
 import json
 
 class Client(Comm):
-    def __init__(self, data_pin=23, clock_pin=24):
+    def __init__(self, data_pin=23, clock_pin=24, train=False, encoding=TEXT,
+                 cache_bytes=DEFAULT_CACHE_BYTES, **kwargs):
+        """encoding is messages.TEXT or messages.BINARY. The binary encoding
+        needs framed=True; if the server turns out not to understand it, the
+        client falls back to text. cache_bytes bounds the bodies kept in the
+        response cache; 0 turns the cache off."""
         # Initialize with latch pin for shift register display
-        super().__init__(data_pin, clock_pin, latch_pin=25)
+        super().__init__(data_pin, clock_pin, latch_pin=25, **kwargs)
+        if encoding == BINARY and not self.framed:
+            raise ValueError("The binary encoding needs framed=True")
+        self.encoding = encoding
+        self._encoding_confirmed = encoding == TEXT
         
-    def get(self, path, headers=None):
-        """Send a GET request."""
-        if headers is None:
-            headers = {}
-            
-        # Build request
-        request = f"GET {path} HTTP/1.1\n"
-        for key, value in headers.items():
-            request += f"{key}: {value}\n"
-        request += "\n"
+        # Header tables of this connection (binary encoding only)
+        self.tx_table = DynamicTable()
+        self.rx_table = DynamicTable()
         
-        # Print request
-        print("\nSending request:")
-        print("=" * 40)
-        print(request, end="")
-        print("\n" + "=" * 40)
+        # Codings the server said it accepts for request bodies
+        self.server_accepts = None
+        
+        # Last GET response per path, for conditional requests
+        self.cache = LRUCache(cache_bytes, sizeof=lambda entry: entry.size) if cache_bytes else None
         
-        # Send request and get response
-        response = self.send_message(request.encode('utf-8'))
-        return self._parse_response(response)
+        # Find the fastest reliable rate before the first request
+        if train:
+            self.train_link()
+        
+    def get(self, path, headers=None):
+        """Send a GET request."""
+        return self.request(get_request(path, headers))
         
     def post(self, path, data, headers=None):
         """Send a POST request with JSON data."""
-        if headers is None:
-            headers = {}
+        return self.request(post_request(path, data, headers))
+        
+    def list(self, prefix, limit=None, after=None, values=False):
+        """List the keys under prefix (with values=True, the values too), one
+        page per call. The body's "next" is the after of the next page."""
+        return self.request(list_request(prefix, limit, after, values))
+        
+    def request(self, request):
+        """Send a Request and return the parsed response."""
+        return self.batch([request])[0]
+        
+    def batch(self, requests):
+        """Send several Requests in one transmission and return their parsed
+        responses, in order, each with its own status. The server answers
+        them all in one transmission too (framed mode; otherwise every
+        request still takes its own round trip)."""
+        requests = [self._conditional(request) for request in requests]
+        messages = []
+        for request in requests:
+            self._print_request(request)
             
-        # Convert data to JSON
-        body = json.dumps(data)
-        
-        # Build request
-        request = f"POST {path} HTTP/1.1\n"
-        headers['Content-Type'] = 'application/json'
-        headers['Content-Length'] = str(len(body))
-        for key, value in headers.items():
-            request += f"{key}: {value}\n"
-        request += "\n"
-        request += body
-        
-        # Print request
+            # Compressed bodies may contain null bytes, so only when framed
+            if self.framed:
+                request = self._compress_request(request)
+            messages.append(request)
+            
+        # Send requests and get responses
+        responses = self.send_messages([encode_request(request, self.encoding, self.tx_table)
+                                        for request in messages])
+        
+        # A server that only speaks text answers a binary request in text
+        if not self._encoding_confirmed:
+            if encoding_of(responses[0]) == BINARY:
+                self._encoding_confirmed = True
+            else:
+                print("Server does not understand the binary encoding, using text")
+                self.encoding = TEXT
+                self._encoding_confirmed = True
+                # The binary attempt filled tables the server never saw
+                self.tx_table = DynamicTable()
+                self.rx_table = DynamicTable()
+                responses = self.send_messages([encode_request(request, TEXT)
+                                                for request in messages])
+                
+        # Decode them all before _revalidate may make another round trip,
+        # which moves the header tables on
+        parsed = [self._parse_response(response) for response in responses]
+        return [self._revalidate(request, response)
+                for request, response in zip(requests, parsed)]
+        
+    def post_stream(self, path, chunks, headers=None):
+        """POST a body produced chunk by chunk (bytes or str) by an iterable,
+        without building it in memory first. Needs framed=True."""
+        headers = dict(headers or {})
+        headers['Transfer-Encoding'] = CHUNKED
+        request = self._compress_request(Request("POST", path, headers))
+        self._print_request(request, streamed=True)
+        chunks = (chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                  for chunk in chunks)
+        head = encode_request(request, self._stream_encoding(), self.tx_table)
+        return self._parse_response(self.send_message(Stream(head, chunks)))
+        
+    def get_stream(self, path, headers=None):
+        """GET with the body as an iterator of bytes chunks, read from the
+        link as the caller iterates. Read it to the end (or leave it; the
+        next request discards the rest) before using the client again."""
+        headers = dict(headers or {})
+        headers['TE'] = CHUNKED
+        request = get_request(path, headers)
+        self._print_request(request)
+        response = self.send_message(encode_request(request, self._stream_encoding(),
+                                                    self.tx_table))
+        if not isinstance(response, Stream):
+            parsed = self._parse_response(response)
+            parsed['body'] = iter([parsed['body'].encode('utf-8')])
+            return parsed
+        parsed = self._parse_response(response.head)
+        parsed['body'] = response.chunks
+        return parsed
+        
+    def _stream_encoding(self):
+        """Streams cannot be resent in text, so only use binary once the
+        server has answered in it."""
+        return self.encoding if self._encoding_confirmed else TEXT
+        
+    def _message_parser(self):
+        return MessageParser(response=True)
+        
+    def _print_request(self, request, streamed=False):
         print("\nSending request:")
         print("=" * 40)
-        print(request, end="")
+        if streamed:
+            request = replace(request, body=b"<streamed body>")
+        print(encode_text_request(request).decode('utf-8'), end="")
         print("\n" + "=" * 40)
         
-        # Send request and get response
-        response = self.send_message(request.encode('utf-8'))
-        return self._parse_response(response)
+    def pipeline(self):
+        """Collect requests and send them as one batch, e.g.
+        
+            with client.pipeline() as p:
+                p.get("/data/a")
+                p.post("/data/b", {"value": 1})
+            print(p.results)
+        """
+        return Pipeline(self)
+        
+    def _conditional(self, request):
+        """Make a GET for a cached path conditional on our cached version."""
+        if (self.cache is None or request.method != "GET"
+                or header(request.headers, 'If-None-Match')):
+            return request
+        entry = self.cache.get(request.path)
+        if entry is None:
+            return request
+        headers = dict(request.headers)
+        headers['If-None-Match'] = entry.etag
+        headers['A-IM'] = MERGE_PATCH
+        return replace(request, headers=headers)
+        
+    def _revalidate(self, request, response):
+        """Answer a 304 or 226 from the cache and cache fresh GET responses."""
+        if self.cache is None or request.method != "GET":
+            return response
+        status = response['status_code']
+        etag = header(response['headers'], 'ETag')
+        if status in (226, 304):
+            entry = self.cache.get(request.path)
+            if entry is None:
+                return response
+            if status == 304:
+                return dict(entry.response)
+            try:
+                body = patch_body(entry.response['body'], response['body'])
+            except ValueError:
+                # Cannot apply it, fetch the whole value instead
+                self.cache.pop(request.path)
+                return self.get(request.path)
+            headers = {k: v for k, v in response['headers'].items() if k.lower() != 'im'}
+            response = dict(response, status_code=200, status_text='OK',
+                            headers=headers, body=body)
+        if status in (200, 226) and etag:
+            self.cache.put(request.path, CachedResponse(etag, response))
+        elif status != 304:
+            self.cache.pop(request.path)
+        return response
+        
+    def _compress_request(self, request):
+        """Ask for compressed responses and compress our own body if the
+        server has told us what it accepts."""
+        headers = dict(request.headers)
+        headers.setdefault('Accept-Encoding', ACCEPT)
+        body, coding = compress(request.body, self.server_accepts)
+        if coding:
+            headers['Content-Encoding'] = coding
+            if 'Content-Length' in headers:
+                headers['Content-Length'] = str(len(body))
+        return replace(request, headers=headers, body=body)
         
     def _parse_response(self, response):
         """Parse HTTP-like response."""
         try:
-            # Split into lines
-            lines = response.decode('utf-8').split('\n')
-            
-            # Parse status line
-            status_line = lines[0]
-            version, status_code, status_text = status_line.split(' ', 2)
-            
-            # Parse headers
-            headers = {}
-            body = ""
-            in_body = False
-            for line in lines[1:]:
-                if not in_body and line.strip() == "":
-                    in_body = True
-                    continue
-                if in_body:
-                    body += line + "\n"
-                else:
-                    if ":" in line:
-                        key, value = line.split(":", 1)
-                        headers[key.strip()] = value.strip()
-                        
+            parsed = decode_response(response, self.rx_table)
+            accepts = header(parsed.headers, 'Accept-Encoding')
+            if accepts:
+                self.server_accepts = accepts
+            body = decompress(parsed.body, header(parsed.headers, 'Content-Encoding'))
             return {
-                'status_code': int(status_code),
-                'status_text': status_text,
-                'headers': headers,
-                'body': body.strip()
+                'status_code': parsed.status,
+                'status_text': parsed.reason,
+                'headers': parsed.headers,
+                'body': str(body, 'utf-8')
             }
         except Exception as e:
             return {
@@ -99,13 +241,81 @@ class Client(Comm):
                 'body': f"Error parsing response: {str(e)}"
             }
             
+def get_request(path, headers=None):
+    """Build a GET Request."""
+    return Request("GET", path, dict(headers or {}))
+    
+def list_request(prefix, limit=None, after=None, values=False):
+    """Build a GET Request for one page of the keys under prefix."""
+    query = {'list': ''}
+    if limit is not None:
+        query['limit'] = limit
+    if after is not None:
+        query['after'] = after
+    if values:
+        query['values'] = ''
+    return Request("GET", f"{prefix}?{urlencode(query)}")
+    
+def post_request(path, data, headers=None):
+    """Build a POST Request with a JSON body."""
+    headers = dict(headers or {})
+    
+    # Convert data to JSON
+    body = json.dumps(data)
+    headers['Content-Type'] = 'application/json'
+    headers['Content-Length'] = str(len(body))
+    return Request("POST", path, headers, body.encode('utf-8'))
+    
+class Pipeline:
+    """Requests queued for one batch; see Client.pipeline()."""
+    
+    def __init__(self, client):
+        self.client = client
+        self.requests = []
+        self.results = []
+        
+    def get(self, path, headers=None):
+        """Queue a GET request."""
+        self.requests.append(get_request(path, headers))
+        return self
+        
+    def list(self, prefix, limit=None, after=None, values=False):
+        """Queue one page of a key listing."""
+        self.requests.append(list_request(prefix, limit, after, values))
+        return self
+        
+    def post(self, path, data, headers=None):
+        """Queue a POST request with JSON data."""
+        self.requests.append(post_request(path, data, headers))
+        return self
+        
+    def execute(self):
+        """Send the queued requests and return their parsed responses."""
+        if self.requests:
+            self.results = self.client.batch(self.requests)
+            self.requests = []
+        return self.results
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.execute()
+            
 if __name__ == "__main__":
-    client = Client()
+    parser = argparse.ArgumentParser(description='Send requests over GPIO pins')
+    parser.add_argument('--socket',
+                        help='Connect to a server on a Unix socket at this path instead')
+    args = parser.parse_args()
+    
+    transport = SocketTransport.connect(args.socket) if args.socket else None
+    client = Client(transport=transport)
     
     try:
         while True:
             # Get command from user
-            command = input("\nEnter command (get/post/quit): ").lower()
+            command = input("\nEnter command (get/post/list/batch/quit): ").lower()
             
             if command == 'quit':
                 break
@@ -114,6 +324,19 @@ if __name__ == "__main__":
                 response = client.get(path)
                 print(f"\nStatus: {response['status_code']} {response['status_text']}")
                 print(f"Body: {response['body']}")
+            elif command == 'list':
+                prefix = input("Enter prefix (e.g., /data/): ")
+                response = client.list(prefix)
+                print(f"\nStatus: {response['status_code']} {response['status_text']}")
+                print(f"Body: {response['body']}")
+            elif command == 'batch':
+                paths = input("Enter paths to GET, separated by spaces: ").split()
+                with client.pipeline() as pipeline:
+                    for path in paths:
+                        pipeline.get(path)
+                for path, response in zip(paths, pipeline.results):
+                    print(f"\n{path}: {response['status_code']} {response['status_text']}")
+                    print(f"Body: {response['body']}")
             elif command == 'post':
                 path = input("Enter path (e.g., /data/key): ")
                 print("Enter JSON data (press Enter twice when done):")
@@ -6,31 +6,180 @@ Protocol:
 3. Server switches to send mode, client switches to receive mode
 4. Server sends response, ends with null byte
 5. Both return to default states
+
+Line turnaround (only at message boundaries):
+- The side that just sent a terminator releases data and clock at once
+  (drive LOW, then switch to INPUT with pull-down).
+- The side taking the line waits TURNAROUND_GUARD, checks the clock is idle
+  LOW, and only then switches its pins to OUTPUT.
+
+Batches (framed mode only): send_messages() sends several messages as
+frames in one transmission, every frame but the last marked FLAG_MORE. The
+peer processes them in order and answers with the same number of response
+frames, again in one transmission, so N messages cost one turnaround.
+
+Streams (framed mode only): a Stream is a message head followed by body
+chunks that are produced or consumed while the transfer is under way. The
+head frame and every chunk frame but the last are marked FLAG_CHUNK, and
+the sender keeps the line until the last one, so a multi-megabyte body is
+never held in memory as one piece. The receiver gets a ChunkReader that
+reads chunk frames as it is iterated. Framing already delimits the chunks,
+so unlike HTTP's chunked coding they carry no size lines. If the sender
+cannot produce the rest of the body, it ends the stream with a frame
+marked FLAG_ABORT carrying the reason, and the ChunkReader raises
+StreamAborted instead of ending normally, so a cut-off body is never
+mistaken for a whole one.
+
+With line_code="manchester" there is no clock line: data is self-clocking
+(see linecode.py), the data pin is the only one turned around, and the
+clock pin is left free.
+
+Transports: every byte goes through self.transport (see transport.py). The
+default GpioTransport is the pin code in this class; a pipe or socket
+transport runs the same protocol without pigpio.
 """
 
 import pigpio
 import time
+from contextlib import closing
+from dataclasses import dataclass
+from waveform import WaveformSender, DEFAULT_BIT_PERIOD_US
+from notify import NotifyReceiver
+from linecode import ManchesterSender, ManchesterDecoder
+from connection import Frame, FrameHeader, FrameDecoder
+from training import LinkTrainer, control_type
+from lanes import LaneMap
+from transport import Transport
+from textparser import MessageError
+
+# Link directions for the half-duplex state machine
+LINK_TX = "tx"
+LINK_RX = "rx"
+
+TURNAROUND_GUARD = 0.002     # Seconds to let the peer release the line
+TURNAROUND_TIMEOUT = 1.0     # Give up if the clock is still driven after this
+BIT_DELAY = 0.01             # Seconds between edges when bit-banging
+
+FLAG_MORE = 0x40             # Another message of the same batch follows
+FLAG_CHUNK = 0x08            # Another chunk of the same streamed message follows
+FLAG_ABORT = 0x80            # The stream ends early; the payload says why
+RESPONSE_DELAY = 0.01        # Seconds the GPIO responder gives the peer to turn around
+
+@dataclass
+class Stream:
+    """A streamed message: head bytes, then an iterable of body chunks."""
+    head: bytes
+    chunks: object
+
+class StreamAborted(Exception):
+    """The sender gave up on a stream before its last chunk."""
+
+class ChunkReader:
+    """Iterates over the chunks of a received stream as their frames arrive.
+    The stream must be read to the end before the link is used again;
+    drain() discards whatever is left."""
+    
+    def __init__(self, comm):
+        self.comm = comm
+        self.done = False
+        
+    def __iter__(self):
+        return self
+        
+    def __next__(self):
+        while not self.done:
+            frame = self.comm.receive_frame()
+            self.done = not frame.header.flags & FLAG_CHUNK
+            if frame.header.flags & FLAG_ABORT:
+                raise StreamAborted(str(frame.payload, 'utf-8', 'replace'))
+            if frame.payload:
+                return frame.payload
+        raise StopIteration
+        
+    def drain(self):
+        try:
+            for _ in self:
+                pass
+        except StreamAborted:
+            pass
 
 class Comm:
-    def __init__(self, data_pin=23, clock_pin=24, latch_pin=None):
+    def __init__(self, data_pin=23, clock_pin=24, latch_pin=None,
+                 waveform=False, bit_period_us=DEFAULT_BIT_PERIOD_US, notify=False,
+                 framed=False, data_pins=None, ddr=False, line_code=None, transport=None):
         """Initialize communication with default pins (23 for data, 24 for clock).
-        latch_pin is optional and only used for shift register display."""
-        self.data_pin = data_pin
-        self.clock_pin = clock_pin
+        latch_pin is optional and only used for shift register display.
+        With waveform=True messages are sent as pigpio DMA waveforms
+        with a bit period of bit_period_us instead of bit-banged writes.
+        With notify=True messages are received in bulk from the pigpio
+        notification pipe instead of polling the clock pin.
+        With framed=True messages travel as length-prefixed, CRC-checked
+        frames (see connection.Frame) instead of null-terminated strings,
+        so binary payloads are allowed; it is required for link training.
+        data_pins optionally lists 2, 4 or 8 data lanes sharing the clock.
+        The link starts on the first lane only; link training checks the
+        lanes and widens the bus (see set_lanes).
+        With ddr=True double data rate is offered to the peer during link
+        training; the link only uses it once both sides have agreed.
+        line_code="manchester" sends self-clocking Manchester code on
+        data_pin alone; it needs waveform and notify and a fixed, agreed
+        bit_period_us, and leaves clock_pin unused.
+        transport replaces the pins with another byte transport, e.g. a
+        transport.PipeTransport; the pin options are then ignored."""
+        if line_code not in (None, "manchester"):
+            raise ValueError(f"Unknown line code: {line_code}")
+        if line_code and (not waveform or not notify or data_pins):
+            raise ValueError("Manchester code needs waveform and notify on one data pin")
+        self.line_code = line_code
+        self.data_pins = list(data_pins) if data_pins else [data_pin]
+        LaneMap(self.data_pins)  # Rejects unsupported lane counts early
+        self.data_pin = self.data_pins[0]
+        self.lanes = LaneMap([self.data_pin])
+        self.clock_pin = None if line_code else clock_pin
         self.latch_pin = latch_pin
         
-        # Initialize pigpio
+        # Turnaround bookkeeping
+        self.direction = None
+        self.turnarounds = 0
+        self.turnaround_seconds = 0.0
+        
+        # Bit timing; link training may change it later
+        self.bit_period_us = bit_period_us
+        self.bit_delay = BIT_DELAY
+        
+        # Double data rate: offered, and actually in use
+        self.ddr_capable = ddr
+        self.ddr = False
+        
+        self.pi = None
+        self.wave = None
+        self.notify = None
+        self._notifying = False  # Notifications running, see _receive_chunks
+        self._rx_pending = bytearray()  # Bytes decoded past the last terminator
+        if transport is None:
+            self._init_pins(waveform, notify)
+            transport = GpioTransport(self)
+        self.transport = transport
+            
+        # Framing state
+        self.framed = framed
+        self.tx_seq = 0
+        self.frame_decoder = FrameDecoder()
+        self._rx_frames = []  # Frames decoded past the one last returned
+        self.frames_received = 0
+        self._open_stream = None  # ChunkReader of a received stream not yet read
+        
+        self.trainer = LinkTrainer(self)
+        
+    def _init_pins(self, waveform, notify):
+        """Set up pigpio, the pins and the optional DMA sender and
+        notification receiver for the GPIO transport."""
         self.pi = pigpio.pi()
         if not self.pi.connected:
             raise RuntimeError("Could not connect to pigpio daemon")
             
-        # Set up pins
-        self.pi.set_mode(self.clock_pin, pigpio.OUTPUT)
-        self.pi.set_mode(self.data_pin, pigpio.OUTPUT)
-        
-        # Initialize pins to LOW
-        self.pi.write(self.clock_pin, 0)
-        self.pi.write(self.data_pin, 0)
+        # Start released, like a server waiting for a request
+        self._set_direction(LINK_RX)
         
         # Set up latch pin if provided
         if self.latch_pin is not None:
@@ -39,121 +188,494 @@ class Comm:
             
         time.sleep(0.01)  # Give time for pins to stabilize
         
+        if self.line_code:
+            self.wave = ManchesterSender(self.pi, self.data_pin, self.bit_period_us)
+        elif waveform:
+            self.wave = WaveformSender(self.pi, self.data_pin, self.clock_pin,
+                                       self.latch_pin, self.bit_period_us,
+                                       lanes=self.lanes)
+            
+        if self.line_code:
+            self.notify = NotifyReceiver(self.pi, self.data_pin, None,
+                                         decoder=ManchesterDecoder(self.data_pin,
+                                                                   self.bit_period_us))
+        elif notify:
+            self.notify = NotifyReceiver(self.pi, self.data_pin, self.clock_pin,
+                                         self.lanes)
+            
+    def set_bit_period(self, bit_period_us):
+        """Change the bit period used for sending."""
+        self.bit_period_us = bit_period_us
+        self.bit_delay = bit_period_us / 2_000_000
+        if self.wave is not None:
+            self.wave.set_bit_period(bit_period_us)
+        if self.line_code:
+            # Without a clock line the receiver must know the period too
+            self.notify.decoder.set_bit_period(bit_period_us)
+            self._restart_notify()
+            
+    def set_lanes(self, lanes):
+        """Use the data lanes at the given indices into data_pins.
+        Both sides must switch together; link training does this.
+        DDR is dropped on a bus too wide for it (8 lanes)."""
+        self.lanes = LaneMap([self.data_pins[i] for i in lanes])
+        if self.lanes.symbols_per_byte % 2:
+            self.ddr = False
+        if self.wave is not None:
+            self.wave.ddr = self.ddr
+            self.wave.set_lanes(self.lanes)
+        if self.notify is not None:
+            self.notify.set_ddr(self.ddr)
+            self.notify.set_lanes(self.lanes)
+            self._restart_notify()
+            
+    def set_ddr(self, ddr):
+        """Sample on both clock edges (ddr=True) or on rising edges only.
+        Both sides must switch together; link training does this."""
+        if ddr and self.lanes.symbols_per_byte % 2:
+            raise ValueError("DDR needs at most 4 data lanes")
+        self.ddr = ddr
+        if self.wave is not None:
+            self.wave.set_ddr(ddr)
+        if self.notify is not None:
+            self.notify.set_ddr(ddr)
+            self._restart_notify()
+            
+    def _restart_notify(self):
+        """Make the next receive begin notifications afresh, so decoder
+        changes take effect."""
+        if self._notifying:
+            self.notify.pause()
+            self._notifying = False
+            
+    def train_link(self):
+        """Run link training with the peer and switch to the agreed period."""
+        if not isinstance(self.transport, GpioTransport):
+            raise ValueError("Link training needs the GPIO transport")
+        if self.line_code:
+            raise ValueError("Link training needs a clock line; set bit_period_us instead")
+        return self.trainer.train()
+        
+    @property
+    def link_rate(self):
+        """The bit period in microseconds currently used on the link."""
+        return self.bit_period_us
+        
+    def _set_direction(self, direction):
+        """Turn the half-duplex link around. No-op if already facing that way."""
+        if direction == self.direction:
+            return
+            
+        start = time.perf_counter()
+        # Without a clock line the data pin is the one that idles LOW
+        idle_pin = self.data_pin if self.line_code else self.clock_pin
+        line_pins = self.data_pins if self.line_code else self.data_pins + [self.clock_pin]
+        if direction == LINK_RX:
+            # Stop driving before releasing so the peer never sees contention
+            for pin in line_pins:
+                if self.direction == LINK_TX:
+                    self.pi.write(pin, 0)
+                self.pi.set_mode(pin, pigpio.INPUT)
+                self.pi.set_pull_up_down(pin, pigpio.PUD_DOWN)
+        else:
+            # Our own edges are not data
+            self._restart_notify()
+            
+            # Let the peer release, then wait for the clock to sit idle LOW
+            time.sleep(TURNAROUND_GUARD)
+            deadline = start + TURNAROUND_TIMEOUT
+            while self.pi.read(idle_pin) == 1:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError("Peer did not release the line")
+                time.sleep(TURNAROUND_GUARD / 10)
+            for pin in reversed(line_pins):
+                self.pi.write(pin, 0)
+                self.pi.set_mode(pin, pigpio.OUTPUT)
+                
+        # The very first call only sets the initial state
+        if self.direction is not None:
+            self.turnarounds += 1
+            self.turnaround_seconds += time.perf_counter() - start
+        self.direction = direction
+        
+    def turnaround_stats(self):
+        """Return how often and how long the link has spent turning around."""
+        mean = self.turnaround_seconds / self.turnarounds if self.turnarounds else 0.0
+        return {
+            'turnarounds': self.turnarounds,
+            'total_seconds': self.turnaround_seconds,
+            'mean_ms': mean * 1000,
+        }
+        
+    def send_bytes(self, data):
+        """Send a buffer of bytes as one DMA waveform chain."""
+        self._set_direction(LINK_TX)
+        self.wave.send(data)
+        
     def send_byte(self, byte):
         """Send a single byte."""
-        # Ensure we're in output mode
-        self.pi.set_mode(self.data_pin, pigpio.OUTPUT)
-        time.sleep(0.01)
+        if self.wave is not None:
+            self.send_bytes(bytes([byte]))
+            return
+            
+        # Only changes anything on the first byte of a message
+        self._set_direction(LINK_TX)
         
-        # Set data line LOW before starting
-        self.pi.write(self.data_pin, 0)
-        time.sleep(0.01)  # Increased delay
+        # Set data lines LOW before starting
+        self.pi.clear_bank_1(self.lanes.mask)
+        time.sleep(self.bit_delay)  # Edge delay
         
-        # Send each bit
-        for i in range(7, -1, -1):
-            # Set data line
-            bit = (byte >> i) & 1
-            self.pi.write(self.data_pin, bit)
-            time.sleep(0.01)  # Increased delay
+        # Send each bit, one per lane per clock edge
+        for i, high in enumerate(self.lanes.symbols(byte)):
+            # Set data lines in one bank write each way
+            self.pi.clear_bank_1(self.lanes.mask & ~high)
+            if high:
+                self.pi.set_bank_1(high)
+            time.sleep(self.bit_delay)  # Edge delay
+            
+            if self.ddr:
+                # Flip the clock; every edge carries data
+                self.pi.write(self.clock_pin, 1 - i % 2)
+                time.sleep(self.bit_delay)  # Edge delay
+                continue
             
             # Pulse clock
             self.pi.write(self.clock_pin, 1)
-            time.sleep(0.01)  # Increased delay
+            time.sleep(self.bit_delay)  # Edge delay
             self.pi.write(self.clock_pin, 0)
-            time.sleep(0.01)  # Increased delay
+            time.sleep(self.bit_delay)  # Edge delay
             
-        # Set data line LOW after byte
-        self.pi.write(self.data_pin, 0)
-        time.sleep(0.01)  # Increased delay
+        # Set data lines LOW after byte
+        self.pi.clear_bank_1(self.lanes.mask)
+        time.sleep(self.bit_delay)  # Edge delay
         
         # Pulse latch to update shift register if latch pin is configured
         if self.latch_pin is not None:
             self.pi.write(self.latch_pin, 1)
-            time.sleep(0.01)  # Increased delay
+            time.sleep(self.bit_delay)  # Edge delay
             self.pi.write(self.latch_pin, 0)
-            time.sleep(0.01)  # Increased delay
+            time.sleep(self.bit_delay)  # Edge delay
         
-    def receive_byte(self):
-        """Receive a single byte."""
-        # Switch to input mode with pull-down
-        self.pi.set_mode(self.data_pin, pigpio.INPUT)
-        self.pi.set_pull_up_down(self.data_pin, pigpio.PUD_DOWN)
-        time.sleep(0.01)  # Increased delay
+    def receive_byte(self, timeout=None):
+        """Receive a single byte.
+        Raises TimeoutError if the clock stays idle for timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        
+        # Only changes anything on the first byte of a message
+        self._set_direction(LINK_RX)
         
         # Initialize byte
         byte = 0
         
-        # Receive each bit
-        for i in range(8):
-            # Wait for clock high
-            while self.pi.read(self.clock_pin) == 0:
+        # Receive each clock edge's worth of bits
+        for i in range(self.lanes.symbols_per_byte):
+            # Wait for clock high (or low again for every second DDR edge)
+            edge = 0 if self.ddr and i % 2 else 1
+            while self.pi.read(self.clock_pin) != edge:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError("No clock from peer")
                 time.sleep(0.001)
             
-            # Read data bit
-            bit = self.pi.read(self.data_pin)
-            byte = (byte << 1) | bit
+            # Sample all lanes with one bank read
+            level = self.pi.read_bank_1()
+            byte = (byte << self.lanes.width) | self.lanes.sample(level)
+            
+            if self.ddr:
+                continue
             
             # Wait for clock low
             while self.pi.read(self.clock_pin) == 1:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError("Clock stuck high")
                 time.sleep(0.001)
         
-        # Switch back to output mode
-        self.pi.set_mode(self.data_pin, pigpio.OUTPUT)
-        time.sleep(0.01)  # Increased delay
-        
         return byte
         
     def send_message(self, message):
-        """Send a message and wait for response."""
-        # Send the message
-        for byte in message:
-            self.send_byte(byte)
-            time.sleep(0.01)  # Added delay between bytes
-            
-        # Send null byte to indicate end of transmission
-        self.send_byte(0)
-        time.sleep(0.01)  # Added delay after null byte
+        """Send a message (bytes or a Stream) and wait for the response,
+        which is a Stream if the peer streams it."""
+        self._finish_stream()
+        if self.framed and self.trainer.trainings and self.trainer.needs_retrain():
+            print("Link error rate drifted, retraining")
+            self.train_link()
+        self._send_payload(message)
         
         # Switch to receive mode
-        response = bytearray()
+        return self._receive_payload()
+        
+    def send_messages(self, messages):
+        """Send several messages in one transmission and return their
+        responses in order. Without framing each message takes its own
+        round trip."""
+        if not self.framed:
+            return [self.send_message(message) for message in messages]
+        self._finish_stream()
+        if self.trainer.trainings and self.trainer.needs_retrain():
+            print("Link error rate drifted, retraining")
+            self.train_link()
+        self.send_frames(self._batch_frames(messages))
+        
+        # All responses come back in a single transmission too
+        responses = []
         while True:
-            byte = self.receive_byte()
-            if byte == 0:  # End of response
-                break
-            response.append(byte)
-            time.sleep(0.01)  # Added delay between received bytes
-            
-        return bytes(response)
+            frame = self.receive_frame()
+            responses.append(frame.payload)
+            if not frame.header.flags & FLAG_MORE:
+                return responses
         
     def receive_message(self):
-        """Receive a message and send response."""
+        """Receive a message (or a batch of them) and send the response(s)."""
         # Receive the message
-        message = bytearray()
-        while True:
-            byte = self.receive_byte()
-            if byte == 0:  # End of message
-                break
-            message.append(byte)
-            time.sleep(0.01)  # Added delay between received bytes
+        if self.framed:
+            frame = self.receive_frame()
+            if control_type(frame) is not None:
+                # Link management, not an application message
+                self.trainer.respond(frame)
+                return
+            if frame.header.flags & FLAG_CHUNK:
+                # Streamed message: the handler reads chunks as they arrive
+                chunks = ChunkReader(self)
+                response = self.process_stream(frame.payload, chunks)
+                chunks.drain()
+                time.sleep(self.transport.response_delay)  # Added delay before sending response
+                self._send_payload(response)
+                return
+            batch = [frame.payload]
+            while frame.header.flags & FLAG_MORE:
+                frame = self.receive_frame()
+                batch.append(frame.payload)
+            if len(batch) > 1:
+                responses = [self.process_message(message) for message in batch]
+                time.sleep(self.transport.response_delay)  # Added delay before sending response
+                self.send_frames(self._batch_frames(responses))
+                return
+            message = batch[0]
+        else:
+            message = self._receive_payload()
             
         # Process message and prepare response
-        response = self.process_message(bytes(message))
-        time.sleep(0.01)  # Added delay before sending response
+        response = self.process_message(message)
+        time.sleep(self.transport.response_delay)  # Added delay before sending response
         
         # Send response
-        for byte in response:
-            self.send_byte(byte)
-            time.sleep(0.01)  # Added delay between bytes
+        self._send_payload(response)
+        
+    def _batch_frames(self, messages):
+        """Frames for one batch, every one but the last marked FLAG_MORE."""
+        frames = []
+        for i, message in enumerate(messages):
+            flags = FLAG_MORE if i < len(messages) - 1 else 0
+            frames.append(self._next_frame(message, flags))
+        return frames
+        
+    def _next_frame(self, payload, flags=0):
+        """A frame with the next sequence number."""
+        frame = Frame(FrameHeader(seq=self.tx_seq, flags=flags), bytes(payload))
+        self.tx_seq = (self.tx_seq + 1) & 0xFFFF
+        return frame
+        
+    def _send_payload(self, message):
+        """Send one message using the configured message format."""
+        if isinstance(message, Stream):
+            self._send_stream(message)
+        elif self.framed:
+            self.send_frame(self._next_frame(message))
+        else:
+            # Null byte indicates end of transmission
+            self._send_raw(bytes(message) + b"\x00")
+            
+    def _receive_payload(self):
+        """Receive one message using the configured message format."""
+        if self.framed:
+            frame = self.receive_frame()
+            if frame.header.flags & FLAG_CHUNK:
+                self._open_stream = ChunkReader(self)
+                return Stream(frame.payload, self._open_stream)
+            return frame.payload
+        return self._receive_until_terminator()
+        
+    def _send_stream(self, stream):
+        """Send a Stream, one frame per chunk as the chunks are produced,
+        keeping the line until the last one."""
+        if not self.framed:
+            raise ValueError("Streams need framed=True")
+        self._send_raw(self._next_frame(stream.head, FLAG_CHUNK).encode(), release=False)
+        chunks = iter(stream.chunks)
+        while True:
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            except Exception as e:
+                # The head is out already; abort the stream rather than the link
+                print(f"Stream body failed: {e}")
+                self.send_frame(self._next_frame(str(e).encode('utf-8'), FLAG_ABORT))
+                return
+            if chunk:
+                self._send_raw(self._next_frame(chunk, FLAG_CHUNK).encode(), release=False)
+        self.send_frame(self._next_frame(b""))
+        
+    def _finish_stream(self):
+        """Read past the rest of a received stream the caller left unread."""
+        if self._open_stream is not None:
+            self._open_stream.drain()
+            self._open_stream = None
+        
+    def send_frame(self, frame):
+        """Send a single frame and hand the line to the peer."""
+        self.send_frames([frame])
+        
+    def send_frames(self, frames):
+        """Send several frames back-to-back in one transmission."""
+        self._send_raw(b"".join(frame.encode() for frame in frames))
+        
+    def receive_frame(self, timeout=None):
+        """Block until a valid frame arrives and return it.
+        Noise and corrupted frames are skipped by the decoder.
+        Raises TimeoutError if nothing valid arrives within timeout seconds."""
+        with closing(self._receive_chunks(timeout)) as chunks:
+            for chunk in chunks:
+                self._rx_frames += self.frame_decoder.feed(chunk)
+                if self._rx_frames:
+                    break
+        self.frames_received += 1
+        return self._rx_frames.pop(0)
+        
+    def send_raw(self, data):
+        """Send bytes with no framing or terminator, then release the line."""
+        self._send_raw(data)
+        
+    def receive_raw(self, length, timeout=None):
+        """Receive up to length bytes with no framing.
+        Returns early with what arrived if timeout seconds pass."""
+        buffer = bytearray()
+        try:
+            with closing(self._receive_chunks(timeout)) as chunks:
+                for chunk in chunks:
+                    buffer += chunk
+                    if len(buffer) >= length:
+                        break
+        except TimeoutError:
+            pass
+        return bytes(buffer[:length])
+        
+    def _send_raw(self, data, release=True):
+        """Send bytes as they are, then release the line unless release is
+        False (more of the same transmission follows)."""
+        self.transport.send(data, release)
+        
+    def _send_pins(self, data, release=True):
+        """GpioTransport.send: drive the bytes onto the pins."""
+        if self.wave is not None:
+            # Whole message goes out as one wave chain
+            self.send_bytes(data)
+        else:
+            for byte in data:
+                self.send_byte(byte)
+                time.sleep(self.bit_delay)  # Added delay between bytes
+                
+        # Message boundary: hand the line to the peer straight away
+        if release:
+            self._set_direction(LINK_RX)
+        
+    def _receive_chunks(self, timeout=None):
+        """Yield received bytes until the caller stops iterating.
+        Chunks are single bytes when polling and whole buffers with notify
+        or another transport. An empty chunk is yielded first so callers
+        can check pending data.
+        Raises TimeoutError once timeout seconds have passed."""
+        yield b""
+        
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is None:
+                yield self.transport.receive()
+                continue
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise TimeoutError("Timed out waiting for data")
+            yield self.transport.receive(left)
+            
+    def _receive_pins(self, timeout=None):
+        """GpioTransport.receive: bytes decoded off the pins."""
+        self._set_direction(LINK_RX)
+        if self.notify is None:
+            return bytes([self.receive_byte(timeout)])
             
-        # Send null byte to indicate end of response
-        self.send_byte(0)
-        time.sleep(0.01)  # Added delay after null byte
+        # Keep reporting until we send again, so nothing is lost between
+        # the frames of one transmission (see _set_direction)
+        if not self._notifying:
+            self.notify.begin()
+            self._notifying = True
+        return self.notify.read(timeout=1.0 if timeout is None else min(timeout, 1.0))
+        
+    def _receive_until_terminator(self):
+        """Receive bytes up to the null byte that ends a message.
+        With a message parser (see _message_parser) the bytes are parsed as
+        they arrive. Once it rejects them the rest of the message is
+        dropped as it comes in, and only the head up to the bad line is
+        returned, for the decoder to reject again."""
+        buffer = self._rx_pending
+        scanned = 0  # Only look at new bytes, so long messages stay linear
+        parser = self._message_parser()
+        rejected = None
+        with closing(self._receive_chunks()) as chunks:
+            for chunk in chunks:
+                buffer += chunk
+                end = buffer.find(0, scanned)
+                if parser is not None and rejected is None:
+                    new = bytes(buffer[scanned:end if end >= 0 else len(buffer)])
+                    try:
+                        parser.feed(new)
+                    except MessageError as e:
+                        print(f"Malformed message, dropping the rest: {e}")
+                        rejected = bytes(buffer[:parser.parsed])
+                if end >= 0:
+                    break
+                if rejected is not None:
+                    del buffer[:]
+                scanned = len(buffer)
+                
+        message = bytes(buffer[:end]) if rejected is None else rejected
+        self._rx_pending = buffer[end + 1:]
+        return message
+        
+    def _message_parser(self):
+        """A textparser.MessageParser to check unframed messages with as
+        they arrive, or None to take them as they are."""
+        return None
         
     def process_message(self, message):
         """Process received message and return response.
         Override this method in subclasses."""
         return b"Received: " + message
         
+    def process_stream(self, head, chunks):
+        """Process a streamed message: head bytes and an iterator of body
+        chunks that arrive as it is read. Returns the response, bytes or a
+        Stream. Override to handle chunks as they come; by default the
+        body is collected and passed to process_message."""
+        return self.process_message(head + b"".join(chunks))
+        
     def cleanup(self):
-        """Clean up GPIO resources."""
-        self.pi.stop() 
\ No newline at end of file
+        """Clean up GPIO resources, or close the transport."""
+        self.transport.close()
+
+class GpioTransport(Transport):
+    """The pins of a Comm, as a transport. The bit-level work stays in Comm,
+    which link training and the lane and DDR settings act on."""
+    response_delay = RESPONSE_DELAY
+    
+    def __init__(self, comm):
+        self.comm = comm
+        
+    def send(self, data, release=True):
+        self.comm._send_pins(data, release)
+        
+    def receive(self, timeout=None):
+        return self.comm._receive_pins(timeout)
+        
+    def close(self):
+        if self.comm.notify is not None:
+            self.comm.notify.close()
+        self.comm.pi.stop() 
\ No newline at end of file
@@ -8,23 +8,139 @@ sudo pigpiod
 """
 
 from dataclasses import dataclass
+import binascii
+import struct
+import zlib
 import pigpio
 import time
 import sys
 import argparse
+from waveform import WaveformSender, DEFAULT_BIT_PERIOD_US
+from linecode import ManchesterSender
+from fec import FecCodec, DEFAULT_DEPTH
+from lanes import LaneMap
+
+# Frame layout on the wire:
+#   sync (2) | length (4) | seq (2) | flags (1) | header CRC-16 (2)
+#   payload (length bytes) | payload CRC-32 (4)
+# The header CRC guards the length field, so a corrupted length can never
+# make the receiver swallow the frames that follow it.
+SYNC_WORD = b"\x7e\xa5"
+HEADER = struct.Struct(">2sIHBH")
+TRAILER = struct.Struct(">I")
+MAX_PAYLOAD = 16 * 1024 * 1024
+FRAME_PAYLOAD = 4096  # Chunk size used when sending files as frames
+
+class FrameError(ValueError):
+    """Raised when bytes do not form a valid frame."""
+
+@dataclass
+class FrameHeader:
+    seq: int = 0
+    flags: int = 0
+    length: int = 0
 
 @dataclass
 class Frame:
-    header: bytes
+    header: FrameHeader
     payload: bytes
 
     def __repr__(self):
-        return f'{self.header}{self.payload}'
+        return (f'Frame(seq={self.header.seq}, flags=0x{self.header.flags:02x}, '
+                f'len={len(self.payload)})')
+
+    def encode(self):
+        """Return the frame as bytes ready to send."""
+        self.header.length = len(self.payload)
+        if self.header.length > MAX_PAYLOAD:
+            raise FrameError(f"Payload too large: {self.header.length} bytes")
+        fields = struct.pack(">IHB", self.header.length,
+                             self.header.seq & 0xFFFF, self.header.flags & 0xFF)
+        return b"".join((
+            SYNC_WORD, fields,
+            struct.pack(">H", binascii.crc_hqx(fields, 0xFFFF)),
+            self.payload,
+            TRAILER.pack(zlib.crc32(self.payload)),
+        ))
+
+    @classmethod
+    def decode(cls, data):
+        """Decode exactly one frame from data."""
+        frames = FrameDecoder().feed(data)
+        if len(frames) != 1:
+            raise FrameError("Data does not hold exactly one valid frame")
+        return frames[0]
+
+class FrameDecoder:
+    """Incremental frame decoder that resynchronises on the sync word."""
+
+    def __init__(self, max_payload=MAX_PAYLOAD):
+        self.max_payload = max_payload
+        self.buffer = bytearray()
+        self.header_errors = 0
+        self.crc_errors = 0
+        self.skipped_bytes = 0
+
+    def feed(self, data):
+        """Add received bytes and return the list of complete frames."""
+        self.buffer += data
+        frames = []
+        pos = 0
+        with memoryview(self.buffer) as view:
+            while True:
+                start = self.buffer.find(SYNC_WORD, pos)
+                if start < 0:
+                    # Keep a trailing byte that may be half a sync word
+                    keep = max(pos, len(self.buffer) - 1)
+                    self.skipped_bytes += keep - pos
+                    pos = keep
+                    break
+                self.skipped_bytes += start - pos
+                pos = start
+
+                if len(self.buffer) - pos < HEADER.size:
+                    break
+                _, length, seq, flags, header_crc = HEADER.unpack_from(self.buffer, pos)
+                computed = binascii.crc_hqx(view[pos + len(SYNC_WORD):pos + HEADER.size - 2], 0xFFFF)
+                if computed != header_crc or length > self.max_payload:
+                    # Not a real header, look for the next sync word
+                    self.header_errors += 1
+                    pos += 1
+                    continue
+
+                body = pos + HEADER.size
+                end = body + length
+                if len(self.buffer) < end + TRAILER.size:
+                    break
+                (payload_crc,) = TRAILER.unpack_from(self.buffer, end)
+                if zlib.crc32(view[body:end]) != payload_crc:
+                    self.crc_errors += 1
+                    pos += 1
+                    continue
+
+                frames.append(Frame(FrameHeader(seq, flags, length), bytes(view[body:end])))
+                pos = end + TRAILER.size
+        del self.buffer[:pos]
+        return frames
 
 class Connection:
-    def __init__(self, data_pin, clock_pin, single_step=False):
-        # Validate pins
-        self.data_pin = data_pin
+    def __init__(self, data_pin, clock_pin, single_step=False,
+                 waveform=False, bit_period_us=DEFAULT_BIT_PERIOD_US, data_pins=None,
+                 ddr=False, line_code=None):
+        # Validate pins; data_pins optionally lists 2, 4 or 8 lanes.
+        # There is no return path for link setup, so every lane is used as given,
+        # and ddr (data on both clock edges) must match the receiver's --ddr.
+        # line_code="manchester" sends self-clocking waveforms on one data pin
+        # and leaves the clock pin alone.
+        if line_code not in (None, "manchester"):
+            raise ValueError(f"Unknown line code: {line_code}")
+        if line_code and (ddr or (data_pins and len(data_pins) > 1)):
+            raise ValueError("Manchester code uses one data pin and no clock edges")
+        self.lanes = LaneMap(data_pins or [data_pin])
+        if ddr and self.lanes.symbols_per_byte % 2:
+            raise ValueError("DDR needs at most 4 data lanes")
+        self.ddr = ddr
+        self.data_pin = self.lanes.pins[0]
         self.clock_pin = clock_pin
         self.latch_pin = 25  # Add latch pin
         self.single_step = single_step
@@ -35,16 +151,31 @@ class Connection:
             raise RuntimeError("Could not connect to pigpio daemon")
 
         # Set up pins as outputs
-        self.pi.set_mode(self.clock_pin, pigpio.OUTPUT)
-        self.pi.set_mode(self.data_pin, pigpio.OUTPUT)
+        if not line_code:
+            self.pi.set_mode(self.clock_pin, pigpio.OUTPUT)
+        for pin in self.lanes.pins:
+            self.pi.set_mode(pin, pigpio.OUTPUT)
         self.pi.set_mode(self.latch_pin, pigpio.OUTPUT)
         
         # Initialize all pins to LOW
-        self.pi.write(self.clock_pin, 0)
-        self.pi.write(self.data_pin, 0)
+        if not line_code:
+            self.pi.write(self.clock_pin, 0)
+        self.pi.clear_bank_1(self.lanes.mask)
         self.pi.write(self.latch_pin, 0)
 
-    def send_file(self, filename: str):
+        # Optional DMA waveform transmitter
+        self.wave = None
+        if line_code:
+            self.wave = ManchesterSender(self.pi, self.data_pin, bit_period_us)
+        elif waveform:
+            self.wave = WaveformSender(self.pi, self.data_pin, self.clock_pin,
+                                       self.latch_pin, bit_period_us,
+                                       hold_latch=single_step, lanes=self.lanes,
+                                       ddr=ddr)
+
+    def send_file(self, filename: str, framed=False, fec=None):
+        """Send a file. fec optionally names an FEC scheme ("secded" or "rs")
+        or is a fec.FecCodec; the encoded stream is sent unframed."""
         try:
             with open(filename, 'rb') as file:
                 data = file.read()
@@ -55,6 +186,22 @@ class Connection:
             print(f"Error: Could not read file '{filename}'.")
             sys.exit(1)
 
+        if fec is not None:
+            codec = fec if isinstance(fec, FecCodec) else FecCodec(fec)
+            data = codec.encode(data)
+            framed = False
+
+        if framed:
+            # One CRC-checked frame per chunk, so an error only costs that chunk
+            for seq, offset in enumerate(range(0, len(data), FRAME_PAYLOAD)):
+                chunk = data[offset:offset + FRAME_PAYLOAD]
+                self.send_frame(Frame(FrameHeader(seq=seq & 0xFFFF), chunk))
+            return
+
+        if not self.single_step:
+            self.send_bytes(data)
+            return
+
         byte_count = 0
         for byte in data:
             if self.single_step:
@@ -77,27 +224,51 @@ class Connection:
             self.send_byte(byte)
             byte_count += 1
 
+    def send_frame(self, frame):
+        """Encode and send a single frame."""
+        self.send_bytes(frame.encode())
+
+    def send_bytes(self, data):
+        """Send a buffer of bytes, as one wave chain when waveform is enabled."""
+        if self.wave is not None:
+            self.wave.send(data)
+            return
+        for byte in data:
+            self.send_byte(byte)
+
     def send_byte(self, byte):
-        # Ensure data line is LOW before starting
-        self.pi.write(self.data_pin, 0)
+        if self.wave is not None:
+            self.wave.send(bytes([byte]))
+            self.last_byte_sent = True
+            return
+
+        # Ensure data lines are LOW before starting
+        self.pi.clear_bank_1(self.lanes.mask)
         self.pi.write(self.clock_pin, 0)
         time.sleep(0.001)  # 1ms delay to ensure stable start
 
-        # Shift out the byte
-        for ix in range(7, -1, -1):
-            # Set data line first
-            bit = 1 if (byte >> ix) & 1 else 0
-            self.pi.write(self.data_pin, bit)
+        # Shift out the byte, one bit per lane per clock edge
+        for i, high in enumerate(self.lanes.symbols(byte)):
+            # Set data lines first
+            self.pi.clear_bank_1(self.lanes.mask & ~high)
+            if high:
+                self.pi.set_bank_1(high)
             time.sleep(0.001)  # 1ms delay
 
+            if self.ddr:
+                # Flip the clock, both edges carry data
+                self.pi.write(self.clock_pin, 1 - i % 2)
+                time.sleep(0.001)  # 1ms delay
+                continue
+
             # Then pulse clock
             self.pi.write(self.clock_pin, 1)
             time.sleep(0.001)  # 1ms delay
             self.pi.write(self.clock_pin, 0)
             time.sleep(0.001)  # 1ms delay
 
-        # Set data line LOW after shifting
-        self.pi.write(self.data_pin, 0)
+        # Set data lines LOW after shifting
+        self.pi.clear_bank_1(self.lanes.mask)
         time.sleep(0.001)  # 1ms delay
 
         # Pulse the latch to update the output
@@ -120,8 +291,8 @@ class Connection:
         self.pi.stop()
 
 class Connect():
-    def __init__(self, data_pin, clock_pin, single_step=False):
-        self.conn = Connection(data_pin, clock_pin, single_step)
+    def __init__(self, data_pin, clock_pin, single_step=False, **kwargs):
+        self.conn = Connection(data_pin, clock_pin, single_step, **kwargs)
 
     def __enter__(self):
         return self.conn
@@ -134,11 +305,32 @@ def main():
     parser.add_argument('filename', help='The file to send')
     parser.add_argument('-s', '--single-step', action='store_true', 
                       help='Enable single-step mode (press Enter for each byte)')
+    parser.add_argument('-w', '--waveform', action='store_true',
+                      help='Send using pigpio DMA waveforms')
+    parser.add_argument('-d', '--data-pins', type=int, nargs='+', default=[23],
+                      help='Data lane GPIOs (1, 2, 4 or 8 of them)')
+    parser.add_argument('-p', '--bit-period', type=int, default=DEFAULT_BIT_PERIOD_US,
+                      help='Bit period in microseconds for waveform mode')
+    parser.add_argument('--ddr', action='store_true',
+                      help='Send data on both clock edges (receiver needs --ddr too)')
+    parser.add_argument('-m', '--manchester', action='store_true',
+                      help='Self-clocking Manchester code on the data pin, no clock line '
+                           '(receiver needs --manchester and the same --bit-period)')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-f', '--framed', action='store_true',
+                      help='Send the file as CRC-checked frames')
+    group.add_argument('--fec', choices=['secded', 'rs'],
+                      help='Add forward error correction (no return path needed)')
+    parser.add_argument('--fec-depth', type=int, default=DEFAULT_DEPTH,
+                      help='Interleaver depth in codewords')
     
     args = parser.parse_args()
 
-    with Connect(23, 24, args.single_step) as conn:
-        conn.send_file(args.filename)
+    with Connect(args.data_pins[0], 24, args.single_step, waveform=args.waveform,
+                 bit_period_us=args.bit_period, data_pins=args.data_pins,
+                 ddr=args.ddr, line_code='manchester' if args.manchester else None) as conn:
+        fec = FecCodec(args.fec, depth=args.fec_depth) if args.fec else None
+        conn.send_file(args.filename, framed=args.framed, fec=fec)
 
 if __name__ == "__main__":
     main()
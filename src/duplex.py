@@ -0,0 +1,293 @@
+"""
+Full-duplex link with separate TX and RX data lines.
+
+Comm shares its wires and turns them around at every message boundary, so a
+request, its response and any ACKs have to take turns. Here each side drives
+its own TX line and listens on the peer's TX line, with a sender thread and
+a receiver thread running at the same time:
+
+    side A  tx_pin --------------> rx_pin        side B
+            rx_pin <-------------- tx_pin
+            tx_clock_pin --------> rx_clock_pin  (clocked mode only)
+            rx_clock_pin <-------- tx_clock_pin
+
+Without clock pins both directions use the self-clocking Manchester code
+from linecode.py, so two wires are enough (the old data and clock pins).
+
+Messages travel as frames (connection.Frame). A response carries the seq of
+its request and FLAG_RESPONSE, so several requests can be in flight at once
+and each response is matched to its request as it arrives. send_frames() and
+receive_frame() behave like Comm's, so arq.py runs over this link and its
+ACKs flow back while data is still going out.
+
+With a workers.WorkerPool, receive_message() hands each request to the
+pool and returns at once, so the link goes on receiving while handlers
+run; responses go out as they are ready, in request order.
+
+A handler that raises is answered with FLAG_RESPONSE | comm.FLAG_ABORT and
+the error text, and the waiting submit() future fails with RemoteError. If
+the receiver or sender thread dies, the error fails every pending future,
+and receive_frame() and submit() raise ConnectionError from then on.
+
+The same pins are also a transport.Transport, FullDuplexTransport, for
+running Comm, and so Client and Server, over the full-duplex wiring:
+
+    server = Server(transport=FullDuplexTransport(23, 24), framed=True)
+
+Comm still waits for each response before sending again, so only
+FullDuplexComm gets requests in flight at the same time.
+"""
+
+from concurrent.futures import Future
+import queue
+import threading
+import pigpio
+from comm import FLAG_ABORT
+from connection import Frame, FrameHeader, FrameDecoder
+from notify import NotifyReceiver
+from transport import Transport
+from waveform import WaveformSender, DEFAULT_BIT_PERIOD_US
+from linecode import ManchesterSender, ManchesterDecoder
+
+FLAG_RESPONSE = 0x20   # Frame answers the request with the same seq
+
+READ_TIMEOUT = 0.1     # Seconds per notify read, so the receiver can stop
+MAX_SEQ = 0xFFFF
+
+
+class RemoteError(Exception):
+    """The peer's handler failed on our request."""
+
+
+class FullDuplexTransport(Transport):
+    """Our TX lines and the peer's TX lines, as a transport.
+    Give both clock pins for clocked data in each direction, or neither
+    for Manchester code; both sides must use the same bit_period_us then."""
+
+    def __init__(self, tx_pin=23, rx_pin=24, tx_clock_pin=None, rx_clock_pin=None,
+                 bit_period_us=DEFAULT_BIT_PERIOD_US):
+        if (tx_clock_pin is None) != (rx_clock_pin is None):
+            raise ValueError("Give both clock pins or neither")
+        self.tx_pin = tx_pin
+        self.rx_pin = rx_pin
+        self.tx_clock_pin = tx_clock_pin
+        self.rx_clock_pin = rx_clock_pin
+        self.bit_period_us = bit_period_us
+
+        # Initialize pigpio
+        self.pi = pigpio.pi()
+        if not self.pi.connected:
+            raise RuntimeError("Could not connect to pigpio daemon")
+
+        # We only ever drive our TX lines and only ever listen on RX
+        for pin in (tx_pin, tx_clock_pin):
+            if pin is not None:
+                self.pi.write(pin, 0)
+                self.pi.set_mode(pin, pigpio.OUTPUT)
+        for pin in (rx_pin, rx_clock_pin):
+            if pin is not None:
+                self.pi.set_mode(pin, pigpio.INPUT)
+                self.pi.set_pull_up_down(pin, pigpio.PUD_DOWN)
+
+        if tx_clock_pin is None:
+            self.wave = ManchesterSender(self.pi, tx_pin, bit_period_us)
+            self.notify = NotifyReceiver(self.pi, rx_pin, None,
+                                         decoder=ManchesterDecoder(rx_pin, bit_period_us))
+        else:
+            self.wave = WaveformSender(self.pi, tx_pin, tx_clock_pin,
+                                       bit_period_us=bit_period_us)
+            self.notify = NotifyReceiver(self.pi, rx_pin, rx_clock_pin)
+        self.notify.begin()
+
+    def send(self, data, release=True):
+        """Send data; there is no line to release, the peer has its own."""
+        self.wave.send(data)
+
+    def receive(self, timeout=None):
+        return self.notify.read(READ_TIMEOUT if timeout is None else timeout)
+
+    def close(self):
+        self.notify.pause()
+        self.notify.close()
+        self.pi.stop()
+
+
+class FullDuplexComm:
+    def __init__(self, tx_pin=23, rx_pin=24, tx_clock_pin=None, rx_clock_pin=None,
+                 bit_period_us=DEFAULT_BIT_PERIOD_US, pool=None):
+        """Start the sender and receiver threads.
+        The pins are as for FullDuplexTransport.
+        pool optionally runs process_message off the receiving thread."""
+        self.transport = FullDuplexTransport(tx_pin, rx_pin, tx_clock_pin, rx_clock_pin,
+                                             bit_period_us)
+        self.pi = self.transport.pi
+        self.wave = self.transport.wave
+        self.notify = self.transport.notify
+        self.bit_period_us = bit_period_us
+        self.pool = pool
+
+        self.tx_seq = 0
+        self.frame_decoder = FrameDecoder()
+        self.frames_received = 0
+        self._rx_frames = queue.Queue()   # Frames that are not responses
+        self._pending = {}                # seq -> Future of an outstanding request
+        self._lock = threading.Lock()
+        self._tx_queue = queue.Queue()    # Encoded frames waiting for the wire
+        self._stop = threading.Event()
+        self.error = None                 # Why a link thread died, see _fail
+
+        self._sender = threading.Thread(target=self._send_loop, daemon=True)
+        self._receiver = threading.Thread(target=self._receive_loop, daemon=True)
+        self._sender.start()
+        self._receiver.start()
+
+    def send_frame(self, frame):
+        """Queue a single frame for sending; returns at once."""
+        self.send_frames([frame])
+
+    def send_frames(self, frames):
+        """Queue several frames to go out back-to-back; returns at once."""
+        self._tx_queue.put(b"".join(frame.encode() for frame in frames))
+
+    def receive_frame(self, timeout=None):
+        """Return the next frame that is not a response.
+        Raises TimeoutError if none arrives within timeout seconds, and
+        ConnectionError once the link has failed."""
+        try:
+            frame = self._rx_frames.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Timed out waiting for a frame") from None
+        if frame is None:
+            self._rx_frames.put(None)  # For the next caller too
+            raise ConnectionError(f"Link failed: {self.error}") from self.error
+        return frame
+
+    def submit(self, message):
+        """Send a request and return a Future for its response payload.
+        Any number of requests may be outstanding, up to one per seq. The
+        future fails with RemoteError if the peer's handler raises."""
+        future = Future()
+        with self._lock:
+            if self.error is not None:
+                raise ConnectionError(f"Link failed: {self.error}") from self.error
+            if len(self._pending) > MAX_SEQ:
+                raise RuntimeError("Every seq is waiting for a response")
+            # Skip any seq still waiting after a wraparound
+            while self.tx_seq in self._pending:
+                self.tx_seq = (self.tx_seq + 1) & MAX_SEQ
+            seq = self.tx_seq
+            self.tx_seq = (self.tx_seq + 1) & MAX_SEQ
+            self._pending[seq] = future
+        self.send_frame(Frame(FrameHeader(seq=seq), bytes(message)))
+        return future
+
+    def send_message(self, message, timeout=None):
+        """Send a message and wait for the response."""
+        return self.submit(message).result(timeout)
+
+    def receive_message(self, timeout=None):
+        """Receive a message and queue the response.
+        The response goes out while the next request is being received."""
+        frame = self.receive_frame(timeout)
+        if self.pool is not None:
+            # One peer, so its requests run in order; blocks while the pool is full
+            future = self.pool.submit(None, frame.payload)
+            future.add_done_callback(lambda done: self._finish(frame, done))
+            return
+        try:
+            response = self.process_message(frame.payload)
+        except Exception as e:
+            self._respond_error(frame, e)
+            return
+        self._respond(frame, response)
+
+    def _finish(self, frame, done):
+        if done.exception() is not None:
+            self._respond_error(frame, done.exception())
+        else:
+            self._respond(frame, done.result())
+
+    def _respond(self, frame, response):
+        self.send_frame(Frame(FrameHeader(seq=frame.header.seq, flags=FLAG_RESPONSE),
+                              bytes(response)))
+
+    def _respond_error(self, frame, error):
+        print(f"Handler failed on request {frame.header.seq}: {error}")
+        self.send_frame(Frame(FrameHeader(seq=frame.header.seq, flags=FLAG_RESPONSE | FLAG_ABORT),
+                              str(error).encode('utf-8')))
+
+    def process_message(self, message):
+        """Process received message and return response.
+        Override this method in subclasses."""
+        return b"Received: " + message
+
+    def _send_loop(self):
+        while True:
+            data = self._tx_queue.get()
+            if data is None:
+                return
+            # Batch whatever else is waiting into the same wave chain
+            while True:
+                try:
+                    more = self._tx_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    self._tx_queue.put(None)
+                    break
+                data += more
+            try:
+                self.transport.send(data)
+            except Exception as e:
+                self._fail(e)
+                return
+
+    def _receive_loop(self):
+        try:
+            while not self._stop.is_set():
+                chunk = self.transport.receive(READ_TIMEOUT)
+                if not chunk:
+                    continue
+                for frame in self.frame_decoder.feed(chunk):
+                    self.frames_received += 1
+                    self._dispatch(frame)
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error):
+        """A link thread died: fail whatever waits on it."""
+        print(f"Full-duplex link failed: {error}")
+        with self._lock:
+            if self.error is not None:
+                return
+            self.error = error
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(ConnectionError(f"Link failed: {error}"))
+        self._rx_frames.put(None)
+
+    def _dispatch(self, frame):
+        if frame.header.flags & FLAG_RESPONSE:
+            with self._lock:
+                future = self._pending.pop(frame.header.seq, None)
+            if future is not None:
+                if frame.header.flags & FLAG_ABORT:
+                    future.set_exception(RemoteError(frame.payload.decode('utf-8', 'replace')))
+                else:
+                    future.set_result(frame.payload)
+                return
+        self._rx_frames.put(frame)
+
+    def cleanup(self):
+        """Stop both threads and release GPIO resources."""
+        self._tx_queue.put(None)
+        self._sender.join()
+        self._stop.set()
+        self._receiver.join()
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self.transport.close()
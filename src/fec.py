@@ -0,0 +1,319 @@
+"""
+Forward error correction for one-way transfers over the GPIO link.
+
+connection.py -> recv.py has no return path, so lost bits cannot be asked for
+again. Encoding the stream with redundancy lets the receiver repair them:
+
+- "secded": extended Hamming(8,4). Every nibble becomes one byte that
+  corrects any single bit error and detects double errors. Cheap, 2x size.
+- "rs": Reed-Solomon RS(255, 255 - nsym) over GF(2^8). Corrects up to
+  nsym/2 wrong bytes per 255 byte block, good against bursts.
+
+Codewords are block-interleaved with a configurable depth, so a burst of
+timing errors is spread over several codewords instead of destroying one.
+All table lookups, syndrome checks and interleaving run on whole NumPy
+buffers; only Reed-Solomon blocks that actually have errors are corrected
+one at a time.
+
+The original length is stored in front of the data before encoding, so it
+is protected by the code as well.
+"""
+
+from dataclasses import dataclass
+import struct
+import numpy as np
+
+LENGTH = struct.Struct(">I")
+DEFAULT_DEPTH = 8
+DEFAULT_NSYM = 32
+RS_N = 255
+
+
+@dataclass
+class FecStats:
+    codewords: int = 0
+    corrected: int = 0        # symbols repaired (bits for secded, bytes for rs)
+    uncorrectable: int = 0    # codewords that could not be repaired
+
+    def __str__(self):
+        return (f"{self.codewords} codewords, {self.corrected} symbols corrected, "
+                f"{self.uncorrectable} uncorrectable")
+
+
+def interleave(codewords, depth):
+    """Send groups of depth codewords column by column.
+    codewords is a 2D array with one codeword per row."""
+    rows, width = codewords.shape
+    pad = -rows % depth
+    if pad:
+        codewords = np.vstack((codewords, np.zeros((pad, width), codewords.dtype)))
+    groups = codewords.reshape(-1, depth, width)
+    return groups.transpose(0, 2, 1).reshape(-1, width)
+
+
+def deinterleave(symbols, depth, width):
+    """Undo interleave(); returns whole groups only."""
+    groups = len(symbols) // (depth * width)
+    symbols = symbols[:groups * depth * width].reshape(groups, width, depth)
+    return symbols.transpose(0, 2, 1).reshape(-1, width)
+
+
+# Extended Hamming(8,4): bits d1..d4, parity p1 p2 p3, overall parity p0
+
+def _secded_tables():
+    encode = np.zeros(16, dtype=np.uint8)
+    for nibble in range(16):
+        d1, d2, d3, d4 = (nibble >> 3) & 1, (nibble >> 2) & 1, (nibble >> 1) & 1, nibble & 1
+        p1 = d1 ^ d2 ^ d4
+        p2 = d1 ^ d3 ^ d4
+        p3 = d2 ^ d3 ^ d4
+        bits = [p1, p2, d1, p3, d2, d3, d4]  # Hamming positions 1..7
+        p0 = sum(bits) & 1
+        byte = 0
+        for bit in bits + [p0]:
+            byte = (byte << 1) | bit
+        encode[nibble] = byte
+
+    # Nearest codeword for every received byte
+    decode = np.zeros(256, dtype=np.uint8)
+    status = np.zeros(256, dtype=np.uint8)  # 0 ok, 1 corrected, 2 uncorrectable
+    distance = np.array([[bin(r ^ int(c)).count("1") for c in encode] for r in range(256)])
+    for received in range(256):
+        best = int(np.argmin(distance[received]))
+        d = distance[received, best]
+        decode[received] = best
+        status[received] = 0 if d == 0 else 1 if d == 1 else 2
+    return encode, decode, status
+
+
+SECDED_ENCODE, SECDED_DECODE, SECDED_STATUS = _secded_tables()
+
+
+class Secded:
+    name = "secded"
+
+    def encode(self, data):
+        """Return one codeword byte per nibble, high nibble first."""
+        data = np.frombuffer(data, dtype=np.uint8)
+        nibbles = np.empty(len(data) * 2, dtype=np.uint8)
+        nibbles[0::2] = data >> 4
+        nibbles[1::2] = data & 0x0F
+        # Interleave at bit level so a burst hits many codewords once
+        return np.unpackbits(SECDED_ENCODE[nibbles]).reshape(-1, 8)
+
+    def decode(self, bits, stats):
+        codewords = np.packbits(bits, axis=1).ravel()
+        status = SECDED_STATUS[codewords]
+        nibbles = SECDED_DECODE[codewords]
+        stats.codewords += len(codewords)
+        stats.corrected += int(np.count_nonzero(status == 1))
+        stats.uncorrectable += int(np.count_nonzero(status == 2))
+        nibbles = nibbles[:len(nibbles) // 2 * 2]
+        return ((nibbles[0::2] << 4) | nibbles[1::2]).astype(np.uint8).tobytes()
+
+
+# GF(2^8) arithmetic with primitive polynomial x^8 + x^4 + x^3 + x^2 + 1
+
+GF_EXP = np.zeros(512, dtype=np.int32)
+GF_LOG = np.zeros(256, dtype=np.int32)
+_x = 1
+for _i in range(255):
+    GF_EXP[_i] = _x
+    GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11D
+GF_EXP[255:510] = GF_EXP[:255]
+_EXP = GF_EXP.tolist()
+_LOG = GF_LOG.tolist()
+
+
+def gf_mul_array(a, b):
+    """Element-wise GF(2^8) product of two integer arrays."""
+    product = GF_EXP[GF_LOG[a] + GF_LOG[b]]
+    return np.where((a == 0) | (b == 0), 0, product)
+
+
+def _mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+
+def _div(a, b):
+    if a == 0:
+        return 0
+    return _EXP[(_LOG[a] - _LOG[b]) % 255]
+
+
+def _pow(x, power):
+    return _EXP[(_LOG[x] * power) % 255]
+
+
+def _poly_eval(poly, x):
+    y = poly[0]
+    for coef in poly[1:]:
+        y = _mul(y, x) ^ coef
+    return y
+
+
+def _poly_add(p, q):
+    width = max(len(p), len(q))
+    out = [0] * width
+    for i, c in enumerate(p):
+        out[i + width - len(p)] = c
+    for i, c in enumerate(q):
+        out[i + width - len(q)] ^= c
+    return out
+
+
+def _poly_mul(p, q):
+    out = [0] * (len(p) + len(q) - 1)
+    for j, qj in enumerate(q):
+        for i, pi in enumerate(p):
+            out[i + j] ^= _mul(pi, qj)
+    return out
+
+
+class ReedSolomon:
+    name = "rs"
+
+    def __init__(self, nsym=DEFAULT_NSYM):
+        if not 2 <= nsym < RS_N or nsym % 2:
+            raise ValueError("nsym must be an even number between 2 and 254")
+        self.nsym = nsym
+        self.k = RS_N - nsym
+
+        # Generator polynomial with roots alpha^0 .. alpha^(nsym-1)
+        generator = [1]
+        for i in range(nsym):
+            generator = _poly_mul(generator, [1, _pow(2, i)])
+        self.generator = np.array(generator[1:], dtype=np.int32)
+        self.roots = np.array([_pow(2, i) for i in range(nsym)], dtype=np.int32)
+
+    def encode(self, data):
+        """Return a (blocks, 255) array of systematic codewords."""
+        data = np.frombuffer(data, dtype=np.uint8)
+        data = np.concatenate((data, np.zeros(-len(data) % self.k, np.uint8)))
+        message = data.reshape(-1, self.k).astype(np.int32)
+
+        # LFSR division by the generator, one message column at a time
+        parity = np.zeros((len(message), self.nsym), dtype=np.int32)
+        for column in message.T:
+            feedback = column ^ parity[:, 0]
+            parity[:, :-1] = parity[:, 1:]
+            parity[:, -1] = 0
+            parity ^= gf_mul_array(feedback[:, None], self.generator[None, :])
+        return np.hstack((message, parity)).astype(np.uint8)
+
+    def syndromes(self, codewords):
+        """Evaluate every codeword at every generator root (Horner)."""
+        codewords = codewords.astype(np.int32)
+        synd = np.zeros((len(codewords), self.nsym), dtype=np.int32)
+        for column in codewords.T:
+            synd = gf_mul_array(synd, self.roots[None, :]) ^ column[:, None]
+        return synd
+
+    def decode(self, codewords, stats):
+        codewords = codewords.copy()
+        synd = self.syndromes(codewords)
+        stats.codewords += len(codewords)
+
+        # Only blocks with a non-zero syndrome need the scalar decoder
+        for row in np.flatnonzero(synd.any(axis=1)):
+            fixed = self._correct(codewords[row].tolist(), [0] + synd[row].tolist())
+            if fixed is None:
+                stats.uncorrectable += 1
+                continue
+            stats.corrected += sum(a != b for a, b in zip(fixed, codewords[row].tolist()))
+            codewords[row] = fixed
+        return codewords[:, :self.k].tobytes()
+
+    def _correct(self, msg, synd):
+        """Berlekamp-Massey, Chien search and Forney for one codeword.
+        Returns the corrected codeword, or None if there are too many errors."""
+        nsym = self.nsym
+        err_loc = [1]
+        old_loc = [1]
+        for i in range(nsym):
+            k = i + 1
+            delta = synd[k]
+            for j in range(1, len(err_loc)):
+                delta ^= _mul(err_loc[-(j + 1)], synd[k - j])
+            old_loc = old_loc + [0]
+            if delta:
+                if len(old_loc) > len(err_loc):
+                    new_loc = [_mul(c, delta) for c in old_loc]
+                    old_loc = [_mul(c, _div(1, delta)) for c in err_loc]
+                    err_loc = new_loc
+                err_loc = _poly_add(err_loc, [_mul(c, delta) for c in old_loc])
+        while err_loc and err_loc[0] == 0:
+            err_loc.pop(0)
+        errors = len(err_loc) - 1
+        if errors * 2 > nsym:
+            return None
+
+        # Chien search: roots of the locator give the error positions
+        reversed_loc = err_loc[::-1]
+        positions = [RS_N - 1 - i for i in range(RS_N) if _poly_eval(reversed_loc, _pow(2, i)) == 0]
+        if len(positions) != errors:
+            return None
+
+        # Forney: error magnitudes from the evaluator polynomial
+        coef_pos = [RS_N - 1 - p for p in positions]
+        locator = [1]
+        for i in coef_pos:
+            locator = _poly_mul(locator, [_pow(2, i), 1])
+        evaluator = _poly_mul(synd[::-1], locator)[-(len(locator)):]
+        xs = [_pow(2, i) for i in coef_pos]
+        for pos, xi in zip(positions, xs):
+            xi_inv = _div(1, xi)
+            derivative = 1
+            for xj in xs:
+                if xj != xi:
+                    derivative = _mul(derivative, 1 ^ _mul(xi_inv, xj))
+            y = _mul(xi, _poly_eval(evaluator, xi_inv))
+            if derivative == 0:
+                return None
+            msg[pos] ^= _div(y, derivative)
+
+        # Make sure the result really is a codeword
+        if any(_poly_eval(msg, _pow(2, i)) for i in range(nsym)):
+            return None
+        return msg
+
+
+class FecCodec:
+    def __init__(self, scheme="rs", depth=DEFAULT_DEPTH, nsym=DEFAULT_NSYM):
+        """scheme is "secded" or "rs"; depth is the interleaver depth in codewords."""
+        if scheme == "secded":
+            self.code = Secded()
+        elif scheme == "rs":
+            self.code = ReedSolomon(nsym)
+        else:
+            raise ValueError(f"Unknown FEC scheme: {scheme}")
+        self.depth = depth
+        self.stats = FecStats()
+
+    def encode(self, data):
+        """Return the encoded, interleaved bytes to put on the wire."""
+        codewords = self.code.encode(LENGTH.pack(len(data)) + bytes(data))
+        symbols = interleave(codewords, self.depth).ravel()
+        if isinstance(self.code, Secded):
+            return np.packbits(symbols).tobytes()
+        return symbols.tobytes()
+
+    def decode(self, data):
+        """Repair received bytes and return the original data.
+        Counts land in self.stats; trailing partial groups are ignored."""
+        symbols = np.frombuffer(bytes(data), dtype=np.uint8)
+        width = RS_N
+        if isinstance(self.code, Secded):
+            symbols = np.unpackbits(symbols)
+            width = 8
+        codewords = deinterleave(symbols, self.depth, width)
+        decoded = self.code.decode(codewords, self.stats)
+        if len(decoded) < LENGTH.size:
+            return b""
+        (length,) = LENGTH.unpack_from(decoded)
+        return decoded[LENGTH.size:LENGTH.size + length]
@@ -0,0 +1,86 @@
+"""
+Lane mapping for the multi-lane data bus.
+
+With N data pins sharing one clock, every clock edge carries N bits that are
+written and sampled together through one GPIO bank access. Bytes are sent
+MSB first; within a clock, lane 0 carries the most significant bit. With a
+single lane this is exactly the original serial bit order.
+"""
+
+import numpy as np
+
+LANE_WIDTHS = (1, 2, 4, 8)
+
+
+class LaneMap:
+    def __init__(self, data_pins):
+        """data_pins lists the GPIO of each lane, lane 0 first."""
+        self.pins = list(data_pins)
+        self.width = len(self.pins)
+        if self.width not in LANE_WIDTHS:
+            raise ValueError(f"Lane count must be one of {LANE_WIDTHS}")
+        self.mask = 0
+        for pin in self.pins:
+            self.mask |= 1 << pin
+        self.symbols_per_byte = 8 // self.width
+        self._pin_array = np.array(self.pins, dtype=np.uint32)
+
+        # Bank mask to drive high for every (byte, clock) pair
+        self._symbols = [self._split(byte) for byte in range(256)]
+
+    def _split(self, byte):
+        symbols = []
+        for k in range(self.symbols_per_byte):
+            shift = 8 - self.width * (k + 1)
+            value = (byte >> shift) & ((1 << self.width) - 1)
+            high = 0
+            for lane, pin in enumerate(self.pins):
+                if (value >> (self.width - 1 - lane)) & 1:
+                    high |= 1 << pin
+            symbols.append(high)
+        return symbols
+
+    def symbols(self, byte):
+        """Return the bank masks of the lanes to drive high, one per clock."""
+        return self._symbols[byte]
+
+    def sample(self, level):
+        """Return the bits of one clock, lane 0 first, from a bank level."""
+        value = 0
+        for pin in self.pins:
+            value = (value << 1) | ((level >> pin) & 1)
+        return value
+
+    def bits(self, levels):
+        """Return the bit stream from bank levels sampled at clock edges."""
+        levels = np.asarray(levels, dtype=np.uint32)
+        return ((levels[:, None] >> self._pin_array) & 1).astype(np.uint8).ravel()
+
+
+def lane_errors(expected, received, width, max_shift=1):
+    """Compare a multi-lane burst with the pattern that was sent.
+    Returns one (errors, bits, skew) tuple per lane. skew is the shift in
+    clocks at which the lane matches best; a lane that is skewed or stuck
+    shows up with a non-zero skew or a high error count."""
+    sent = np.unpackbits(np.frombuffer(expected, dtype=np.uint8))
+    got = np.unpackbits(np.frombuffer(received, dtype=np.uint8))
+    if len(got) < len(sent):
+        got = np.concatenate((got, np.zeros(len(sent) - len(got), np.uint8)))
+    got = got[:len(sent)]
+
+    results = []
+    for lane in range(width):
+        tx = sent[lane::width]
+        rx = got[lane::width]
+        best = None
+        for shift in range(-max_shift, max_shift + 1):
+            if shift >= 0:
+                a, b = tx[:len(tx) - shift], rx[shift:]
+            else:
+                a, b = tx[-shift:], rx[:len(rx) + shift]
+            errors = int(np.count_nonzero(a != b))
+            if best is None or errors < best[0] or (errors == best[0] and shift == 0):
+                best = (errors, shift)
+        errors_at_zero = int(np.count_nonzero(tx != rx))
+        results.append((errors_at_zero, len(tx), best[1]))
+    return results
@@ -0,0 +1,223 @@
+"""
+Self-clocking Manchester line code for a single data pin.
+
+With a clock line, one of the two wires carries no payload. Manchester code
+puts a transition in the middle of every bit (0 = HIGH then LOW, 1 = LOW then
+HIGH, as in IEEE 802.3), so the receiver can recover the timing from the
+edge ticks alone and the clock pin is free for something else, such as a
+return channel.
+
+A burst on the wire is:
+
+    idle LOW | PREAMBLE + SFD | data bytes, MSB first | one 1 bit | idle LOW
+
+The 0x55 preamble gives a run of evenly spaced edges to lock onto, the SFD
+(start frame delimiter) marks the first data bit, and the trailing 1 bit
+closes the last data bit's final half before the line goes idle. Long
+messages are split into several bursts, one per wave chain, because the line
+must not pause mid-burst.
+
+The decoder works on whole arrays of (tick, level) reports from the pigpio
+notification pipe: edge spacings are quantised to half bits, expanded into
+half-bit levels with np.repeat and paired up, so only gaps between bursts
+are handled one at a time. The half-bit length is re-estimated from every
+batch of edges, so the receiver follows a sender whose clock drifts.
+"""
+
+import numpy as np
+import pigpio
+from notify import parse_reports, REPORT_SIZE
+from waveform import WaveformSender, DEFAULT_BIT_PERIOD_US
+
+PREAMBLE = b"\x55\x55\x55"
+SFD = 0xD5
+SYNC_BITS = np.unpackbits(np.frombuffer(bytes([0x55, SFD]), dtype=np.uint8))
+GAP_HALVES = 3         # No valid Manchester run is this long; the burst ended
+CLOCK_TRACKING = 0.1   # Weight of new edges in the half-bit estimate
+
+
+def bit_pulses(bit, pin_mask, half_us):
+    """Two half-bit pulses for one Manchester bit."""
+    first, second = (0, pin_mask) if bit else (pin_mask, 0)
+    return [pigpio.pulse(first, pin_mask & ~first, half_us),
+            pigpio.pulse(second, pin_mask & ~second, half_us)]
+
+
+def manchester_pulses(byte, pin_mask, bit_period_us=DEFAULT_BIT_PERIOD_US):
+    """Return the pigpio pulses for one byte, MSB first."""
+    half = max(1, bit_period_us // 2)
+    return [p for i in range(7, -1, -1) for p in bit_pulses((byte >> i) & 1, pin_mask, half)]
+
+
+class ManchesterSender(WaveformSender):
+    """Waveform sender that drives only the data pin with Manchester code."""
+
+    def __init__(self, pi, data_pin, bit_period_us=DEFAULT_BIT_PERIOD_US):
+        """Prepare a sender on an already connected pigpio.pi.
+        The caller owns the pin and must have it in OUTPUT mode."""
+        self.pin_mask = 1 << data_pin
+        super().__init__(pi, data_pin, None, bit_period_us=bit_period_us)
+
+    def set_bit_period(self, bit_period_us):
+        """Change the bit period and rebuild the per-byte pulse trains."""
+        if bit_period_us < 2:
+            raise ValueError("bit_period_us must be at least 2")
+        self.bit_period_us = bit_period_us
+        half = max(1, bit_period_us // 2)
+        self._byte_pulses = [manchester_pulses(b, self.pin_mask, bit_period_us)
+                             for b in range(256)]
+        self._byte_micros = 2 * half * 8
+
+        # Trailing 1 bit, then back to idle LOW
+        self._tail = bit_pulses(1, self.pin_mask, half) + [pigpio.pulse(0, self.pin_mask, half)]
+
+        # Bytes per burst, so that a whole burst fits in one wave
+        per_byte = len(self._byte_pulses[0])
+        self.burst_bytes = max(1, (self._max_pulses - len(self._tail)) // per_byte
+                               - len(PREAMBLE) - 1)
+
+    def set_lanes(self, lanes):
+        raise ValueError("Manchester code uses a single data pin")
+
+    def set_ddr(self, ddr):
+        if ddr:
+            raise ValueError("Manchester code has no clock edges to double up")
+
+    def send(self, data):
+        """Send a buffer of bytes as one or more bursts.
+        Blocks until the last bit has left the pin."""
+        data = bytes(data)
+        for start in range(0, len(data), self.burst_bytes):
+            burst = PREAMBLE + bytes([SFD]) + data[start:start + self.burst_bytes]
+            pulses = [p for b in burst for p in self._byte_pulses[b]] + self._tail
+            self.pi.wave_add_generic(pulses)
+            wave_id = self.pi.wave_create()
+            try:
+                self.pi.wave_chain([wave_id])
+                self._wait(sum(p.delay for p in pulses))
+            finally:
+                self.pi.wave_delete(wave_id)
+
+
+class ManchesterDecoder:
+    """Turn level reports of one data pin into bytes, recovering the clock."""
+
+    def __init__(self, data_pin, bit_period_us=DEFAULT_BIT_PERIOD_US):
+        """bit_period_us is the nominal period; the decoder tracks drift from it."""
+        self.data_pin = data_pin
+        self.mask = 1 << data_pin
+        self.nominal_half_us = bit_period_us / 2
+        self.half_us = self.nominal_half_us
+        self.code_errors = 0   # Half-bit pairs without a mid-bit transition
+        self.bursts = 0
+        self.reset()
+
+    def reset(self, level=0):
+        """Forget any partial burst. level is the current GPIO bank level."""
+        self._pending = b""
+        self._last_level = (level >> self.data_pin) & 1
+        self._last_tick = None
+        self._new_burst()
+
+    def set_bit_period(self, bit_period_us):
+        """Expect a different nominal bit period from now on."""
+        self.nominal_half_us = bit_period_us / 2
+        self.half_us = self.nominal_half_us
+
+    def _new_burst(self):
+        self._slots = np.zeros(0, dtype=np.uint8)  # Half-bit levels not yet paired
+        self._aligned = False   # Slots start on a bit boundary
+        self._bits = np.zeros(0, dtype=np.uint8)
+        self._synced = False    # SFD seen, bits start on a byte boundary
+
+    def feed(self, buf):
+        """Decode raw report bytes and return every byte completed so far."""
+        buf = self._pending + bytes(buf)
+        whole = len(buf) - len(buf) % REPORT_SIZE
+        self._pending = buf[whole:]
+        ticks, levels = parse_reports(buf[:whole])
+        return self.feed_edges(ticks, levels)
+
+    def feed_edges(self, ticks, levels):
+        """Decode arrays of report ticks and GPIO bank levels."""
+        ticks = np.asarray(ticks, dtype=np.int64)
+        pin = (np.asarray(levels, dtype=np.uint32) >> self.data_pin) & 1
+
+        # Keep only reports where the data pin actually changed
+        previous = np.concatenate(([self._last_level], pin[:-1]))
+        changed = pin != previous
+        ticks, pin = ticks[changed], pin[changed].astype(np.uint8)
+        if len(ticks) == 0:
+            return b""
+
+        if self._last_tick is None:
+            # The first edge only starts the first run
+            self._last_tick, self._last_level = int(ticks[0]), int(pin[0])
+            ticks, pin = ticks[1:], pin[1:]
+            if len(ticks) == 0:
+                return b""
+
+        # Run lengths in half bits; each run has the level before its edge
+        starts = np.concatenate(([self._last_tick], ticks))
+        run_levels = np.concatenate(([self._last_level], pin[:-1])).astype(np.uint8)
+        durations = np.diff(starts) & 0xFFFFFFFF  # Ticks wrap every ~72 minutes
+        self._last_tick, self._last_level = int(ticks[-1]), int(pin[-1])
+
+        halves = np.rint(durations / self.half_us).astype(np.int64)
+        self._track_clock(durations, halves)
+
+        # Split at the idle gaps between bursts
+        out = bytearray()
+        start = 0
+        for gap in np.flatnonzero(halves >= GAP_HALVES):
+            # The run before the gap is the idle line; one half bit of it
+            # completes a final data bit that ended LOW
+            out += self._add_runs(run_levels[start:gap + 1],
+                                  np.append(halves[start:gap], 1))
+            self._new_burst()
+            start = gap + 1
+        out += self._add_runs(run_levels[start:], np.maximum(halves[start:], 1))
+        return bytes(out)
+
+    def _track_clock(self, durations, halves):
+        valid = (halves == 1) | (halves == 2)
+        if not valid.any():
+            return
+        measured = float(np.median(durations[valid] / halves[valid]))
+        # Stay close to the nominal rate so noise cannot run away with it
+        measured = min(max(measured, self.nominal_half_us * 0.75), self.nominal_half_us * 1.25)
+        self.half_us += CLOCK_TRACKING * (measured - self.half_us)
+
+    def _add_runs(self, run_levels, halves):
+        """Expand runs into half-bit levels and decode whatever is complete."""
+        if len(run_levels) == 0:
+            return b""
+        slots = np.concatenate((self._slots, np.repeat(run_levels, halves).astype(np.uint8)))
+
+        if not self._aligned:
+            # Two equal halves in a row only happen across a bit boundary
+            same = np.flatnonzero(slots[:-1] == slots[1:])
+            if len(same) == 0:
+                self._slots = slots
+                return b""
+            slots = slots[(same[0] + 1) % 2:]
+            self._aligned = True
+
+        pairs = len(slots) // 2
+        first, second = slots[0:2 * pairs:2], slots[1:2 * pairs:2]
+        self.code_errors += int(np.count_nonzero(first == second))
+        self._slots = slots[2 * pairs:]
+        bits = np.concatenate((self._bits, second))
+
+        if not self._synced:
+            found = bits.tobytes().find(SYNC_BITS.tobytes())
+            if found < 0:
+                self._bits = bits[-(len(SYNC_BITS) - 1):]
+                return b""
+            bits = bits[found + len(SYNC_BITS):]
+            self._synced = True
+            self.bursts += 1
+
+        whole = len(bits) - len(bits) % 8
+        self._bits = bits[whole:]
+        return np.packbits(bits[:whole]).tobytes()
@@ -0,0 +1,428 @@
+"""
+Request/response encodings for the client and server.
+
+Two encodings share one Request/Response model:
+
+- text: the original HTTP-like lines, e.g. "GET /path HTTP/1.1\\n" plus
+  headers. Easy to read on a logic analyser, kept for debugging.
+- binary: every byte on the wire costs bit periods, so fields are packed:
+
+    request:  method (1) | path | headers | body
+    response: RESPONSE (1) | status varint | headers | body
+
+  headers is a varint count followed by the fields. The path and every
+  header field start with a varint v whose low two bits give the kind and
+  whose remaining bits (v >> 2) the argument, much like HPACK:
+
+    LITERAL          path: argument is its length, UTF-8 bytes follow.
+                     header: argument is a HEADER_TABLE name ID (0 = literal
+                     name follows), then the value; both as varint length
+                     plus bytes.
+    STATIC           argument indexes PATH_TABLE or STATIC_HEADERS.
+    INDEXED          argument indexes the dynamic table, newest entry first.
+    LITERAL_INDEXED  like LITERAL, and the receiver adds it to its dynamic
+                     table so the next occurrence is a single varint.
+
+  The body runs to the end of the message, so Content-Length is dropped.
+
+The dynamic tables belong to one connection: each side keeps one table for
+what it sends and one for what it receives, and the two stay in step
+because every message is decoded in order. A message that fails to decode
+leaves the table as it was. Without tables (table=None) the
+encoder only uses LITERAL and STATIC, so every message stands alone.
+
+Binary messages start with a byte >= 0x80 and text ones with an ASCII
+letter, so a receiver tells them apart from the first byte. Binary bodies
+can hold any byte value, including the null terminator, so the binary
+encoding needs framed Comm. Bodies are bytes-like in both encodings:
+decoders return a memoryview of the received message rather than a copy
+(see textparser.py). A Content-Encoding header (see compression.py) says
+how to unpack them.
+
+A message with "Transfer-Encoding: chunked" is encoded with an empty body
+and its body follows as chunks (see comm.Stream); read_body() collects
+them. "TE: chunked" in a request says the client takes such a response.
+"""
+
+from dataclasses import dataclass, field
+from compression import ACCEPT, DICT_ENCODING, DEFLATE
+from cache import MERGE_PATCH
+from textparser import MessageParser, MessageError
+
+TEXT = "text"
+BINARY = "binary"
+
+METHODS = {"GET": 0x81, "POST": 0x82}
+METHOD_NAMES = {code: name for name, code in METHODS.items()}
+RESPONSE = 0xA0
+CHUNKED = "chunked"            # Transfer-Encoding of streamed bodies
+
+# Shared tables; both sides must use the same ones
+PATH_TABLE = ("/",)
+HEADER_TABLE = (None, "Content-Type", "Content-Length", "Accept-Encoding",
+                "Content-Encoding", "ETag", "If-None-Match", "A-IM", "IM",
+                "Transfer-Encoding", "TE")
+HEADER_IDS = {name.lower(): i for i, name in enumerate(HEADER_TABLE) if name}
+
+STATIC_HEADERS = (("Content-Type", "application/json"),
+                  ("Content-Type", "text/plain"),
+                  ("Content-Encoding", DICT_ENCODING),
+                  ("Content-Encoding", DEFLATE),
+                  ("Accept-Encoding", ACCEPT),
+                  ("A-IM", MERGE_PATCH),
+                  ("IM", MERGE_PATCH),
+                  ("Transfer-Encoding", CHUNKED),
+                  ("TE", CHUNKED))
+
+# Field kinds, the low two bits of a path or header varint
+LITERAL = 0
+STATIC = 1
+INDEXED = 2
+LITERAL_INDEXED = 3
+
+PATH_NAME = ":path"            # Dynamic table name for path entries
+NEVER_INDEX = {"content-length"}  # Changes every time, not worth a table slot
+MIN_INDEX_LENGTH = 3           # Shorter values cost about as much as an index
+DYNAMIC_TABLE_SIZE = 64
+
+REASONS = {200: "OK", 226: "IM Used", 304: "Not Modified", 400: "Bad Request",
+           404: "Not Found"}
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    headers: dict = field(default_factory=dict)
+    body: bytes = b""
+
+
+@dataclass
+class Response:
+    status: int
+    body: bytes = b""
+    headers: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        # A str body is text to send, not an iterable of chunks
+        if isinstance(self.body, str):
+            self.body = self.body.encode('utf-8')
+
+    @property
+    def reason(self):
+        return REASONS.get(self.status, "Unknown")
+
+
+class DynamicTable:
+    """Per-connection table of recently sent (name, value) pairs, newest first."""
+
+    def __init__(self, size=DYNAMIC_TABLE_SIZE):
+        self.size = size
+        self.entries = []
+
+    def find(self, name, value):
+        name = name.lower()
+        for index, (entry_name, entry_value) in enumerate(self.entries):
+            if entry_value == value and entry_name.lower() == name:
+                return index
+        return None
+
+    def get(self, index):
+        if index >= len(self.entries):
+            raise MessageError(f"Unknown dynamic table index {index}")
+        return self.entries[index]
+
+    def add(self, name, value):
+        self.entries.insert(0, (name, value))
+        del self.entries[self.size:]
+
+    def copy(self):
+        table = DynamicTable(self.size)
+        table.entries = list(self.entries)
+        return table
+
+
+def encode_varint(value):
+    """Unsigned LEB128."""
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varint(data, pos):
+    """Return (value, new position)."""
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise MessageError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def is_streamed(body):
+    """True if body is an iterable of chunks rather than bytes (or str)."""
+    return not isinstance(body, (bytes, bytearray, memoryview, str))
+
+
+def read_body(body):
+    """The whole body as bytes-like, collecting chunks if it is streamed."""
+    return b"".join(body) if is_streamed(body) else body
+
+
+def encoding_of(message):
+    """Return BINARY or TEXT depending on the first byte of a message."""
+    return BINARY if message and message[0] >= 0x80 else TEXT
+
+
+# Text encoding
+
+def _text_lines(start_line, headers, body):
+    text = start_line + "\n"
+    for key, value in headers.items():
+        text += f"{key}: {value}\n"
+    text += "\n"
+    return text.encode('utf-8') + body
+
+
+def _parse_text(message, response=False):
+    """Split a text message into start line, headers and body (a
+    memoryview of message; see textparser.py)."""
+    parser = MessageParser(response)
+    parser.feed(message)
+    return parser.finish()
+
+
+def header(headers, name):
+    """Case-insensitive header lookup."""
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def encode_text_request(request):
+    return _text_lines(f"{request.method} {request.path} HTTP/1.1",
+                       request.headers, request.body)
+
+
+def decode_text_request(message):
+    start, headers, body = _parse_text(message)
+    method, path, _ = start.split()
+    return Request(method, path, headers, body)
+
+
+def encode_text_response(response):
+    headers = {"Content-Type": "text/plain"}
+    if header(response.headers, "Transfer-Encoding") != CHUNKED:
+        headers["Content-Length"] = str(len(response.body))
+    headers.update(response.headers)
+    return _text_lines(f"HTTP/1.1 {response.status} {response.reason}",
+                       headers, response.body)
+
+
+def decode_text_response(message):
+    start, headers, body = _parse_text(message, response=True)
+    return Response(int(start.split()[1]), body, headers)
+
+
+# Binary encoding
+
+def _encode_string(text):
+    raw = text.encode('utf-8')
+    return encode_varint(len(raw)) + raw
+
+
+def _decode_string(data, pos):
+    length, pos = decode_varint(data, pos)
+    if pos + length > len(data):
+        raise MessageError("Truncated string")
+    return bytes(data[pos:pos + length]).decode('utf-8'), pos + length
+
+
+def _field(kind, argument):
+    return encode_varint(argument << 2 | kind)
+
+
+def _encode_headers(headers, table=None):
+    items = [(k, str(v)) for k, v in headers.items() if k.lower() != "content-length"]
+    out = bytearray(encode_varint(len(items)))
+    for key, value in items:
+        if (key, value) in STATIC_HEADERS:
+            out += _field(STATIC, STATIC_HEADERS.index((key, value)))
+            continue
+        index = table.find(key, value) if table is not None else None
+        if index is not None:
+            out += _field(INDEXED, index)
+            continue
+
+        kind = LITERAL
+        if (table is not None and key.lower() not in NEVER_INDEX
+                and len(value) >= MIN_INDEX_LENGTH):
+            kind = LITERAL_INDEXED
+            table.add(key, value)
+        key_id = HEADER_IDS.get(key.lower(), 0)
+        out += _field(kind, key_id)
+        if not key_id:
+            out += _encode_string(key)
+        out += _encode_string(value)
+    return bytes(out)
+
+
+def _decode_headers(data, pos, table=None):
+    count, pos = decode_varint(data, pos)
+    headers = {}
+    for _ in range(count):
+        field, pos = decode_varint(data, pos)
+        kind, argument = field & 3, field >> 2
+        if kind == STATIC:
+            if argument >= len(STATIC_HEADERS):
+                raise MessageError(f"Unknown static header {argument}")
+            key, value = STATIC_HEADERS[argument]
+            headers[key] = value
+            continue
+        if kind == INDEXED:
+            if table is None:
+                raise MessageError("Indexed header without a dynamic table")
+            key, value = table.get(argument)
+            headers[key] = value
+            continue
+
+        if argument:
+            if argument >= len(HEADER_TABLE):
+                raise MessageError(f"Unknown header ID {argument}")
+            key = HEADER_TABLE[argument]
+        else:
+            key, pos = _decode_string(data, pos)
+        headers[key], pos = _decode_string(data, pos)
+        if kind == LITERAL_INDEXED:
+            if table is None:
+                raise MessageError("Indexed header without a dynamic table")
+            table.add(key, headers[key])
+    return headers, pos
+
+
+def _encode_path(path, table=None):
+    if path in PATH_TABLE:
+        return _field(STATIC, PATH_TABLE.index(path))
+    index = table.find(PATH_NAME, path) if table is not None else None
+    if index is not None:
+        return _field(INDEXED, index)
+    raw = path.encode('utf-8')
+    kind = LITERAL
+    if table is not None and len(raw) >= MIN_INDEX_LENGTH:
+        kind = LITERAL_INDEXED
+        table.add(PATH_NAME, path)
+    return _field(kind, len(raw)) + raw
+
+
+def _decode_path(data, pos, table=None):
+    field, pos = decode_varint(data, pos)
+    kind, argument = field & 3, field >> 2
+    if kind == STATIC:
+        if argument >= len(PATH_TABLE):
+            raise MessageError(f"Unknown path ID {argument}")
+        return PATH_TABLE[argument], pos
+    if table is None and kind in (INDEXED, LITERAL_INDEXED):
+        raise MessageError("Indexed path without a dynamic table")
+    if kind == INDEXED:
+        name, path = table.get(argument)
+        if name != PATH_NAME:
+            raise MessageError(f"Dynamic entry {argument} is not a path")
+        return path, pos
+    if pos + argument > len(data):
+        raise MessageError("Truncated path")
+    path = bytes(data[pos:pos + argument]).decode('utf-8')
+    if kind == LITERAL_INDEXED:
+        table.add(PATH_NAME, path)
+    return path, pos + argument
+
+
+def encode_binary_request(request, table=None):
+    """table is this connection's DynamicTable for outgoing requests."""
+    if request.method not in METHODS:
+        raise MessageError(f"Unsupported method: {request.method}")
+    out = bytearray([METHODS[request.method]])
+    out += _encode_path(request.path, table)
+    out += _encode_headers(request.headers, table)
+    return bytes(out) + request.body
+
+
+def _staged(table):
+    """Scratch copy of table to decode one message against. Later fields
+    may index entries earlier ones added, so the copy takes every add; it
+    replaces table (see _commit) only once the whole message has decoded,
+    so a message that fails halfway leaves table as it was."""
+    return table.copy() if table is not None else None
+
+
+def _commit(table, staged):
+    if table is not None:
+        table.entries = staged.entries
+
+
+def decode_binary_request(message, table=None):
+    """table is this connection's DynamicTable for incoming requests."""
+    message = memoryview(message)
+    method = METHOD_NAMES.get(message[0])
+    if method is None:
+        raise MessageError(f"Unknown method code 0x{message[0]:02x}")
+    staged = _staged(table)
+    path, pos = _decode_path(message, 1, staged)
+    headers, pos = _decode_headers(message, pos, staged)
+    _commit(table, staged)
+    return Request(method, path, headers, message[pos:])
+
+
+def encode_binary_response(response, table=None):
+    return (bytes([RESPONSE]) + encode_varint(response.status)
+            + _encode_headers(response.headers, table)
+            + response.body)
+
+
+def decode_binary_response(message, table=None):
+    message = memoryview(message)
+    if message[0] != RESPONSE:
+        raise MessageError("Not a binary response")
+    status, pos = decode_varint(message, 1)
+    staged = _staged(table)
+    headers, pos = _decode_headers(message, pos, staged)
+    _commit(table, staged)
+    return Response(status, message[pos:], headers)
+
+
+def encode_request(request, encoding=TEXT, table=None):
+    if encoding == BINARY:
+        return encode_binary_request(request, table)
+    return encode_text_request(request)
+
+
+def decode_request(message, table=None):
+    """Decode a request in whichever encoding it arrived in."""
+    if encoding_of(message) == BINARY:
+        return decode_binary_request(message, table)
+    return decode_text_request(message)
+
+
+def encode_response(response, encoding=TEXT, table=None):
+    if encoding == BINARY:
+        return encode_binary_response(response, table)
+    return encode_text_response(response)
+
+
+def decode_response(message, table=None):
+    """Decode a response in whichever encoding it arrived in."""
+    if encoding_of(message) == BINARY:
+        return decode_binary_response(message, table)
+    return decode_text_response(message)
@@ -0,0 +1,326 @@
+"""
+Logical streams multiplexed over one framed link.
+
+A bulk transfer sent as one message holds the link until it is done, so a
+small request queued behind it waits for all of it. Here every message
+travels on its own stream, cut into chunks, and the link is shared in
+rounds: the side holding the line sends up to round_bytes of chunks picked
+by the scheduler, then hands the line over and the peer does the same. A
+small request therefore waits at most about one round, however much bulk
+data is queued.
+
+Each chunk is one frame whose payload starts with a mux header:
+
+    stream id (2) | kind (1) | priority (1) | data
+
+    DATA    a chunk of the stream's message
+    LAST    the final chunk; the message is complete
+    WINDOW  data is a 4-byte credit increment for the stream
+    IDLE    nothing to send, just handing the line back
+
+Every frame of a round but the last is marked FLAG_MORE. The initiator
+opens streams with odd ids, wrapping round at 65536 past ids still open,
+and the responder answers each on the same stream, with the same priority.
+
+Scheduling: WINDOW frames go first, then streams share the round by
+deficit round robin, each visit adding weight * CHUNK_SIZE bytes of
+allowance, so an INTERACTIVE stream gets 16 times the share of a BULK one
+and a short message usually leaves in its first visit. fair=False sends
+streams first come, first served instead, for comparison.
+
+Flow control: a stream may have at most window bytes in flight. The
+receiver returns credit in WINDOW frames as the data is consumed. Both
+ends must be created with the same window.
+
+Works over anything with send_frames() and receive_frame(): Comm (framed)
+or duplex.FullDuplexComm.
+"""
+
+from collections import deque
+from concurrent.futures import Future
+import struct
+import threading
+from connection import Frame, FrameHeader
+from comm import FLAG_MORE
+
+MUX_HEADER = struct.Struct(">HBB")   # stream id, kind, priority
+WINDOW_UPDATE = struct.Struct(">I")
+
+DATA = 1
+LAST = 2
+WINDOW = 3
+IDLE = 4
+
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+WEIGHTS = {INTERACTIVE: 16, NORMAL: 4, BULK: 1}
+
+CHUNK_SIZE = 1024        # Largest data chunk per frame
+MAX_STREAM_ID = 0xFFFF   # Stream ids are 16 bits and wrap round
+ROUND_BYTES = 8192       # Data bytes one side sends before handing over the line
+INITIAL_WINDOW = 65536   # Bytes a stream may have in flight
+READ_TIMEOUT = 0.1       # Seconds per receive, so the driver thread can stop
+
+
+class MuxStream:
+    """One message in each direction, sharing the link with other streams."""
+
+    def __init__(self, stream_id, priority, window):
+        self.id = stream_id
+        self.priority = priority
+        self.outbox = bytearray()
+        self.out_end = False       # Whole outgoing message queued
+        self.end_sent = False
+        self.credit = window       # Bytes we may still send
+        self.deficit = 0
+        self.inbox = bytearray()
+        self.in_end = False
+        self.unacked = 0           # Bytes consumed but not yet credited to the peer
+        self.future = None         # Initiator: resolves to the response
+
+    @property
+    def sendable(self):
+        if self.end_sent:
+            return False
+        return (self.outbox and self.credit > 0) or (self.out_end and not self.outbox)
+
+
+class Mux:
+    def __init__(self, comm, initiator=True, handler=None, fair=True,
+                 round_bytes=ROUND_BYTES, window=INITIAL_WINDOW):
+        """comm carries the frames. The initiator sends requests with
+        request(); the responder answers every completed stream with
+        handler(message) -> response bytes (default comm.process_message)."""
+        self.comm = comm
+        self.initiator = initiator
+        self.handler = handler if handler is not None else getattr(comm, "process_message", None)
+        self.fair = fair
+        self.round_bytes = round_bytes
+        self.window = window
+        self.rounds = 0
+        self.error = None          # What stopped the driver thread, if anything
+
+        self._streams = {}
+        self._order = deque()      # Stream ids in scheduling order
+        self._control = []         # WINDOW frames waiting to go out
+        self._next_id = 1 if initiator else 2
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    # Application side
+
+    def request(self, message, priority=INTERACTIVE):
+        """Queue a message on a new stream. Returns a Future that resolves
+        to the peer's response."""
+        if not self.initiator:
+            raise ValueError("Only the initiator opens streams")
+        with self._cond:
+            if self.error is not None:
+                raise ConnectionError(f"Mux stopped: {self.error}") from self.error
+            stream = self._open(self._new_id(), priority)
+            stream.outbox += message
+            stream.out_end = True
+            stream.future = Future()
+            self._cond.notify_all()
+        return stream.future
+
+    def send_message(self, message, priority=INTERACTIVE, timeout=None):
+        """Send a message and wait for its response."""
+        return self.request(message, priority).result(timeout)
+
+    def start(self):
+        """Run rounds in a background thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._drive, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _new_id(self):
+        """The next free id of our parity, wrapping round."""
+        for _ in range(MAX_STREAM_ID // 2 + 1):
+            stream_id = self._next_id
+            self._next_id = (self._next_id + 2) & MAX_STREAM_ID
+            if stream_id not in self._streams:
+                return stream_id
+        raise RuntimeError("Every stream id is in use")
+
+    def _open(self, stream_id, priority):
+        stream = MuxStream(stream_id, priority, self.window)
+        self._streams[stream_id] = stream
+        self._order.append(stream_id)
+        return stream
+
+    # Rounds
+
+    def _drive(self):
+        try:
+            while self._running:
+                if self.initiator:
+                    with self._cond:
+                        # Only take the line when there is something to send or receive
+                        self._cond.wait_for(lambda: self._streams or not self._running)
+                    if self._running:
+                        self.run_round()
+                else:
+                    try:
+                        self._receive_round(READ_TIMEOUT)
+                    except TimeoutError:
+                        continue
+                    self._send_round()
+        except Exception as e:
+            print(f"Mux stopped: {e}")
+            self._fail(e)
+
+    def _fail(self, error):
+        """Stop, failing every request still waiting for its response."""
+        with self._cond:
+            self.error = error
+            self._running = False
+            streams = list(self._streams.values())
+            self._streams.clear()
+            self._order.clear()
+        for stream in streams:
+            if stream.future is not None and not stream.future.done():
+                stream.future.set_exception(error)
+
+    def run_round(self):
+        """Initiator: send one round, then receive the peer's."""
+        self._send_round()
+        self._receive_round()
+
+    def serve_round(self, timeout=None):
+        """Responder: receive one round, then answer with ours."""
+        self._receive_round(timeout)
+        self._send_round()
+
+    def _send_round(self):
+        with self._cond:
+            frames = self._control + self._schedule()
+            self._control = []
+        if not frames:
+            frames = [self._frame(0, IDLE, INTERACTIVE)]
+        for frame in frames[:-1]:
+            frame.header.flags |= FLAG_MORE
+        self.comm.send_frames(frames)
+        self.rounds += 1
+
+    def _receive_round(self, timeout=None):
+        while True:
+            frame = self.comm.receive_frame(timeout)
+            timeout = None     # Only the first frame may time out; the rest follow at once
+            with self._cond:
+                self._handle(frame.payload)
+            if not frame.header.flags & FLAG_MORE:
+                break
+        self._complete()
+
+    def _frame(self, stream_id, kind, priority, data=b""):
+        frame = Frame(FrameHeader(seq=self._seq),
+                      MUX_HEADER.pack(stream_id, kind, priority) + bytes(data))
+        self._seq = (self._seq + 1) & 0xFFFF
+        return frame
+
+    def _schedule(self):
+        """Data frames for one round, within budget and credit."""
+        frames = []
+        budget = self.round_bytes
+        while budget > 0:
+            ready = [sid for sid in self._order if self._streams[sid].sendable]
+            if not ready:
+                break
+            if not self.fair:
+                ready = ready[:1]      # First come, first served
+            for stream_id in ready:
+                stream = self._streams[stream_id]
+                stream.deficit += CHUNK_SIZE * WEIGHTS[stream.priority]
+                while stream.sendable and budget > 0 and (stream.deficit > 0 or not self.fair):
+                    size = min(len(stream.outbox), CHUNK_SIZE, stream.credit, budget)
+                    data = bytes(stream.outbox[:size])
+                    del stream.outbox[:size]
+                    stream.credit -= size
+                    stream.deficit -= size
+                    budget -= size
+                    last = stream.out_end and not stream.outbox
+                    frames.append(self._frame(stream.id, LAST if last else DATA,
+                                              stream.priority, data))
+                    if last:
+                        stream.end_sent = True
+                if not stream.sendable:
+                    stream.deficit = 0
+                if budget <= 0:
+                    break
+                if self.fair:
+                    # Visit the next stream first next time
+                    self._order.remove(stream_id)
+                    self._order.append(stream_id)
+        return frames
+
+    def _handle(self, payload):
+        if len(payload) < MUX_HEADER.size:
+            return
+        stream_id, kind, priority = MUX_HEADER.unpack_from(payload)
+        data = payload[MUX_HEADER.size:]
+        if kind == IDLE:
+            return
+        stream = self._streams.get(stream_id)
+        if kind == WINDOW:
+            if stream is not None:
+                stream.credit += WINDOW_UPDATE.unpack(data)[0]
+            return
+        if stream is None:
+            if self.initiator:
+                return         # Response to a stream we gave up on
+            stream = self._open(stream_id, priority)
+        stream.inbox += data
+        if kind == LAST:
+            stream.in_end = True
+        else:
+            self._consume(stream, len(data))
+
+    def _consume(self, stream, size):
+        """Credit consumed bytes back to the sender, in batches."""
+        stream.unacked += size
+        if stream.unacked >= self.window // 2:
+            self._control.append(self._frame(stream.id, WINDOW, stream.priority,
+                                             WINDOW_UPDATE.pack(stream.unacked)))
+            stream.unacked = 0
+
+    def _complete(self):
+        """Deliver messages that finished arriving this round."""
+        with self._cond:
+            done = [s for s in self._streams.values() if s.in_end and s.inbox is not None]
+        for stream in done:
+            message = bytes(stream.inbox)
+            stream.inbox = None
+            if self.initiator:
+                with self._cond:
+                    self._close(stream)
+                stream.future.set_result(message)
+            else:
+                try:
+                    response = self.handler(message)
+                except Exception as e:
+                    # Still answer, so the initiator's request completes
+                    print(f"Handler failed: {e}")
+                    response = b""
+                with self._cond:
+                    stream.outbox += response
+                    stream.out_end = True
+        with self._cond:
+            for stream in [s for s in self._streams.values() if s.end_sent and s.inbox is None]:
+                self._close(stream)
+
+    def _close(self, stream):
+        self._streams.pop(stream.id, None)
+        if stream.id in self._order:
+            self._order.remove(stream.id)
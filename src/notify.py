@@ -0,0 +1,153 @@
+"""
+Bulk receiver built on pigpio's notification pipe.
+
+pigpiod writes a 12 byte report (seqno, flags, tick, level) to /dev/pigpioN
+for every change on the monitored GPIOs. Reading that pipe in large chunks and
+decoding the reports with NumPy replaces the per-bit pi.read() polling loop:
+no edge is lost to the poll interval and a whole buffer of bytes is decoded
+in one go. The decoder only looks at the level words, so it can be fed a
+recorded edge stream as easily as the live pipe.
+"""
+
+import os
+import select
+import numpy as np
+from lanes import LaneMap
+
+# Layout of one pigpio notification report
+REPORT_DTYPE = np.dtype([
+    ('seqno', '<u2'),
+    ('flags', '<u2'),
+    ('tick', '<u4'),
+    ('level', '<u4'),
+])
+REPORT_SIZE = REPORT_DTYPE.itemsize
+
+READ_SIZE = REPORT_SIZE * 4096  # Reports pulled from the pipe per read
+
+
+def parse_reports(buf):
+    """Return the (ticks, levels) arrays of the level-change reports in buf.
+    Watchdog, keep-alive and event reports are dropped."""
+    reports = np.frombuffer(buf, dtype=REPORT_DTYPE, count=len(buf) // REPORT_SIZE)
+    reports = reports[reports['flags'] == 0]
+    return reports['tick'], reports['level']
+
+
+def pack_reports(samples, seqno=0):
+    """Build raw report bytes from (tick, level) pairs.
+    Handy for replaying a recorded edge stream through the decoder."""
+    reports = np.zeros(len(samples), dtype=REPORT_DTYPE)
+    for i, (tick, level) in enumerate(samples):
+        reports[i] = ((seqno + i) & 0xFFFF, 0, tick & 0xFFFFFFFF, level)
+    return reports.tobytes()
+
+
+class ClockedDecoder:
+    """Turn GPIO level reports into bytes, sampling data on rising clock edges
+    (or on every clock edge in DDR mode)."""
+
+    def __init__(self, data_pin, clock_pin, lanes=None, ddr=False):
+        """lanes is an optional LaneMap; by default data_pin is the only lane."""
+        self.data_pin = data_pin
+        self.clock_pin = clock_pin
+        self.lanes = lanes or LaneMap([data_pin])
+        self.ddr = ddr
+        self.reset()
+
+    @property
+    def mask(self):
+        """GPIOs the decoder needs reports for."""
+        return self.lanes.mask | (1 << self.clock_pin)
+
+    def reset(self, level=0):
+        """Forget any partial byte and report. level is the current GPIO bank level."""
+        self._pending = b""
+        self._bits = np.zeros(0, dtype=np.uint8)
+        self._last_clock = (level >> self.clock_pin) & 1
+
+    def feed(self, buf):
+        """Decode raw report bytes and return every byte completed so far."""
+        buf = self._pending + bytes(buf)
+        whole = len(buf) - len(buf) % REPORT_SIZE
+        self._pending = buf[whole:]
+        _, levels = parse_reports(buf[:whole])
+        return self.feed_levels(levels)
+
+    def feed_levels(self, levels):
+        """Decode an array of GPIO bank levels and return the completed bytes."""
+        levels = np.asarray(levels, dtype=np.uint32)
+        if len(levels) == 0:
+            return b""
+
+        clock = (levels >> self.clock_pin) & 1
+        previous = np.empty_like(clock)
+        previous[0] = self._last_clock
+        previous[1:] = clock[:-1]
+        self._last_clock = int(clock[-1])
+
+        # Sample every lane wherever the clock went from low to high,
+        # or wherever it changed at all in DDR mode
+        if self.ddr:
+            edges = clock != previous
+        else:
+            edges = (clock == 1) & (previous == 0)
+        bits = np.concatenate((self._bits, self.lanes.bits(levels[edges])))
+
+        whole = len(bits) - len(bits) % 8
+        self._bits = bits[whole:]
+        return np.packbits(bits[:whole]).tobytes()
+
+
+class NotifyReceiver:
+    def __init__(self, pi, data_pin, clock_pin, lanes=None, ddr=False, decoder=None):
+        """Open a notification pipe on an already connected pigpio.pi.
+        Reports only flow between begin() and pause().
+        decoder replaces the ClockedDecoder, e.g. a linecode.ManchesterDecoder."""
+        self.pi = pi
+        self.decoder = decoder or ClockedDecoder(data_pin, clock_pin, lanes, ddr)
+
+        self.handle = self.pi.notify_open()
+        if self.handle < 0:
+            raise RuntimeError("Could not open pigpio notification pipe")
+        self.fd = os.open(f"/dev/pigpio{self.handle}", os.O_RDONLY | os.O_NONBLOCK)
+
+    def set_lanes(self, lanes):
+        """Decode with a different LaneMap from the next begin() on."""
+        self.decoder.lanes = lanes
+
+    def set_ddr(self, ddr):
+        """Sample on both clock edges from now on."""
+        self.decoder.ddr = ddr
+
+    def begin(self):
+        """Start reporting edges, discarding anything left in the pipe."""
+        self._drain()
+        self.decoder.reset(self.pi.read_bank_1())
+        self.pi.notify_begin(self.handle, self.decoder.mask)
+
+    def pause(self):
+        """Stop reporting edges (e.g. while we drive the pins ourselves)."""
+        self.pi.notify_pause(self.handle)
+
+    def read(self, timeout=None):
+        """Wait for reports and return the bytes they complete.
+        Returns b"" if nothing arrived within timeout seconds."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return b""
+        try:
+            return self.decoder.feed(os.read(self.fd, READ_SIZE))
+        except BlockingIOError:
+            return b""
+
+    def _drain(self):
+        try:
+            while os.read(self.fd, READ_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        self.pi.notify_close(self.handle)
+        os.close(self.fd)
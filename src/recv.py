@@ -1,5 +1,12 @@
 import pigpio
 import time
+import argparse
+from notify import NotifyReceiver
+from linecode import ManchesterDecoder
+from waveform import DEFAULT_BIT_PERIOD_US
+from connection import FrameDecoder
+from fec import FecCodec, DEFAULT_DEPTH
+from lanes import LaneMap
 
 # GPIO pins (BCM numbering)
 DATA_PIN  = 23
@@ -49,37 +56,98 @@ def on_clock_rising(gpio, level, tick):
         current_byte = 0
         bit_count = 0
 
+def receive_bulk(data_pins, ddr=False, manchester_period_us=None):
+    """Decode bytes in bulk from the notification pipe until Ctrl-C.
+    manchester_period_us selects self-clocking Manchester decoding."""
+    decoder = None
+    if manchester_period_us:
+        decoder = ManchesterDecoder(data_pins[0], manchester_period_us)
+    receiver = NotifyReceiver(pi, data_pins[0], CLOCK_PIN, LaneMap(data_pins), ddr, decoder)
+    receiver.begin()
+    try:
+        while True:
+            data = receiver.read(timeout=1.0)
+            received.extend(data)
+            print(data.decode('utf-8', errors='backslashreplace'), end='', flush=True)
+    finally:
+        receiver.close()
+
 def main():
     global pi
+    parser = argparse.ArgumentParser(description='Receive bytes over GPIO pins')
+    parser.add_argument('-n', '--notify', action='store_true',
+                      help='Decode in bulk from the pigpio notification pipe '
+                           '(needed for waveform-rate senders)')
+    parser.add_argument('-d', '--data-pins', type=int, nargs='+', default=[DATA_PIN],
+                      help='Data lane GPIOs, in the sender\'s order (needs --notify '
+                           'for more than one lane)')
+    parser.add_argument('--ddr', action='store_true',
+                      help='Sample data on both clock edges (sender uses --ddr)')
+    parser.add_argument('-m', '--manchester', action='store_true',
+                      help='Sender uses self-clocking Manchester code (needs --notify)')
+    parser.add_argument('-p', '--bit-period', type=int, default=DEFAULT_BIT_PERIOD_US,
+                      help='Nominal bit period in microseconds for --manchester')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-f', '--framed', action='store_true',
+                      help='Sender uses CRC-checked frames; only write valid payloads')
+    group.add_argument('--fec', choices=['secded', 'rs'],
+                      help='Sender uses forward error correction; repair before writing')
+    parser.add_argument('--fec-depth', type=int, default=DEFAULT_DEPTH,
+                      help='Interleaver depth in codewords (must match the sender)')
+    args = parser.parse_args()
+    if len(args.data_pins) > 1 and not args.notify:
+        parser.error('multiple data lanes need --notify')
+    if args.manchester and (not args.notify or len(args.data_pins) > 1):
+        parser.error('--manchester needs --notify and a single data pin')
+
     # Initialize pigpio
     pi = pigpio.pi()
     if not pi.connected:
         raise RuntimeError("Could not connect to pigpio daemon")
 
     # Set up pins as inputs with pull-downs
-    pi.set_mode(DATA_PIN, pigpio.INPUT)
+    for pin in args.data_pins:
+        pi.set_mode(pin, pigpio.INPUT)
+        pi.set_pull_up_down(pin, pigpio.PUD_DOWN)
     pi.set_mode(CLOCK_PIN, pigpio.INPUT)
     pi.set_mode(LATCH_PIN, pigpio.INPUT)
-    pi.set_pull_up_down(DATA_PIN, pigpio.PUD_DOWN)
     pi.set_pull_up_down(CLOCK_PIN, pigpio.PUD_DOWN)
     pi.set_pull_up_down(LATCH_PIN, pigpio.PUD_DOWN)
 
-    # Set up callback for rising edge
-    cb = pi.callback(CLOCK_PIN, pigpio.RISING_EDGE, on_clock_rising)
+    # Set up callback for rising edge (every edge for DDR)
+    cb = None
+    if not args.notify:
+        edge = pigpio.EITHER_EDGE if args.ddr else pigpio.RISING_EDGE
+        cb = pi.callback(CLOCK_PIN, edge, on_clock_rising)
 
     print("Waiting for data...  Press Ctrl-C to stop.")
     try:
+        if args.notify:
+            receive_bulk(args.data_pins, args.ddr,
+                         args.bit_period if args.manchester else None)
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         print("\nStopping.")
     finally:
-        cb.cancel()  # Cancel the callback
+        if cb is not None:
+            cb.cancel()  # Cancel the callback
         pi.stop()    # Stop pigpio
         # write all bytes out
+        data = received
+        if args.framed:
+            decoder = FrameDecoder()
+            frames = decoder.feed(received)
+            data = b"".join(frame.payload for frame in frames)
+            print(f"\nDecoded {len(frames)} frames "
+                  f"({decoder.crc_errors} CRC errors, {decoder.skipped_bytes} bytes skipped)")
+        elif args.fec:
+            codec = FecCodec(args.fec, depth=args.fec_depth)
+            data = codec.decode(received)
+            print(f"\nFEC: {codec.stats}")
         with open("received.bin", "wb") as f:
-            f.write(received)
-        print(f"\nWrote {len(received)} bytes to received.bin")
+            f.write(data)
+        print(f"\nWrote {len(data)} bytes to received.bin")
 
 if __name__ == "__main__":
     main()
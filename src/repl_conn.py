@@ -5,26 +5,25 @@ for interactive use in a Python interpreter.
 """
 
 from connection import Connection
+from waveform import DEFAULT_BIT_PERIOD_US
 import time
 
 class InteractiveConnection:
-    def __init__(self, data_pin=23, clock_pin=24):
-        """Initialize the connection with default pins (23 for data, 24 for clock)."""
-        self.conn = Connection(data_pin, clock_pin)
+    def __init__(self, data_pin=23, clock_pin=24, waveform=False,
+                 bit_period_us=DEFAULT_BIT_PERIOD_US):
+        """Initialize the connection with default pins (23 for data, 24 for clock).
+        waveform=True sends each call as a single DMA waveform chain."""
+        self.conn = Connection(data_pin, clock_pin, waveform=waveform,
+                               bit_period_us=bit_period_us)
         
     def send(self, message: str):
         """Send a text message."""
-        # Convert string to bytes and send
-        data = message.encode('utf-8')
-        for byte in data:
-            self.conn.send_byte(byte)
-        # Send a newline to mark end of message
-        self.conn.send_byte(ord('\n'))
+        # Convert string to bytes and send, with a newline to mark the end
+        self.send_bytes(message.encode('utf-8') + b'\n')
         
     def send_bytes(self, data: bytes):
         """Send raw bytes."""
-        for byte in data:
-            self.conn.send_byte(byte)
+        self.conn.send_bytes(data)
             
     def cleanup(self):
         """Clean up the connection."""
@@ -0,0 +1,91 @@
+"""
+Request routing for the server.
+
+A Router maps (method, path) to a handler. Patterns are compiled when they
+are added:
+
+    "/"                  static, matched with one dict lookup
+    "/sensors/{id}"      {name} matches one path segment
+    "/files/{rest:path}" {name:path} matches the rest of the path
+
+Parameterised routes are tried most specific first: more literal text
+wins, and {name:path} routes come after all others. The handler is called
+as handler(request, **params) and returns a Response.
+"""
+
+import re
+from urllib.parse import parse_qs
+
+_PARAM = re.compile(r"\{(\w+)(?::(path))?\}")
+
+
+class RouteError(LookupError):
+    """No route matches a request."""
+
+
+def split_query(path):
+    """Split "/a/b?list&limit=10" into ("/a/b", {"list": "", "limit": "10"})."""
+    path, _, query = path.partition("?")
+    return path, {key: values[-1] for key, values in
+                  parse_qs(query, keep_blank_values=True).items()}
+
+
+class _Route:
+    def __init__(self, pattern, handler):
+        self.pattern = pattern
+        self.handler = handler
+        regex = ""
+        position = 0
+        literal = 0
+        self.greedy = False
+        for match in _PARAM.finditer(pattern):
+            text = pattern[position:match.start()]
+            regex += re.escape(text)
+            literal += len(text)
+            if match.group(2):
+                regex += f"(?P<{match.group(1)}>.+)"
+                self.greedy = True
+            else:
+                regex += f"(?P<{match.group(1)}>[^/]+)"
+            position = match.end()
+        regex += re.escape(pattern[position:])
+        literal += len(pattern) - position
+        self.regex = re.compile(regex + r"\Z")
+        self.order = (self.greedy, -literal)
+
+
+class Router:
+    def __init__(self):
+        self._static = {}    # (method, path) -> handler
+        self._dynamic = {}   # method -> [_Route], most specific first
+
+    def add(self, method, pattern, handler):
+        """Register handler for method and pattern."""
+        method = method.upper()
+        if not _PARAM.search(pattern):
+            self._static[(method, pattern)] = handler
+            return
+        routes = self._dynamic.setdefault(method, [])
+        routes.append(_Route(pattern, handler))
+        routes.sort(key=lambda route: route.order)
+
+    def route(self, method, pattern):
+        """Decorator form of add()."""
+        def register(handler):
+            self.add(method, pattern, handler)
+            return handler
+        return register
+
+    def match(self, method, path):
+        """Return (handler, params) for a path without its query string."""
+        method = method.upper()
+        handler = self._static.get((method, path))
+        if handler is not None:
+            return handler, {}
+        for route in self._dynamic.get(method, ()):
+            match = route.regex.match(path)
+            if match:
+                return route.handler, match.groupdict()
+        if method not in self._dynamic and all(m != method for m, _ in self._static):
+            raise RouteError(f"Unsupported method: {method}")
+        raise RouteError(f"Path not found: {path}")
@@ -1,89 +1,316 @@
 """
 Server implementation using the GPIO communication protocol.
-Handles HTTP-like requests with GET and POST methods.
+Handles HTTP-like requests with GET and POST methods, in the text or the
+compact binary encoding (see messages.py), answering in whichever one the
+request used.
+
+Every stored value carries an ETag. A GET whose If-None-Match names the
+current one gets an empty 304 Not Modified; a client that also sends
+"A-IM: merge-patch" and holds a recent version may get a 226 with a JSON
+merge patch instead of the whole value (see cache.py).
+
+Encoded GET responses are kept in a byte-bounded LRU until the value is
+replaced, so a repeated GET is a lookup instead of serialising, compressing
+and encoding it again. Cached binary responses are encoded without the
+dynamic header table, which would otherwise change under them. Most GETs
+from a caching client are revalidations answered 304, so those are cached
+too; a 304 has no body to save work on and its ETag would cost more bytes
+than the table index it gets, so it is kept as a Response and encoded
+with the table each time.
+
+Values live in a storage backend (see storage.py): in memory by default,
+or in a write-ahead log and snapshot with --data-dir, so they survive a
+restart. A POST is acknowledged once its value meets the durability level.
+
+Requests are dispatched through a route table (see routing.py). Besides the
+built-in routes, GET /prefix/?list returns the keys under a prefix a page
+at a time: limit=N sets the page size, after=KEY continues from the "next"
+key of the previous page and values includes the values themselves.
+
+Large bodies can be streamed both ways (framed mode). A POST with
+"Transfer-Encoding: chunked" reaches its handler with request.body an
+iterator of chunks as they arrive, and a handler may return a Response
+whose body is an iterable of bytes chunks. Clients that send "TE: chunked"
+get stored values serialised and sent a chunk at a time.
+
+Requests may be handled on several threads at once (see worker_pool);
+self.lock guards the ETags, history, response cache and header tables.
+That only pays where requests from several clients arrive over one node,
+as on a bus (see bus.py). run() answers the one client of a half-duplex
+link a request at a time, in order, so it handles them on its own thread.
 """
 
-from comm import Comm
+from comm import Comm, Stream
+from connection import FRAME_PAYLOAD
+from messages import (CHUNKED, Response, DynamicTable, decode_request, encode_response,
+                      encode_text_request, encode_text_response, encoding_of, header,
+                      is_streamed, read_body)
+from compression import ACCEPT, choose_encoding, compress, decompress
+from cache import LRUCache, MERGE_PATCH, make_etag, etag_matches, make_merge_patch
+from routing import Router, RouteError, split_query
+from textparser import MessageParser
+from storage import MemoryStorage, LogStorage, DURABILITY_LEVELS, SYNCED
+from transport import SocketTransport
+from workers import WorkerPool, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE
+from collections import OrderedDict
+from dataclasses import replace
+import argparse
+import threading
 import time
 import json
 
+HISTORY_DEPTH = 4   # Past versions per path kept to send merge patches against
+RESPONSE_CACHE_BYTES = 256 * 1024
+LIST_LIMIT = 100     # Keys per page of a ?list query, unless it asks for fewer
+MAX_LIST_LIMIT = 1000
+NOT_MODIFIED = 304   # Response cache key of a 304, in place of a merge patch base
+
+class Exchange:
+    """A request on its way through the server (see Server.decode_message)."""
+    
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.request = None
+        self.response = None
+        self.cache_key = None    # Where to cache the encoded response, see _cache_key
+        self.encoded = None      # A cached response, sent as it is
+        
 class Server(Comm):
-    def __init__(self, data_pin=23, clock_pin=24, latch_pin=25):
+    def __init__(self, data_pin=23, clock_pin=24, latch_pin=25,
+                 response_cache_bytes=RESPONSE_CACHE_BYTES, storage=None,
+                 durability=None, **kwargs):
+        """response_cache_bytes bounds the encoded GET responses kept for
+        reuse; 0 turns the cache off. storage holds the values (default
+        MemoryStorage); durability is the level POSTs wait for, or None for
+        the storage's own default."""
         # Initialize without latch pin
-        super().__init__(data_pin, clock_pin, latch_pin=latch_pin)
+        super().__init__(data_pin, clock_pin, latch_pin=latch_pin, **kwargs)
         self.running = False
-        self.data = {}  # Simple in-memory storage
+        self.data = storage if storage is not None else MemoryStorage()
+        self.durability = durability
+        self.etags = {}     # Path -> ETag of the value in self.data
+        self.history = {}   # Path -> OrderedDict of recent ETag -> value
+        self.lock = threading.RLock()
+        
+        # Header tables (binary encoding only), a pair per peer; see _tables
+        self.tables = {}
+        
+        # Route table; register more handlers with self.router.add()
+        self.router = Router()
+        self.router.add("GET", "/", self._route_get)
+        self.router.add("GET", "/{key:path}", self._route_get)
+        self.router.add("POST", "/{key:path}", self._route_post)
+        
+        # Encoded GET responses, see _cache_key
+        self.response_cache = (LRUCache(response_cache_bytes, sizeof=_cached_size)
+                               if response_cache_bytes else None)
+        
+    def process_message(self, message, peer=None):
+        """Process HTTP-like request and return response.
+        The response uses the encoding the request arrived in. peer names
+        the client when several share the link (a bus address)."""
+        return self.encode_reply(self.handle_request(self.decode_message(message, peer)), peer)
+        
+    def process_stream(self, head, chunks, peer=None):
+        """Process a request with a streamed body. Its handler gets
+        request.body as an iterator of chunks that arrive as it reads them."""
+        return self.process_message(Stream(head, chunks), peer)
+        
+    def _message_parser(self):
+        return MessageParser()
         
-    def process_message(self, message):
-        """Process HTTP-like request and return response."""
+    def worker_pool(self, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE):
+        """A WorkerPool answering requests with this server. Requests are
+        decoded as they are submitted and responses encoded as they come
+        back, so the header tables see every message in wire order and
+        only the handlers run side by side. For a BusNode's pool; see the
+        module docstring."""
+        return WorkerPool(self.handle_request, workers, queue_size,
+                          decode=self.decode_message, encode=self.encode_reply)
+        
+    def _tables(self, peer):
+        """The (rx, tx) header tables of peer. Each client's tables follow
+        only the messages it exchanges with us, so they are kept apart."""
+        with self.lock:
+            if peer not in self.tables:
+                self.tables[peer] = (DynamicTable(), DynamicTable())
+            return self.tables[peer]
+        
+    # A request is answered in three steps. decode_message and encode_reply
+    # update the header tables, so they run in the order the messages cross
+    # the link; handle_request may run on any thread.
+        
+    def decode_message(self, message, peer=None):
+        """Parse a request (a Stream if its body is streamed) with peer's
+        header table. Returns the Exchange handle_request takes."""
+        chunks = None
+        if isinstance(message, Stream):
+            message, chunks = message.head, message.chunks
+        exchange = Exchange(encoding_of(message))
+        try:
+            request = decode_request(message, self._tables(peer)[0])
+            if chunks is not None:
+                request.body = chunks
+            else:
+                request.body = decompress(request.body, header(request.headers, "Content-Encoding"))
+            exchange.request = request
+        except Exception as e:
+            exchange.response = self._error_response(f"Error processing request: {str(e)}")
+        return exchange
+        
+    def handle_request(self, exchange):
+        """Answer the request in exchange, from the cache or its route, and
+        return the exchange."""
+        if exchange.response is not None:
+            # It could not be decoded
+            self._print_error(exchange.response)
+            return exchange
+        request = exchange.request
         try:
-            # Parse the request
-            request_str = message.decode('utf-8')
-            
             # Print request
             print("\nReceived request:")
             print("=" * 40)
-            print(request_str, end="")
+            print(encode_text_request(_printable(request)).decode('utf-8'), end="")
             print("\n" + "=" * 40)
             
-            # Split into lines
-            lines = request_str.strip().split('\n')
-            if not lines:
-                return self._error_response("Empty request")
-                
-            # Parse request line (e.g., "GET /path HTTP/1.1")
-            request_line = lines[0].strip()
-            parts = request_line.split()
-            if len(parts) != 3:
-                return self._error_response("Invalid request line")
-                
-            method, path, version = parts
-            
-            # Parse headers
-            headers = {}
-            body = ""
-            in_body = False
-            for line in lines[1:]:
-                if not in_body and line.strip() == "":
-                    in_body = True
-                    continue
-                if in_body:
-                    body += line + "\n"
+            with self.lock:
+                key = self._cache_key(request, exchange.encoding)
+                cached = self.response_cache.get(key) if key is not None else None
+            if key is not None:
+                if cached is not None:
+                    print(f"\nSending cached response for {request.path} "
+                          f"({_cached_size(cached)} bytes)")
+                    if isinstance(cached, Response):
+                        exchange.response = cached   # A 304, see encode_reply
+                    else:
+                        exchange.encoded = cached
+                    return exchange
+                    
+            # Handle request based on its route
+            response = self._dispatch(request)
+            if is_streamed(response.body):
+                if self.framed:
+                    response.headers["Transfer-Encoding"] = CHUNKED
                 else:
-                    if ":" in line:
-                        key, value = line.split(":", 1)
-                        headers[key.strip()] = value.strip()
-            
-            # Handle request based on method
-            if method == "GET":
-                response = self._handle_get(path, headers)
-            elif method == "POST":
-                response = self._handle_post(path, headers, body)
-            else:
-                response = self._error_response(f"Unsupported method: {method}")
+                    # Streams need frames; send the body whole instead
+                    response.body = read_body(response.body)
                 
             # Print response
             print("\nSending response:")
             print("=" * 40)
-            print(response.decode('utf-8'), end="")
+            print(encode_text_response(_printable(response)).decode('utf-8'), end="")
             print("\n" + "=" * 40)
             
-            return response
-                
+            # Compress for clients that accept it, and tell them what we accept
+            accept = header(request.headers, "Accept-Encoding")
+            if accept and not is_streamed(response.body):
+                response.body, coding = compress(response.body, accept)
+                if coding:
+                    response.headers["Content-Encoding"] = coding
+                response.headers["Accept-Encoding"] = ACCEPT
+            exchange.response = response
+            exchange.cache_key = key
+        except Exception as e:
+            exchange.response = self._error_response(f"Error processing request: {str(e)}")
+            self._print_error(exchange.response)
+        return exchange
+        
+    def encode_reply(self, exchange, peer=None):
+        """The response in exchange as bytes, or a Stream if its body is
+        streamed, encoded with peer's header table."""
+        if exchange.encoded is not None:
+            return exchange.encoded
+        response = exchange.response
+        tx_table = self._tables(peer)[1]
+        try:
+            if is_streamed(response.body):
+                # Head now, body chunks as the handler produces them
+                head = encode_response(replace(response, body=b""), exchange.encoding, tx_table)
+                return Stream(head, response.body)
+            key = exchange.cache_key
+            if key is not None and response.status == 304:
+                # Cached as it is; the header table makes the ETag one byte
+                self._cache_response(key, response, response)
+                key = None
+            if key is None:
+                return encode_response(response, exchange.encoding, tx_table)
+            encoded = encode_response(response, exchange.encoding)
+            self._cache_response(key, response, encoded)
+            return encoded
         except Exception as e:
             response = self._error_response(f"Error processing request: {str(e)}")
-            print("\nSending error response:")
-            print("=" * 40)
-            print(response.decode('utf-8'), end="")
-            print("\n" + "=" * 40)
-            return response
+            self._print_error(response)
+            return encode_response(response, exchange.encoding, tx_table)
+            
+    def _cache_response(self, key, response, cached):
+        with self.lock:
+            # Not if a POST replaced the value while we were encoding it
+            current = response.headers.get("ETag") == self.etags.get(key[0])
+            if response.status in (200, 226, 304) and current:
+                self.response_cache.put(key, cached)
             
+    def _print_error(self, response):
+        print("\nSending error response:")
+        print("=" * 40)
+        print(encode_text_response(response).decode('utf-8'), end="")
+        print("\n" + "=" * 40)
+        
+    def _dispatch(self, request):
+        """Route a request to its handler. The handler sees the path
+        without its query string."""
+        path, query = split_query(request.path)
+        if request.method == "GET" and "list" in query:
+            return self._handle_list(path, query)
+        try:
+            handler, params = self.router.match(request.method, path)
+        except RouteError as e:
+            return self._error_response(str(e))
+        return handler(replace(request, path=path), **params)
+        
+    def _route_get(self, request, **params):
+        return self._handle_get(request.path, request.headers)
+        
+    def _route_post(self, request, **params):
+        return self._handle_post(request.path, request.headers,
+                                 str(read_body(request.body), 'utf-8'))
+        
+    def _cache_key(self, request, encoding):
+        """Key of the encoded response to a GET, or None if it is not cached.
+        Everything the encoded bytes depend on is in the key: the path, the
+        encoding, the coding the client accepts and, for a merge patch, the
+        version it is against (NOT_MODIFIED for a 304)."""
+        path = request.path
+        if self.response_cache is None or request.method != "GET" or path not in self.data:
+            return None
+        if CHUNKED in (header(request.headers, "TE") or ""):
+            return None     # Streamed, see _handle_get
+        if_none_match = header(request.headers, "If-None-Match")
+        base = None
+        if etag_matches(if_none_match, self._etag(path)):
+            base = NOT_MODIFIED
+        elif MERGE_PATCH in (header(request.headers, "A-IM") or ""):
+            history = self.history.get(path, {})
+            base = next((etag.strip() for etag in (if_none_match or "").split(",")
+                         if etag.strip() in history), None)
+        accept = header(request.headers, "Accept-Encoding")
+        coding = choose_encoding(accept) if accept else False
+        return path, encoding, coding, base
+        
     def _handle_get(self, path, headers):
         """Handle GET request."""
         if path == "/":
             return self._success_response("Server is running")
         elif path in self.data:
-            return self._success_response(json.dumps(self.data[path]))
+            etag = self._etag(path)
+            if etag_matches(header(headers, "If-None-Match"), etag):
+                return Response(304, b"", {"ETag": etag})
+            if CHUNKED in (header(headers, "TE") or ""):
+                # Serialise and send a chunk at a time
+                return Response(200, _json_chunks(self.data[path]), {"ETag": etag})
+            body = json.dumps(self.data[path])
+            response = self._patch_response(path, headers, body) or self._success_response(body)
+            response.headers["ETag"] = etag
+            return response
         else:
             return self._error_response(f"Path not found: {path}")
             
@@ -91,29 +318,88 @@ class Server(Comm):
         """Handle POST request."""
         try:
             data = json.loads(body)
-            self.data[path] = data
+            self._store(path, data)
             return self._success_response(f"Data stored at {path}")
         except json.JSONDecodeError:
             return self._error_response("Invalid JSON in request body")
             
+    def _handle_list(self, prefix, query):
+        """Handle GET prefix?list: one page of the keys under prefix, in
+        order, and the key to continue after (None on the last page)."""
+        try:
+            limit = int(query.get("limit", LIST_LIMIT))
+        except ValueError:
+            return self._error_response(f"Invalid limit: {query['limit']}")
+        if limit < 1:
+            return self._error_response(f"Invalid limit: {limit}")
+        limit = min(limit, MAX_LIST_LIMIT)
+        
+        # One extra key tells us whether there is another page
+        keys = self.data.scan(prefix, query.get("after"), limit + 1)
+        more = len(keys) > limit
+        keys = keys[:limit]
+        if "values" in query:
+            result = {"values": {key: self.data[key] for key in keys}}
+        else:
+            result = {"keys": keys}
+        result["next"] = keys[-1] if more else None
+        return self._success_response(json.dumps(result))
+        
+    def _store(self, path, data):
+        """Store a value under path and give it a new ETag."""
+        etag = make_etag(json.dumps(data).encode('utf-8'))
+        self.data.put(path, data, self.durability)
+        with self.lock:
+            self.etags[path] = etag
+            if self.response_cache is not None:
+                self.response_cache.remove_if(lambda key: key[0] == path)
+            history = self.history.setdefault(path, OrderedDict())
+            history.pop(etag, None)
+            history[etag] = data
+            while len(history) > HISTORY_DEPTH:
+                history.popitem(last=False)
+            
+    def _etag(self, path):
+        """ETag of the value at path. Values loaded from storage get theirs
+        on first use."""
+        with self.lock:
+            if path not in self.etags:
+                self.etags[path] = make_etag(_json_chunks(self.data[path]))
+            return self.etags[path]
+        
+    def _patch_response(self, path, headers, body):
+        """A 226 merge patch against the client's cached version, if the
+        client accepts one, we still have its version and the patch is
+        smaller than body. Otherwise None."""
+        if MERGE_PATCH not in (header(headers, "A-IM") or ""):
+            return None
+        history = self.history.get(path, {})
+        for etag in (header(headers, "If-None-Match") or "").split(","):
+            old = history.get(etag.strip())
+            if old is None:
+                continue
+            patch = make_merge_patch(old, self.data[path])
+            if patch is None:
+                return None
+            patch = json.dumps(patch)
+            if len(patch) >= len(body):
+                return None
+            return Response(226, patch.encode('utf-8'), {"IM": MERGE_PATCH})
+        return None
+        
     def _success_response(self, body):
         """Create a success response."""
-        response = "HTTP/1.1 200 OK\n"
-        response += "Content-Type: text/plain\n"
-        response += f"Content-Length: {len(body)}\n"
-        response += "\n"
-        response += body
-        return response.encode('utf-8')
+        return Response(200, body.encode('utf-8'))
         
     def _error_response(self, message):
         """Create an error response."""
-        response = "HTTP/1.1 400 Bad Request\n"
-        response += "Content-Type: text/plain\n"
-        response += f"Content-Length: {len(message)}\n"
-        response += "\n"
-        response += message
-        return response.encode('utf-8')
+        return Response(400, message.encode('utf-8'))
             
+    def cleanup(self):
+        """Flush storage and clean up GPIO resources."""
+        self.data.close()
+        super().cleanup()
+        
     def run(self):
         """Run the server, continuously waiting for messages."""
         self.running = True
@@ -123,11 +409,60 @@ class Server(Comm):
         try:
             while self.running:
                 self.receive_message()
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, ConnectionError) as e:
+            if isinstance(e, ConnectionError):
+                print(f"\n{e}")  # The client's transport was closed
             print("\nServer stopping...")
+            if self.response_cache is not None:
+                print(f"Response cache: {self.response_cache.stats}")
         finally:
             self.cleanup()
             
+def _json_chunks(value, size=FRAME_PAYLOAD):
+    """Serialise value to JSON as bytes chunks of about size bytes, without
+    building the whole string. Same output as json.dumps."""
+    pieces = []
+    length = 0
+    for piece in json.JSONEncoder().iterencode(value):
+        pieces.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(pieces).encode('utf-8')
+            pieces = []
+            length = 0
+    if pieces:
+        yield "".join(pieces).encode('utf-8')
+        
+def _cached_size(cached):
+    """Bytes a response cache entry is charged: an encoded response, or a
+    304 kept as a Response (see encode_reply)."""
+    if isinstance(cached, Response):
+        return sum(len(name) + len(value) for name, value in cached.headers.items())
+    return len(cached)
+    
+def _printable(message):
+    """The message, with a placeholder for a streamed body."""
+    if is_streamed(message.body):
+        return replace(message, body=b"<streamed body>")
+    return message
+    
 if __name__ == "__main__":
-    server = Server()
+    parser = argparse.ArgumentParser(description='Serve requests over GPIO pins')
+    parser.add_argument('--data-dir',
+                        help='Keep values in a write-ahead log and snapshot in this directory')
+    parser.add_argument('--durability', choices=DURABILITY_LEVELS, default=SYNCED,
+                        help='When a POST is acknowledged (with --data-dir)')
+    parser.add_argument('--socket',
+                        help='Serve over a Unix socket at this path instead of the pins')
+    args = parser.parse_args()
+    
+    storage = None
+    if args.data_dir:
+        storage = LogStorage(args.data_dir, durability=args.durability)
+        print(f"Loaded {len(storage)} values from {args.data_dir}")
+    transport = None
+    if args.socket:
+        print(f"Waiting for a client on {args.socket}")
+        transport = SocketTransport.listen(args.socket)
+    server = Server(storage=storage, transport=transport)
     server.run()
\ No newline at end of file
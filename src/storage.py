@@ -0,0 +1,426 @@
+"""
+Storage backends for Server.data.
+
+MemoryStorage keeps values in memory and loses everything on restart.
+Both backends keep their keys sorted in a KeyIndex, so scan() lists the
+keys under a prefix at a cost proportional to the result, not the store.
+
+LogStorage keeps the same mapping durable in a directory:
+
+- wal.log, an append-only write-ahead log. Every put() appends a record
+
+    crc32 (4) | key length (4) | value length (4) | key | value
+
+  with the value as JSON (length TOMBSTONE for a deletion). A writer thread
+  takes everything queued since its last write and writes and fsyncs it in
+  one go, so concurrent writers share an fsync (group commit).
+- snapshot.dat, a compacted copy of the whole mapping, written every
+  snapshot_records log records and on close(), after which the log starts
+  over. The file is values back to back, then an index of
+  (key, offset, length) and a footer pointing at the index. On startup it
+  is memory-mapped and only the index is read; values of lazy_bytes or
+  more are decoded from the mapping when read instead of being held in
+  memory. Recovery then replays the log on top.
+
+How long put() waits is its durability level:
+
+    MEMORY   return at once, the record is written in the background
+    WRITTEN  return once the record is written to the file (survives the
+             process crashing, not the Pi losing power)
+    SYNCED   return once the record is fsynced
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import MutableMapping
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+MEMORY = "memory"
+WRITTEN = "written"
+SYNCED = "synced"
+DURABILITY_LEVELS = (MEMORY, WRITTEN, SYNCED)
+
+LOG_NAME = "wal.log"
+SNAPSHOT_NAME = "snapshot.dat"
+
+RECORD_HEADER = struct.Struct("<III")       # crc32, key length, value length
+INDEX_ENTRY = struct.Struct("<IQI")         # key length, offset, value length
+FOOTER = struct.Struct("<QII8s")            # index offset, entries, index crc32, magic
+SNAPSHOT_MAGIC = b"GPIOSNP1"
+TOMBSTONE = 0xFFFFFFFF
+
+DEFAULT_SNAPSHOT_RECORDS = 10000
+DEFAULT_LAZY_BYTES = 1024
+
+
+class StorageError(IOError):
+    """The log or snapshot could not be read or written."""
+
+
+class KeyIndex:
+    """Sorted keys for prefix and range scans."""
+
+    def __init__(self, keys=()):
+        self._keys = sorted(keys)
+
+    def add(self, key):
+        position = bisect_left(self._keys, key)
+        if position == len(self._keys) or self._keys[position] != key:
+            self._keys.insert(position, key)
+
+    def discard(self, key):
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+    def scan(self, prefix="", after=None, limit=None):
+        """Keys starting with prefix, in order, beginning after the key
+        after (for paging), at most limit of them."""
+        if after is not None and after >= prefix:
+            start = bisect_right(self._keys, after)
+        else:
+            start = bisect_left(self._keys, prefix)
+        result = []
+        for position in range(start, len(self._keys)):
+            key = self._keys[position]
+            if not key.startswith(prefix) or len(result) == limit:
+                break
+            result.append(key)
+        return result
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class MemoryStorage(MutableMapping):
+    """In-memory storage, the default."""
+
+    def __init__(self):
+        self._entries = {}
+        self._index = KeyIndex()
+
+    def __getitem__(self, key):
+        return self._entries[key]
+
+    def __setitem__(self, key, value):
+        if key not in self._entries:
+            self._index.add(key)
+        self._entries[key] = value
+
+    def __delitem__(self, key):
+        del self._entries[key]
+        self._index.discard(key)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, key, value, durability=None):
+        self[key] = value
+
+    def scan(self, prefix="", after=None, limit=None):
+        return self._index.scan(prefix, after, limit)
+
+    def snapshot(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Lazy:
+    """A value still in the snapshot mapping."""
+    __slots__ = ("offset", "length")
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+
+_DELETED = object()
+
+
+def _encode_record(key, value):
+    raw_key = key.encode('utf-8')
+    if value is _DELETED:
+        raw_value, length = b"", TOMBSTONE
+    else:
+        raw_value = json.dumps(value).encode('utf-8')
+        length = len(raw_value)
+    crc = zlib.crc32(raw_value, zlib.crc32(raw_key))
+    return RECORD_HEADER.pack(crc, len(raw_key), length) + raw_key + raw_value
+
+
+def _decode_records(data):
+    """Yield (key, raw value or None for a deletion, end offset) for every
+    intact record, stopping at the first torn or corrupt one."""
+    pos = 0
+    while pos + RECORD_HEADER.size <= len(data):
+        crc, key_length, length = RECORD_HEADER.unpack_from(data, pos)
+        start = pos + RECORD_HEADER.size
+        value_length = 0 if length == TOMBSTONE else length
+        end = start + key_length + value_length
+        if end > len(data):
+            return
+        raw_key = data[start:start + key_length]
+        raw_value = data[start + key_length:end]
+        if zlib.crc32(raw_value, zlib.crc32(raw_key)) != crc:
+            return
+        yield raw_key.decode('utf-8'), None if length == TOMBSTONE else raw_value, end
+        pos = end
+
+
+class LogStorage(MutableMapping):
+    """Durable mapping of path -> JSON value in directory. See the module
+    docstring for the files and durability levels."""
+
+    def __init__(self, directory, durability=SYNCED,
+                 snapshot_records=DEFAULT_SNAPSHOT_RECORDS, lazy_bytes=DEFAULT_LAZY_BYTES):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level: {durability}")
+        self.directory = directory
+        self.durability = durability
+        self.snapshot_records = snapshot_records
+        self.lazy_bytes = lazy_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._log_path = os.path.join(directory, LOG_NAME)
+        self._snapshot_path = os.path.join(directory, SNAPSHOT_NAME)
+
+        self._entries = {}
+        self._map = None
+        self._snapshot_file = None
+        self._load_snapshot()
+        self.log_records = self._replay_log()
+        self._index = KeyIndex(self._entries)
+
+        # Group commit state, guarded by _cond
+        self._cond = threading.Condition()
+        self._pending = []
+        self._queued = 0     # Sequence number of the last queued record
+        self._written = 0    # ... of the last one written to the file
+        self._synced = 0     # ... of the last one fsynced
+        self._error = None
+        self._closing = False
+        self._log = open(self._log_path, "ab")
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    # Mapping interface
+
+    def __getitem__(self, key):
+        # A snapshot swaps the entries and the mapping their offsets point into
+        with self._cond:
+            value = self._entries[key]
+            if isinstance(value, _Lazy):
+                raw = self._map[value.offset:value.offset + value.length]
+            else:
+                return value
+        return json.loads(raw)
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __delitem__(self, key):
+        if key not in self._entries:
+            raise KeyError(key)
+        self._append(key, _DELETED, self.durability)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, key, value, durability=None):
+        """Store value and return once it meets durability (default: the
+        level given to the constructor)."""
+        durability = durability or self.durability
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level: {durability}")
+        self._append(key, value, durability)
+
+    def scan(self, prefix="", after=None, limit=None):
+        """Keys under prefix in order; see KeyIndex.scan."""
+        with self._cond:
+            return self._index.scan(prefix, after, limit)
+
+    # Write-ahead log
+
+    def _append(self, key, value, durability):
+        record = _encode_record(key, value)
+        with self._cond:
+            if self._error:
+                raise StorageError(f"Log write failed: {self._error}")
+            if value is _DELETED:
+                del self._entries[key]
+                self._index.discard(key)
+            else:
+                if key not in self._entries:
+                    self._index.add(key)
+                self._entries[key] = value
+            self._pending.append(record)
+            self._queued += 1
+            sequence = self._queued
+            self._cond.notify_all()
+            if durability == WRITTEN:
+                self._wait_for(lambda: self._written >= sequence)
+            elif durability == SYNCED:
+                self._wait_for(lambda: self._synced >= sequence)
+            self.log_records += 1
+            if self.log_records >= self.snapshot_records:
+                self._snapshot_locked()
+
+    def _wait_for(self, predicate):
+        self._cond.wait_for(lambda: predicate() or self._error)
+        if self._error:
+            raise StorageError(f"Log write failed: {self._error}")
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closing)
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, []
+                sequence = self._queued
+            try:
+                self._log.write(b"".join(batch))
+                self._log.flush()
+                with self._cond:
+                    self._written = sequence
+                    self._cond.notify_all()
+                os.fsync(self._log.fileno())
+            except OSError as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._synced = sequence
+                self._cond.notify_all()
+
+    def _replay_log(self):
+        """Apply the log on top of the snapshot. A torn record at the end,
+        left by a crash mid-write, is cut off."""
+        if not os.path.exists(self._log_path):
+            return 0
+        with open(self._log_path, "rb") as f:
+            data = f.read()
+        records = 0
+        end = 0
+        for key, raw_value, end in _decode_records(data):
+            if raw_value is None:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = json.loads(raw_value)
+            records += 1
+        if end < len(data):
+            print(f"Discarding {len(data) - end} bytes of torn log at offset {end}")
+            with open(self._log_path, "r+b") as f:
+                f.truncate(end)
+        return records
+
+    # Snapshots
+
+    def _open_snapshot(self):
+        self._snapshot_file = open(self._snapshot_path, "rb")
+        self._map = mmap.mmap(self._snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _load_snapshot(self):
+        if not os.path.exists(self._snapshot_path):
+            return
+        self._open_snapshot()
+        if len(self._map) < FOOTER.size:
+            raise StorageError("Snapshot is truncated")
+        index_offset, count, crc, magic = FOOTER.unpack_from(self._map, len(self._map) - FOOTER.size)
+        index = self._map[index_offset:len(self._map) - FOOTER.size]
+        if magic != SNAPSHOT_MAGIC or zlib.crc32(index) != crc:
+            raise StorageError("Snapshot index is corrupt")
+        pos = 0
+        for _ in range(count):
+            key_length, offset, length = INDEX_ENTRY.unpack_from(index, pos)
+            pos += INDEX_ENTRY.size
+            key = index[pos:pos + key_length].decode('utf-8')
+            pos += key_length
+            if length >= self.lazy_bytes:
+                self._entries[key] = _Lazy(offset, length)
+            else:
+                self._entries[key] = json.loads(self._map[offset:offset + length])
+
+    def snapshot(self):
+        """Write a compacted snapshot now and start a new log."""
+        with self._cond:
+            self._snapshot_locked()
+
+    def _snapshot_locked(self):
+        self._wait_for(lambda: self._synced >= self._queued)
+        temp_path = self._snapshot_path + ".tmp"
+        entries = {}
+        index = bytearray()
+        offset = 0
+        with open(temp_path, "wb") as f:
+            for key, value in self._entries.items():
+                if isinstance(value, _Lazy):
+                    raw = self._map[value.offset:value.offset + value.length]
+                else:
+                    raw = json.dumps(value).encode('utf-8')
+                f.write(raw)
+                raw_key = key.encode('utf-8')
+                index += INDEX_ENTRY.pack(len(raw_key), offset, len(raw)) + raw_key
+                # Large values are dropped from memory and read back lazily
+                entries[key] = _Lazy(offset, len(raw)) if len(raw) >= self.lazy_bytes else value
+                offset += len(raw)
+            f.write(index)
+            f.write(FOOTER.pack(offset, len(self._entries), zlib.crc32(index), SNAPSHOT_MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._snapshot_path)
+        self._sync_directory()
+
+        # Everything is in the snapshot, start the log over
+        self._log.truncate(0)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self.log_records = 0
+
+        self._close_snapshot()
+        self._open_snapshot()
+        self._entries = entries
+
+    def _sync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _close_snapshot(self):
+        if self._map is not None:
+            self._map.close()
+            self._snapshot_file.close()
+            self._map = None
+            self._snapshot_file = None
+
+    def close(self, snapshot=True):
+        """Flush the log, compacting it into the snapshot unless
+        snapshot=False, and stop the writer."""
+        with self._cond:
+            if snapshot and self.log_records and not self._error:
+                self._snapshot_locked()
+            self._closing = True
+            self._cond.notify_all()
+        self._writer.join()
+        self._log.close()
+        self._close_snapshot()
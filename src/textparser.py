@@ -0,0 +1,140 @@
+"""
+Incremental parser for text requests and responses.
+
+feed() takes bytes as they arrive and returns True once the message is
+complete; finish() says no more are coming (the null terminator or the end
+of the frame) and returns the start line, headers and body, from which
+messages.py builds the Request or Response. Every byte is looked at
+once: the head is scanned line by line from where the last feed stopped,
+each line is checked as soon as it is complete, and malformed input raises
+MessageError right away instead of after the whole body has arrived.
+On an unframed link Comm feeds it each message's bytes as they come in
+(see Comm._receive_until_terminator) and drops the rest of a message it
+rejects instead of buffering it.
+
+With Content-Length the body is exactly that many bytes after the blank
+line and is returned as a memoryview of the received data, not a copy.
+Without it the body runs to the end of the message, minus surrounding
+whitespace unless it has a Content-Encoding, as the text encoding always
+did. Bodies can therefore be any
+bytes-like object; use str(body, 'utf-8') or bytes(body) to get a copy.
+"""
+
+MAX_LINE = 4096      # Longest start or header line
+MAX_HEAD = 16384     # Longest start line and headers together
+_WHITESPACE = b" \t\r\n"
+
+
+class MessageError(ValueError):
+    """A message could not be decoded."""
+
+
+class MessageParser:
+    def __init__(self, response=False, max_body=None):
+        """Parses a request, or a response if response is True. max_body, if
+        given, rejects larger Content-Length values before their body
+        arrives."""
+        self.response = response
+        self.max_body = max_body
+        self._buffer = b""
+        self._line_start = 0     # Where the next unparsed head line starts
+        self.start_line = None
+        self.headers = {}
+        self.body_start = None   # Set once the blank line after the head is seen
+        self.content_length = None
+        self._encoded = False    # Content-Encoding set, body must not be stripped
+
+    def feed(self, data):
+        """Add received bytes. Returns True once Content-Length bytes of
+        body are in (a message without one is complete at finish())."""
+        if not self._buffer and isinstance(data, (bytes, bytearray)):
+            self._buffer = data      # Common case, the whole message at once
+        else:
+            if not isinstance(self._buffer, bytearray):
+                self._buffer = bytearray(self._buffer)
+            self._buffer += data
+        if self.body_start is None:
+            self._parse_head()
+        return self.complete
+
+    @property
+    def parsed(self):
+        """Bytes up to the end of the last head line looked at."""
+        return self._line_start
+
+    @property
+    def complete(self):
+        return (self.body_start is not None and self.content_length is not None
+                and len(self._buffer) >= self.body_start + self.content_length)
+
+    def _parse_head(self):
+        buffer = self._buffer
+        while self.body_start is None:
+            end = buffer.find(b"\n", self._line_start)
+            if end < 0:
+                if len(buffer) - self._line_start > MAX_LINE:
+                    raise MessageError("Line too long")
+                return
+            if end - self._line_start > MAX_LINE or end > MAX_HEAD:
+                raise MessageError("Message head too long")
+            line = bytes(buffer[self._line_start:end]).strip()
+            self._line_start = end + 1
+            if self.start_line is None:
+                if line:        # Blank lines before the start line are ignored
+                    self._parse_start_line(line.decode('utf-8'))
+            elif not line:
+                self.body_start = end + 1
+            else:
+                self._parse_header(line.decode('utf-8'))
+
+    def _parse_start_line(self, line):
+        parts = line.split()
+        if not self.response:
+            if len(parts) != 3:
+                raise MessageError("Invalid request line")
+        elif len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+            raise MessageError("Invalid status line")
+        self.start_line = line
+
+    def _parse_header(self, line):
+        key, colon, value = line.partition(":")
+        if not colon or not key.strip():
+            raise MessageError(f"Malformed header line: {line[:40]}")
+        key = key.strip()
+        self.headers[key] = value.strip()
+        if key.lower() == "content-encoding":
+            self._encoded = True
+        elif key.lower() == "content-length":
+            if not self.headers[key].isdigit():
+                raise MessageError(f"Invalid Content-Length: {self.headers[key]}")
+            self.content_length = int(self.headers[key])
+            if self.max_body is not None and self.content_length > self.max_body:
+                raise MessageError(f"Body of {self.content_length} bytes is too large")
+
+    def finish(self):
+        """End of the message: return (start line, headers, body)."""
+        if self.start_line is None:
+            raise MessageError("Empty response" if self.response else "Empty request")
+        view = memoryview(self._buffer)
+        if self.body_start is None:
+            body = view[len(view):]     # Head only, no blank line
+        elif self.content_length is not None:
+            if not self.complete:
+                raise MessageError("Truncated body")
+            body = view[self.body_start:self.body_start + self.content_length]
+        else:
+            body = view[self.body_start:]
+            if not self._encoded:
+                body = _strip(body)
+        return self.start_line, self.headers, body
+
+
+def _strip(view):
+    """memoryview without leading and trailing whitespace."""
+    start, end = 0, len(view)
+    while start < end and view[start] in _WHITESPACE:
+        start += 1
+    while end > start and view[end - 1] in _WHITESPACE:
+        end -= 1
+    return view[start:end]
+
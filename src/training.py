@@ -0,0 +1,400 @@
+"""
+Link training: find the fastest bit period the wiring between two boards
+can carry, instead of hand-tuning delays with timing_test.py.
+
+Both sides must use framed Comm. Link-management frames carry FLAG_CONTROL
+and start with a one byte control type. (Flags 0x01-0x04 belong to arq.py.)
+
+Training, run by the initiator (normally the client):
+1. For each candidate period, fastest last, send a burst of TRAIN frames
+   holding a known pseudo-random pattern at that period. The last one is
+   TRAIN_END. The responder counts the frames that arrived intact and sends
+   a REPORT at the safe period named in the TRAIN frames.
+2. The bit error rate is estimated from the frame loss, and the fastest
+   period meeting the target is slowed down by SAFETY_MARGIN.
+3. A RATE frame at the safe period tells the responder the agreed period;
+   it answers RATE_ACK and both sides switch. If no RATE_ACK comes back
+   the initiator keeps its old period.
+
+Because the receiver follows the sender's clock, only the sender's period
+matters, so the responder never has to guess the rate of a burst.
+
+Lane setup comes first when data_pins lists several lanes. The link always
+starts on lane 0. A LANE_TEST frame announces a raw burst of a known pattern
+on every lane; the responder samples it, compares each lane's bit stream with
+the pattern (including a +/-1 clock shift to spot skew) and sends a
+LANE_REPORT. Lanes that are clean and not skewed are kept, the widest usable
+bus (8, 4, 2 or 1 lanes) is agreed with a LANES frame, and the rest of
+training runs on it.
+
+Optional features are negotiated next: HELLO carries the initiator's
+capability bits and the responder answers CAPS with its own; both sides then
+enable what they share. A peer that predates negotiation ignores HELLO, so
+the initiator times out and keeps the basic SDR link. Rate probing runs
+after this, so the agreed period holds for the mode actually in use.
+"""
+
+from dataclasses import dataclass
+import math
+import random
+import struct
+import time
+from connection import Frame, FrameHeader
+from lanes import LANE_WIDTHS, lane_errors
+
+FLAG_CONTROL = 0x10
+
+CTRL_TRAIN = 1
+CTRL_TRAIN_END = 2
+CTRL_REPORT = 3
+CTRL_RATE = 4
+CTRL_RATE_ACK = 5
+CTRL_LANE_TEST = 6
+CTRL_LANE_REPORT = 7
+CTRL_LANES = 8
+CTRL_LANES_ACK = 9
+CTRL_HELLO = 10
+CTRL_CAPS = 11
+
+CAP_DDR = 0x01    # Data on both clock edges
+
+TRAIN = struct.Struct(">BHHI")   # type, index, total, reply period (us)
+REPORT = struct.Struct(">BHH")   # type, frames received, frames expected
+RATE = struct.Struct(">BI")      # type, agreed period (us)
+LANE_TEST = struct.Struct(">BBH")  # type, lane bitmask, pattern length
+LANE_RESULT = struct.Struct(">IIb")  # errors, bits, skew (clocks), per lane
+LANES = struct.Struct(">BB")     # type, lane bitmask
+CAPS = struct.Struct(">BB")      # type, capability bits
+
+CANDIDATE_PERIODS_US = [2000, 1000, 500, 250, 128, 64, 32, 16, 8]
+TARGET_BER = 1e-5
+SAFETY_MARGIN = 1.25        # Agreed period = fastest good period * margin
+BURST_FRAMES = 16
+PATTERN_BYTES = 128
+REPLY_TIMEOUT = 2.0         # Seconds to wait for a REPORT or RATE_ACK
+BURST_IDLE_TIMEOUT = 0.5    # Responder gives up on a burst after this
+RETRAIN_ERROR_RATE = 0.05   # Frame error rate that triggers retraining
+RETRAIN_MIN_FRAMES = 20     # Frames to observe before judging drift
+LANE_PATTERN_BYTES = 256
+LANE_ERROR_LIMIT = 0.001    # Share of wrong bits that disqualifies a lane
+LANE_SWITCH_DELAY = 0.05    # Time for the responder to switch lanes
+
+
+def training_pattern(index):
+    """Known pattern for a training frame, with plenty of bit transitions."""
+    return random.Random(index).randbytes(PATTERN_BYTES)
+
+
+def lane_pattern(length=LANE_PATTERN_BYTES):
+    """Known pattern for lane tests."""
+    return random.Random(0xA5).randbytes(length)
+
+
+def lane_mask(lanes):
+    mask = 0
+    for lane in lanes:
+        mask |= 1 << lane
+    return mask
+
+
+def mask_lanes(mask):
+    return [lane for lane in range(8) if mask >> lane & 1]
+
+
+def control_type(frame):
+    """Return the control type of a link-management frame, or None."""
+    if frame.header.flags & FLAG_CONTROL and frame.payload:
+        return frame.payload[0]
+    return None
+
+
+def estimate_ber(received, expected, bits_per_frame):
+    """Bit error rate implied by losing frames of bits_per_frame bits."""
+    if received >= expected:
+        return 0.0
+    if received == 0:
+        return 0.5
+    frame_error_rate = 1 - received / expected
+    return -math.log1p(-frame_error_rate) / bits_per_frame
+
+
+@dataclass
+class TrainingResult:
+    period_us: int
+    ber: float
+    received: int
+    expected: int
+
+
+class LinkTrainer:
+    def __init__(self, comm, safe_period_us=None, target_ber=TARGET_BER,
+                 candidates=CANDIDATE_PERIODS_US):
+        """comm is a framed Comm. safe_period_us defaults to its current period."""
+        self.comm = comm
+        self.safe_period_us = safe_period_us or comm.bit_period_us
+        self.target_ber = target_ber
+        self.candidates = sorted(candidates, reverse=True)
+        self.history = []      # TrainingResult per candidate of the last run
+        self.lane_results = []  # (errors, bits, skew) per lane of the last lane test
+        self.trainings = 0
+        self._marks = (0, 0)   # (frames, errors) when the rate was last agreed
+
+    @property
+    def period_us(self):
+        """The agreed bit period in microseconds."""
+        return self.comm.bit_period_us
+
+    def train(self):
+        """Run link training as the initiator and return the agreed period."""
+        if len(self.comm.data_pins) > 1:
+            self.train_lanes()
+        self.negotiate()
+
+        self.history = []
+        best = None
+        for period in self.candidates:
+            if period > self.safe_period_us:
+                continue
+            result = self._probe(period)
+            self.history.append(result)
+            print(f"Training {period}us: {result.received}/{result.expected} frames, "
+                  f"BER ~{result.ber:.1e}")
+            if result.ber > self.target_ber:
+                break  # Faster periods will only be worse
+            best = period
+
+        if best is None:
+            agreed = self.safe_period_us
+        else:
+            agreed = max(best, math.ceil(best * SAFETY_MARGIN))
+            agreed = min(agreed, self.safe_period_us)
+        if not self._agree(agreed):
+            agreed = self.period_us
+        self.trainings += 1
+        rate = 1_000_000 / agreed / 1000
+        print(f"Link trained: {agreed}us bit period (~{rate:.1f} kbit/s raw)")
+        return agreed
+
+    def train_lanes(self):
+        """Test every data lane and switch to the widest healthy bus.
+        Returns the lane indices in use."""
+        all_lanes = list(range(len(self.comm.data_pins)))
+        self.comm.set_lanes([0])
+        self.lane_results = self._probe_lanes(all_lanes)
+
+        healthy = [0]  # Lane 0 carried the control frames, so it works
+        for lane, (errors, bits, skew) in zip(all_lanes, self.lane_results):
+            if lane and skew == 0 and errors <= bits * LANE_ERROR_LIMIT:
+                healthy.append(lane)
+            elif lane:
+                print(f"Lane {lane} (GPIO {self.comm.data_pins[lane]}) unusable: "
+                      f"{errors}/{bits} bit errors, skew {skew}")
+        width = max(w for w in LANE_WIDTHS if w <= len(healthy))
+        chosen = healthy[:width]
+
+        self._agree_lanes(chosen)
+        print(f"Using {width} data lane(s): GPIO "
+              f"{', '.join(str(self.comm.data_pins[i]) for i in chosen)}")
+        return chosen
+
+    def _probe_lanes(self, lanes):
+        pattern = lane_pattern()
+        test = LANE_TEST.pack(CTRL_LANE_TEST, lane_mask(lanes), len(pattern))
+        self.comm.send_frame(Frame(FrameHeader(flags=FLAG_CONTROL), test))
+
+        # Raw pattern on every lane, then back to the base lane for the report
+        time.sleep(LANE_SWITCH_DELAY)
+        self.comm.set_lanes(lanes)
+        try:
+            self.comm.send_raw(pattern)
+        finally:
+            self.comm.set_lanes([0])
+
+        try:
+            reply = self._wait_control(CTRL_LANE_REPORT)
+        except TimeoutError:
+            return [(0, 0, 0)] + [(1, 1, 0)] * (len(lanes) - 1)
+        return [LANE_RESULT.unpack_from(reply.payload, 1 + i * LANE_RESULT.size)
+                for i in range(len(lanes))]
+
+    def _agree_lanes(self, lanes):
+        frame = Frame(FrameHeader(flags=FLAG_CONTROL), LANES.pack(CTRL_LANES, lane_mask(lanes)))
+        for _ in range(3):
+            self.comm.send_frame(frame)
+            try:
+                self._wait_control(CTRL_LANES_ACK)
+                break
+            except TimeoutError:
+                continue
+        else:
+            # Without an ACK we cannot know what the peer uses; stay on lane 0
+            print("Peer did not confirm lanes, staying on one lane")
+            return
+        self.comm.set_lanes(lanes)
+
+    def capabilities(self):
+        """Capability bits this side can offer on the current lanes."""
+        caps = 0
+        if self.comm.ddr_capable and self.comm.lanes.symbols_per_byte % 2 == 0:
+            caps |= CAP_DDR
+        return caps
+
+    def negotiate(self):
+        """Agree optional features with the peer and switch them on.
+        Returns the shared capability bits."""
+        offered = self.capabilities()
+        if not offered:
+            return 0
+
+        frame = Frame(FrameHeader(flags=FLAG_CONTROL), CAPS.pack(CTRL_HELLO, offered))
+        for _ in range(3):
+            self.comm.send_frame(frame)
+            try:
+                reply = self._wait_control(CTRL_CAPS)
+                break
+            except TimeoutError:
+                continue
+        else:
+            print("Peer did not answer HELLO, keeping single data rate")
+            return 0
+
+        _, theirs = CAPS.unpack_from(reply.payload)
+        shared = offered & theirs
+        self._apply(shared)
+        return shared
+
+    def _apply(self, caps):
+        self.comm.set_ddr(bool(caps & CAP_DDR))
+        print(f"Clocking: {'DDR' if caps & CAP_DDR else 'SDR'}")
+
+    def needs_retrain(self):
+        """True once the observed frame error rate has drifted past the limit."""
+        frames, errors = self._counters()
+        frames -= self._marks[0]
+        errors -= self._marks[1]
+        if frames + errors < RETRAIN_MIN_FRAMES:
+            return False
+        return errors / (frames + errors) > RETRAIN_ERROR_RATE
+
+    def _counters(self):
+        decoder = self.comm.frame_decoder
+        return (self.comm.frames_received,
+                decoder.crc_errors + decoder.header_errors)
+
+    def _probe(self, period):
+        frames = []
+        for index in range(BURST_FRAMES):
+            kind = CTRL_TRAIN_END if index == BURST_FRAMES - 1 else CTRL_TRAIN
+            payload = TRAIN.pack(kind, index, BURST_FRAMES, self.safe_period_us)
+            frames.append(Frame(FrameHeader(seq=index, flags=FLAG_CONTROL),
+                                payload + training_pattern(index)))
+        bits = len(frames[0].encode()) * 8
+
+        self.comm.set_bit_period(period)
+        try:
+            self.comm.send_frames(frames)
+        finally:
+            self.comm.set_bit_period(self.safe_period_us)
+
+        try:
+            reply = self._wait_control(CTRL_REPORT)
+        except TimeoutError:
+            return TrainingResult(period, 0.5, 0, BURST_FRAMES)
+        _, received, expected = REPORT.unpack_from(reply.payload)
+        return TrainingResult(period, estimate_ber(received, expected, bits),
+                              received, expected)
+
+    def _agree(self, period):
+        """Tell the peer the new period, then switch ourselves.
+        Without a RATE_ACK we cannot tell whether the peer switched, so
+        keep the old, known-good period. Returns True if we switched."""
+        frame = Frame(FrameHeader(flags=FLAG_CONTROL), RATE.pack(CTRL_RATE, period))
+        for _ in range(3):
+            self.comm.send_frame(frame)
+            try:
+                self._wait_control(CTRL_RATE_ACK)
+                break
+            except TimeoutError:
+                continue
+        else:
+            print(f"Peer did not confirm {period}us, staying at {self.period_us}us")
+            return False
+        self.comm.set_bit_period(period)
+        self._marks = self._counters()
+        return True
+
+    def _wait_control(self, kind):
+        deadline = time.monotonic() + REPLY_TIMEOUT
+        while True:
+            frame = self.comm.receive_frame(timeout=max(0.0, deadline - time.monotonic()))
+            if control_type(frame) == kind:
+                return frame
+
+    def respond(self, frame):
+        """Handle a link-management frame received by the responder."""
+        kind = control_type(frame)
+        if kind in (CTRL_TRAIN, CTRL_TRAIN_END):
+            self._respond_burst(frame)
+        elif kind == CTRL_RATE:
+            _, period = RATE.unpack_from(frame.payload)
+            ack = Frame(FrameHeader(flags=FLAG_CONTROL), bytes([CTRL_RATE_ACK]))
+            self.comm.send_frame(ack)
+            self.comm.set_bit_period(period)
+            self._marks = self._counters()
+            print(f"Link rate set by peer: {period}us bit period")
+        elif kind == CTRL_LANE_TEST:
+            self._respond_lane_test(frame)
+        elif kind == CTRL_LANES:
+            _, mask = LANES.unpack_from(frame.payload)
+            ack = Frame(FrameHeader(flags=FLAG_CONTROL), bytes([CTRL_LANES_ACK]))
+            self.comm.send_frame(ack)
+            self.comm.set_lanes(mask_lanes(mask))
+            print(f"Data lanes set by peer: {mask_lanes(mask)}")
+        elif kind == CTRL_HELLO:
+            _, theirs = CAPS.unpack_from(frame.payload)
+            ours = self.capabilities()
+            self.comm.send_frame(Frame(FrameHeader(flags=FLAG_CONTROL),
+                                       CAPS.pack(CTRL_CAPS, ours)))
+            self._apply(ours & theirs)
+
+    def _respond_lane_test(self, frame):
+        """Sample a raw multi-lane burst and report errors per lane."""
+        _, mask, length = LANE_TEST.unpack_from(frame.payload)
+        lanes = mask_lanes(mask)
+        self.comm.set_lanes(lanes)
+        try:
+            received = self.comm.receive_raw(length, timeout=REPLY_TIMEOUT)
+        finally:
+            self.comm.set_lanes([0])
+
+        results = lane_errors(lane_pattern(length), received, len(lanes))
+        report = bytes([CTRL_LANE_REPORT]) + b"".join(
+            LANE_RESULT.pack(errors, bits, skew) for errors, bits, skew in results)
+        self.comm.send_frame(Frame(FrameHeader(flags=FLAG_CONTROL), report))
+
+    def _respond_burst(self, frame):
+        """Count the rest of a training burst and report back."""
+        seen = set()
+        reply_period = self.comm.bit_period_us
+        expected = BURST_FRAMES
+        while True:
+            kind = control_type(frame)
+            if kind in (CTRL_TRAIN, CTRL_TRAIN_END):
+                _, index, expected, reply_period = TRAIN.unpack_from(frame.payload)
+                if frame.payload[TRAIN.size:] == training_pattern(index):
+                    seen.add(index)
+                if kind == CTRL_TRAIN_END:
+                    break
+            try:
+                frame = self.comm.receive_frame(timeout=BURST_IDLE_TIMEOUT)
+            except TimeoutError:
+                break  # The end of the burst was lost
+
+        # Reply at the safe period the initiator asked for
+        current = self.comm.bit_period_us
+        self.comm.set_bit_period(reply_period)
+        try:
+            report = REPORT.pack(CTRL_REPORT, len(seen), expected)
+            self.comm.send_frame(Frame(FrameHeader(flags=FLAG_CONTROL), report))
+        finally:
+            self.comm.set_bit_period(current)
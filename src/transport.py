@@ -0,0 +1,164 @@
+"""
+Byte transports under Comm.
+
+Comm turns messages into bytes (terminated strings or frames) and hands
+them to a transport, which moves them to the peer. The default is the GPIO
+transport, Comm's own pins (see comm.GpioTransport). The transports here
+carry the same bytes over a pipe or a Unix socket, so Client, Server,
+framing, caches and the message layer can run, and be load-tested, on a
+plain Linux box without pigpio:
+
+    client_end, server_end = PipeTransport.pair()
+    server = Server(transport=server_end, framed=True)
+    client = Client(transport=client_end, framed=True)
+
+or between two processes:
+
+    server = Server(transport=SocketTransport.listen("/tmp/link.sock"), framed=True)
+    client = Client(transport=SocketTransport.connect("/tmp/link.sock"), framed=True)
+
+Both can imitate a real line: byte_latency seconds are spent on every byte
+sent, and every bit is flipped with probability bit_error_rate, so frame
+CRCs, resynchronisation and ARQ see the errors they would on the wires.
+
+A transport subclasses Transport, which requires send() and receive():
+    send(data, release=True)   put bytes on the line; release hands the
+                               line to the peer (half-duplex GPIO only)
+    receive(timeout=None)      bytes that arrived, possibly none, waiting at
+                               most timeout seconds; raises
+                               ConnectionError when the peer has gone
+    close()
+    response_delay             seconds a responder waits before answering
+"""
+
+from abc import ABC, abstractmethod
+import math
+import os
+import random
+import select
+import socket
+import time
+
+READ_SIZE = 65536
+POLL_TIMEOUT = 1.0   # Seconds a receive(None) waits before returning nothing
+
+
+class Transport(ABC):
+    """Base class; see the module docstring."""
+    response_delay = 0.0
+
+    @abstractmethod
+    def send(self, data, release=True):
+        pass
+
+    @abstractmethod
+    def receive(self, timeout=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class FdTransport(Transport):
+    """Transport over a pair of file descriptors, one read and one written."""
+
+    def __init__(self, read_fd, write_fd, byte_latency=0.0, bit_error_rate=0.0, seed=None):
+        if not 0.0 <= bit_error_rate < 1.0:
+            raise ValueError(f"Bit error rate out of range: {bit_error_rate}")
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.byte_latency = byte_latency
+        self.bit_error_rate = bit_error_rate
+        self.random = random.Random(seed)
+        self.bytes_sent = 0
+        self.bit_errors = 0
+
+    def send(self, data, release=True):
+        if self.byte_latency:
+            time.sleep(len(data) * self.byte_latency)
+        data = self._corrupt(data)
+        view = memoryview(data)
+        while view:
+            written = os.write(self.write_fd, view)
+            view = view[written:]
+        self.bytes_sent += len(data)
+
+    def receive(self, timeout=None):
+        wait = POLL_TIMEOUT if timeout is None else timeout
+        readable, _, _ = select.select([self.read_fd], [], [], wait)
+        if not readable:
+            return b""
+        data = os.read(self.read_fd, READ_SIZE)
+        if not data:
+            raise ConnectionError("Peer closed the link")
+        return data
+
+    def _corrupt(self, data):
+        """Flip each bit with probability bit_error_rate. The gaps between
+        flipped bits are geometric, so clean data costs one draw."""
+        if not self.bit_error_rate:
+            return data
+        data = bytearray(data)
+        bits = len(data) * 8
+        log_keep = math.log(1.0 - self.bit_error_rate)
+        position = -1
+        while True:
+            position += 1 + int(math.log(1.0 - self.random.random()) / log_keep)
+            if position >= bits:
+                return bytes(data)
+            data[position // 8] ^= 0x80 >> position % 8
+            self.bit_errors += 1
+
+    def close(self):
+        for fd in {self.read_fd, self.write_fd}:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class PipeTransport(FdTransport):
+    """One end of a link made of two os.pipe()s, for both ends in one
+    process (on different threads)."""
+
+    @classmethod
+    def pair(cls, **options):
+        """Return the two ends of a new link; options go to both."""
+        a_read, b_write = os.pipe()
+        b_read, a_write = os.pipe()
+        return cls(a_read, a_write, **options), cls(b_read, b_write, **options)
+
+
+class SocketTransport(FdTransport):
+    """One end of a link over a connected Unix stream socket."""
+
+    def __init__(self, sock, **options):
+        self.socket = sock
+        super().__init__(sock.fileno(), sock.fileno(), **options)
+
+    @classmethod
+    def pair(cls, **options):
+        """Return the two ends of a new link in this process."""
+        a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        return cls(a, **options), cls(b, **options)
+
+    @classmethod
+    def listen(cls, path, **options):
+        """Wait for one peer to connect at path and return our end."""
+        if os.path.exists(path):
+            os.unlink(path)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(path)
+            server.listen(1)
+            sock, _ = server.accept()
+        return cls(sock, **options)
+
+    @classmethod
+    def connect(cls, path, **options):
+        """Connect to a peer listening at path."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        return cls(sock, **options)
+
+    def close(self):
+        self.socket.close()
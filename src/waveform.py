@@ -0,0 +1,155 @@
+"""
+DMA waveform transmitter for the GPIO protocol.
+
+Instead of toggling the data and clock pins with one pigpio socket call per
+edge, a whole message is turned into pigpio pulses and handed to the daemon,
+which clocks it out with DMA. Bit timing then comes from the configured bit
+period instead of time.sleep(), so it no longer jitters with scheduler load.
+
+Each bit is two pulses: data is set with the clock low, then the clock goes
+high for the second half of the period (the receiver samples on that rising
+edge). The pulses for every byte value are precomputed once.
+
+In DDR mode the clock toggles once per symbol instead: data is set with the
+clock steady, then the clock flips and the receiver samples on both edges.
+The clock period, and so the edge rate, stays the same, but every edge
+carries data, doubling throughput at the cost of half the setup time.
+A byte must span an even number of edges so the clock is LOW between
+bytes, which rules out DDR on an 8 lane bus.
+"""
+
+import pigpio
+import time
+from lanes import LaneMap
+
+DEFAULT_BIT_PERIOD_US = 1000   # Same pace as Connection.send_byte
+BYTES_PER_WAVE = 32            # Bytes packed into a single wave
+MAX_CHAIN_WAVES = 32           # Waves handed to one wave_chain call
+
+
+def byte_pulses(symbols, data_mask, clock_mask, latch_mask=0,
+                bit_period_us=DEFAULT_BIT_PERIOD_US, hold_latch=False, ddr=False):
+    """Return the pigpio pulses that shift out one byte.
+    symbols holds the data pins to drive high for each clock (LaneMap.symbols),
+    data_mask covers every data lane. bit_period_us is the clock period."""
+    low = max(1, bit_period_us // 2)
+    high = max(1, bit_period_us - low)
+    pulses = []
+
+    if ddr:
+        if len(symbols) % 2:
+            raise ValueError("DDR needs an even number of clock edges per byte")
+        setup = max(1, low // 2)
+        hold = max(1, low - setup)
+        for k, high_mask in enumerate(symbols):
+            # Set all lanes with the clock steady
+            pulses.append(pigpio.pulse(high_mask, data_mask & ~high_mask, setup))
+            # Flip the clock, receiver samples on either edge
+            if k % 2 == 0:
+                pulses.append(pigpio.pulse(clock_mask, 0, hold))
+            else:
+                pulses.append(pigpio.pulse(0, clock_mask, hold))
+    else:
+        for high_mask in symbols:
+            # Set all lanes with the clock low
+            pulses.append(pigpio.pulse(high_mask, clock_mask | (data_mask & ~high_mask), low))
+            # Rising clock edge, receiver samples here
+            pulses.append(pigpio.pulse(clock_mask, 0, high))
+
+    # Return clock and data LOW after the byte
+    pulses.append(pigpio.pulse(0, clock_mask | data_mask, low))
+
+    # Pulse the latch so the shift register shows the byte
+    if latch_mask:
+        pulses.append(pigpio.pulse(latch_mask, 0, low))
+        if not hold_latch:
+            pulses.append(pigpio.pulse(0, latch_mask, low))
+
+    return pulses
+
+
+class WaveformSender:
+    def __init__(self, pi, data_pin, clock_pin, latch_pin=None,
+                 bit_period_us=DEFAULT_BIT_PERIOD_US,
+                 bytes_per_wave=BYTES_PER_WAVE, hold_latch=False, lanes=None,
+                 ddr=False):
+        """Prepare a sender on an already connected pigpio.pi.
+        The caller owns the pins and must have them in OUTPUT mode.
+        lanes is an optional LaneMap for multi-lane sending.
+        ddr=True sends data on both clock edges."""
+        self.pi = pi
+        self.data_pin = data_pin
+        self.lanes = lanes or LaneMap([data_pin])
+        self.clock_pin = clock_pin
+        self.latch_pin = latch_pin
+        self.bytes_per_wave = bytes_per_wave
+        self.hold_latch = hold_latch
+        self.ddr = ddr
+
+        # Keep every chain well inside the daemon's pulse budget
+        self._max_pulses = self.pi.wave_get_max_pulses() // 2
+        self.set_bit_period(bit_period_us)
+
+        # Drop any half-built wave left behind by an earlier process
+        self.pi.wave_add_new()
+
+    def set_bit_period(self, bit_period_us):
+        """Change the bit period and rebuild the per-byte pulse trains."""
+        if bit_period_us < 2:
+            raise ValueError("bit_period_us must be at least 2")
+        self.bit_period_us = bit_period_us
+
+        clock_mask = 1 << self.clock_pin
+        latch_mask = 1 << self.latch_pin if self.latch_pin is not None else 0
+
+        # Precompute the pulse train for every possible byte
+        self._byte_pulses = [
+            byte_pulses(self.lanes.symbols(b), self.lanes.mask, clock_mask,
+                        latch_mask, bit_period_us, self.hold_latch, self.ddr)
+            for b in range(256)
+        ]
+        self._byte_micros = sum(p.delay for p in self._byte_pulses[0])
+
+    def set_lanes(self, lanes):
+        """Switch to a different LaneMap and rebuild the pulse trains."""
+        self.lanes = lanes
+        self.set_bit_period(self.bit_period_us)
+
+    def set_ddr(self, ddr):
+        """Switch between single and double data rate and rebuild the pulse trains."""
+        self.ddr = ddr
+        self.set_bit_period(self.bit_period_us)
+
+    def send(self, data):
+        """Send a buffer of bytes as chained DMA waveforms.
+        Blocks until the last bit has left the pin."""
+        data = bytes(data)
+        offset = 0
+        while offset < len(data):
+            wave_ids = []
+            start = offset
+            pulses_used = 0
+            try:
+                # Build as many waves as the chain and pulse budget allow
+                while offset < len(data) and len(wave_ids) < MAX_CHAIN_WAVES:
+                    chunk = data[offset:offset + self.bytes_per_wave]
+                    pulses = [p for b in chunk for p in self._byte_pulses[b]]
+                    if wave_ids and pulses_used + len(pulses) > self._max_pulses:
+                        break
+                    self.pi.wave_add_generic(pulses)
+                    wave_ids.append(self.pi.wave_create())
+                    pulses_used += len(pulses)
+                    offset += len(chunk)
+
+                self.pi.wave_chain(wave_ids)
+                self._wait((offset - start) * self._byte_micros)
+            finally:
+                for wid in wave_ids:
+                    self.pi.wave_delete(wid)
+
+    def _wait(self, micros):
+        """Block until the current chain has finished transmitting."""
+        # Sleep through most of the chain, then poll for the tail
+        time.sleep(micros / 1_000_000)
+        while self.pi.wave_tx_busy():
+            time.sleep(self.bit_period_us / 1_000_000 * 8)
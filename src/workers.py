@@ -0,0 +1,158 @@
+"""
+Worker pool that runs request handlers off the link thread.
+
+The thread driving the link submits each request with a key naming the
+client it came from and goes straight back to the link. Worker threads run
+the handler; requests with the same key run one at a time in the order
+they were submitted, so a client sees its own requests in order, while
+requests from different clients run side by side.
+
+Messages whose decoding depends on the ones before them (binary requests
+index into a header table that every message updates) cannot be decoded
+side by side. A pool given decode and encode stages decodes each message
+in submit(), on the link thread in arrival order, and encodes each
+response as its handler returns, in order per key, so only the handler
+itself runs concurrently (see Server.worker_pool).
+
+At most queue_size requests wait for a worker. submit() blocks while the
+queue is full, which holds up the link thread and so pushes back on the
+clients instead of queueing without bound.
+
+Threads rather than processes: handlers share the server's storage and
+caches, and most of their time goes to I/O and the GIL-free parts of zlib
+and json.
+
+stats reports the queue depth, how long requests waited and how long the
+handler took, so a slow handler shows up there instead of in the link rate.
+"""
+
+from collections import deque
+from concurrent.futures import Future
+import threading
+import time
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 64
+SAMPLES = 1000      # Recent requests the latency percentiles are taken over
+
+
+class WorkerPool:
+    def __init__(self, handler, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                 decode=None, encode=None):
+        """Run handler(message) -> response on workers threads. With
+        decode(message, key) the handler gets what it returns instead, and
+        with encode(response, key) the Future resolves to what that returns."""
+        if workers < 1 or queue_size < 1:
+            raise ValueError("Need at least one worker and one queue slot")
+        self.handler = handler
+        self.decode = decode
+        self.encode = encode
+        self.queue_size = queue_size
+        self.queued = 0
+        self.max_queued = 0
+        self.running = 0
+        self.handled = 0
+        self.errors = 0
+        self._waits = deque(maxlen=SAMPLES)      # Seconds from submit to start
+        self._durations = deque(maxlen=SAMPLES)  # Seconds in the handler
+
+        self._jobs = {}          # key -> deque of (message, Future, submit time)
+        self._ready = deque()    # Keys whose next job may start
+        self._busy = set()       # Keys with a job running
+        self._cond = threading.Condition()
+        self._arrivals = threading.Lock()   # Decode and queue in one order
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, message, timeout=None):
+        """Queue message behind earlier ones with the same key. Returns a
+        Future for the response. Blocks while the queue is full; raises
+        TimeoutError if it stays full for timeout seconds. The decode stage
+        runs here, on the caller's thread."""
+        future = Future()
+        with self._arrivals:
+            if self.decode is not None:
+                message = self.decode(message, key)
+            with self._cond:
+                if not self._cond.wait_for(lambda: self.queued < self.queue_size or self._closed,
+                                           timeout):
+                    raise TimeoutError("Request queue full")
+                if self._closed:
+                    raise RuntimeError("Worker pool is closed")
+                jobs = self._jobs.setdefault(key, deque())
+                if not jobs and key not in self._busy:
+                    self._ready.append(key)
+                jobs.append((message, future, time.perf_counter()))
+                self.queued += 1
+                self.max_queued = max(self.max_queued, self.queued)
+                self._cond.notify_all()
+        return future
+
+    def close(self):
+        """Finish the queued requests and stop the workers."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    @property
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._waits)
+            durations = sorted(self._durations)
+            return {'queued': self.queued, 'max_queued': self.max_queued,
+                    'running': self.running, 'handled': self.handled, 'errors': self.errors,
+                    'wait_ms_p50': _percentile(waits, 0.5) * 1000,
+                    'wait_ms_p99': _percentile(waits, 0.99) * 1000,
+                    'handler_ms_p50': _percentile(durations, 0.5) * 1000,
+                    'handler_ms_p99': _percentile(durations, 0.99) * 1000}
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._ready or (self._closed and not self.queued))
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                message, future, submitted = self._jobs[key].popleft()
+                self._busy.add(key)
+                self.queued -= 1
+                self.running += 1
+                self._cond.notify_all()
+            started = time.perf_counter()
+            try:
+                response = self.handler(message)
+                finished = time.perf_counter()
+                if self.encode is not None:
+                    # Jobs with this key wait for us, so this is their order
+                    response = self.encode(response, key)
+            except Exception as e:
+                print(f"Handler failed: {e}")
+                future.set_exception(e)
+                failed = True
+                finished = time.perf_counter()
+            else:
+                future.set_result(response)
+                failed = False
+            with self._cond:
+                self._waits.append(started - submitted)
+                self._durations.append(finished - started)
+                self.running -= 1
+                self.handled += 1
+                self.errors += failed
+                self._busy.discard(key)
+                if self._jobs[key]:
+                    self._ready.append(key)
+                else:
+                    del self._jobs[key]
+                self._cond.notify_all()
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
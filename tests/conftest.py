@@ -0,0 +1,103 @@
+"""
+Shared test setup: the modules live in src/ and are imported flat, and
+FakePi stands in for pigpio.pi so nothing needs a Pi or the daemon.
+"""
+
+import os
+import sys
+
+import pigpio
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+class FakePi:
+    """Records what the code under test asks pigpiod to do. Pin levels can
+    be set through levels; waves are kept as the pulse lists given."""
+
+    def __init__(self):
+        self.connected = True
+        self.levels = {}
+        self.modes = {}
+        self.calls = []        # (name, args) in call order
+        self.waves = {}
+        self.chains = []       # Pulse lists of each wave_chain call
+        self._pending = []
+        self._next_wave = 0
+
+    def _record(self, name, *args):
+        self.calls.append((name, args))
+
+    def set_mode(self, gpio, mode):
+        self._record("set_mode", gpio, mode)
+        self.modes[gpio] = mode
+
+    def set_pull_up_down(self, gpio, pud):
+        self._record("set_pull_up_down", gpio, pud)
+
+    def write(self, gpio, level):
+        self._record("write", gpio, level)
+        self.levels[gpio] = level
+
+    def read(self, gpio):
+        return self.levels.get(gpio, 0)
+
+    def read_bank_1(self):
+        return sum(level << gpio for gpio, level in self.levels.items())
+
+    def clear_bank_1(self, mask):
+        self._record("clear_bank_1", mask)
+
+    def set_bank_1(self, mask):
+        self._record("set_bank_1", mask)
+
+    def wave_get_max_pulses(self):
+        return 12000
+
+    def wave_add_new(self):
+        self._pending = []
+
+    def wave_add_generic(self, pulses):
+        self._pending += list(pulses)
+        return len(self._pending)
+
+    def wave_create(self):
+        wave_id = self._next_wave
+        self._next_wave += 1
+        self.waves[wave_id] = self._pending
+        self._pending = []
+        return wave_id
+
+    def wave_chain(self, wave_ids):
+        self._record("wave_chain", list(wave_ids))
+        self.chains.append([pulse for wave_id in wave_ids for pulse in self.waves[wave_id]])
+        return 0
+
+    def wave_tx_busy(self):
+        return 0
+
+    def wave_delete(self, wave_id):
+        del self.waves[wave_id]
+
+    def stop(self):
+        self._record("stop")
+
+
+def replay(pulses, gpio_mask, level=0):
+    """Bank levels after each pulse of a pulse train, as the pins would show
+    them, keeping only the changes on gpio_mask."""
+    levels = []
+    for pulse in pulses:
+        new = (level | pulse.gpio_on) & ~pulse.gpio_off
+        if new & gpio_mask != level & gpio_mask:
+            levels.append(new)
+        level = new
+    return levels
+
+
+@pytest.fixture
+def fake_pi(monkeypatch):
+    pi = FakePi()
+    monkeypatch.setattr(pigpio, "pi", lambda *args, **kwargs: pi)
+    return pi
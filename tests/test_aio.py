@@ -0,0 +1,65 @@
+import asyncio
+import threading
+
+import pytest
+
+from aio import AsyncClient, AsyncServer
+from client import Client
+from messages import Response
+from transport import PipeTransport
+
+
+class StuckClient:
+    """Client whose link never answers until released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.cleanups = 0
+
+    def batch(self, requests):
+        self.release.wait(5)
+        raise ConnectionError("Peer closed the link")
+
+    def cleanup(self):
+        self.cleanups += 1
+        self.release.set()
+
+
+def test_close_does_not_wait_for_stuck_batch():
+    async def main():
+        client = StuckClient()
+        link = AsyncClient(client)
+        on_link = asyncio.ensure_future(link.get("/a"))
+        await asyncio.sleep(0.05)
+        queued = asyncio.ensure_future(link.get("/b"))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(link.close(timeout=0.2), 2)
+        assert client.cleanups == 1
+        for request in (on_link, queued):
+            with pytest.raises(asyncio.CancelledError):
+                await request
+
+    asyncio.run(main())
+
+
+def test_requests_round_trip():
+    client_end, server_end = PipeTransport.pair()
+
+    async def main():
+        server = AsyncServer(transport=server_end, framed=True)
+
+        @server.route("GET", "/echo/{name}")
+        async def echo(request, name):
+            await asyncio.sleep(0)
+            return Response(200, name.encode())
+
+        serving = asyncio.ensure_future(server.serve())
+        async with AsyncClient(Client(transport=client_end, framed=True)) as client:
+            responses = await asyncio.gather(*(client.get(f"/echo/{i}") for i in range(5)))
+        assert [response["body"] for response in responses] == [str(i) for i in range(5)]
+        # The client's transport is closed, which ends serve() with the error
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(serving, 5)
+        server.close()
+
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+import os
+import threading
+
+import pytest
+
+from arq import (INITIAL_RTO, MAX_RTO, MIN_RTO, ArqReceiver, ArqSender, RetransmitTimer,
+                 decode_ack, encode_ack)
+from comm import Comm
+from transport import PipeTransport
+
+
+def test_ack_round_trip_across_wrap():
+    cumulative, selective = decode_ack(encode_ack(0xFFFE, {0xFFFF, 0, 5}))
+    assert cumulative == 0xFFFE
+    assert selective == {0xFFFF, 0, 5}
+
+
+def test_rto_follows_rtt_samples():
+    timer = RetransmitTimer(initial=1.0)
+    timer.sample(0.2)
+    assert timer.srtt == pytest.approx(0.2)
+    assert timer.rttvar == pytest.approx(0.1)
+    assert timer.rto == pytest.approx(0.6)       # srtt + 4 * rttvar
+    timer.sample(0.4)
+    assert timer.rttvar == pytest.approx(0.125)  # 3/4 * 0.1 + 1/4 * |0.2 - 0.4|
+    assert timer.srtt == pytest.approx(0.225)    # 7/8 * 0.2 + 1/8 * 0.4
+    assert timer.rto == pytest.approx(0.725)
+
+
+def test_rto_is_clamped():
+    timer = RetransmitTimer(initial=1.0)
+    timer.sample(0.001)
+    assert timer.rto == MIN_RTO
+    for _ in range(10):
+        timer.backoff()
+    assert timer.rto == MAX_RTO
+
+
+class Link:
+    def __init__(self, bit_period_us):
+        self.bit_period_us = bit_period_us
+
+
+def test_initial_rto_covers_a_burst_at_the_bit_period():
+    fast = ArqSender(Link(1))
+    assert fast.timer.rto == INITIAL_RTO
+    slow = ArqSender(Link(1000))
+    # 8 frames of 4 KiB at 1 kbit/s take over four minutes
+    assert slow.burst_seconds() > 4 * 60
+    assert slow.timer.rto == pytest.approx(2 * slow.burst_seconds())
+    slow.timer.backoff()
+    assert slow.timer.rto > MAX_RTO
+    assert ArqSender(Link(1000), initial_rto=3.0).timer.rto == 3.0
+
+
+def test_in_order_delivery_over_a_lossy_link():
+    sender_end, receiver_end = PipeTransport.pair(bit_error_rate=1e-4, seed=7)
+    sender = Comm(transport=sender_end, framed=True, bit_period_us=10)
+    receiver = Comm(transport=receiver_end, framed=True, bit_period_us=10)
+    data = os.urandom(16 * 1024)
+    received = []
+    thread = threading.Thread(
+        target=lambda: received.append(ArqReceiver(receiver, linger=0.5).receive()), daemon=True)
+    thread.start()
+    stats = ArqSender(sender, chunk_size=256).send(data)
+    thread.join(10)
+    assert received == [data]
+    assert sender_end.bit_errors > 0
+    assert stats.retransmissions > 0
+    assert receiver.frame_decoder.crc_errors + receiver.frame_decoder.header_errors > 0
+    sender_end.close()
+    receiver_end.close()
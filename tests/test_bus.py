@@ -0,0 +1,156 @@
+import json
+import threading
+
+import pytest
+
+from bus import BROADCAST, BUS_HEADER, LAST, SERVER_ADDRESS, TOKEN, BusNode, SimulatedBus
+from messages import BINARY, DynamicTable, Request, decode_response, encode_request
+from server import Server
+from transport import PipeTransport
+
+RATE = 10_000_000
+
+
+@pytest.fixture
+def bus_nodes():
+    """Start nodes on a fast SimulatedBus and stop them afterwards."""
+    nodes = []
+
+    def start(*new):
+        nodes.extend(new)
+        for node in new:
+            node.start()
+        return new
+
+    yield start
+    for node in nodes:
+        node.stop()
+
+
+class BinaryClient:
+    """A bus node speaking the binary encoding with its own header tables."""
+
+    def __init__(self, node):
+        self.node = node
+        self.tx_table = DynamicTable()
+        self.rx_table = DynamicTable()
+
+    def post(self, path, value):
+        request = Request("POST", path, {"X-Sensor": path}, json.dumps(value).encode())
+        return self.node.send_message(encode_request(request, BINARY, self.tx_table), timeout=5)
+
+    def get(self, path):
+        request = Request("GET", path, {"X-Sensor": path})
+        response = self.node.send_message(encode_request(request, BINARY, self.tx_table),
+                                          timeout=5)
+        return decode_response(response, self.rx_table)
+
+
+@pytest.mark.parametrize("workers", [0, 4])
+def test_server_keeps_header_tables_per_client(bus_nodes, workers):
+    link, _ = PipeTransport.pair()
+    server = Server(transport=link, response_cache_bytes=0)
+    pool = server.worker_pool(workers) if workers else None
+    bus = SimulatedBus(RATE)
+    ring = [SERVER_ADDRESS, 1, 2, 3]
+    node, *client_nodes = bus_nodes(
+        BusNode(bus.port(), SERVER_ADDRESS, ring, handler=server.process_message, pool=pool),
+        *(BusNode(bus.port(), address, ring) for address in ring[1:]))
+    clients = [BinaryClient(node) for node in client_nodes]
+    errors = []
+
+    def load(i, client):
+        # Interleaved, so one shared table would hand each client the others' entries
+        try:
+            for round in range(5):
+                client.post(f"/c{i}/{round % 2}", {"round": round})
+                response = client.get(f"/c{i}/{round % 2}")
+                assert response.status == 200
+                assert json.loads(bytes(response.body)) == {"round": round}
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load, args=(i, client)) for i, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if pool is not None:
+        pool.close()
+    assert errors == []
+    assert set(server.tables) == {1, 2, 3}
+
+
+def test_token_timeout_covers_longest_hold():
+    ring = [SERVER_ADDRESS, 1, 2, 3]
+    # 1 ms bit period: a 1 KiB frame alone takes about 8 s
+    slow = BusNode(SimulatedBus(1000).port(), SERVER_ADDRESS, ring)
+    assert slow.hold_seconds() > 8 * 4096 / 1000
+    assert slow.token_timeout >= 2 * slow.hold_seconds()
+    fast = BusNode(SimulatedBus(RATE).port(), SERVER_ADDRESS, ring)
+    assert fast.token_timeout == pytest.approx(0.5)
+    assert BusNode(SimulatedBus(1000).port(), 1, ring, token_timeout=3).token_timeout == 3
+
+
+def tokens(listener, count):
+    """(source, destination) of the next count tokens a passive port hears."""
+    seen = []
+    while len(seen) < count:
+        destination, source, kind = BUS_HEADER.unpack_from(listener.receive_frame(5).payload)
+        if kind == TOKEN:
+            seen.append((source, destination))
+    return seen
+
+
+def test_server_polls_clients_in_ring_order(bus_nodes):
+    bus = SimulatedBus(RATE)
+    ring = [SERVER_ADDRESS, 1, 2, 3]
+    listener = bus.port()
+    server, *clients = bus_nodes(
+        BusNode(bus.port(), SERVER_ADDRESS, ring, handler=lambda message, source: message[::-1]),
+        *(BusNode(bus.port(), address, ring) for address in ring[1:]))
+    assert tokens(listener, 6) == [(0, 1), (1, 0), (0, 2), (2, 0), (0, 3), (3, 0)]
+
+    futures = [(client, client.request(b"from %d" % client.address)) for client in clients * 3]
+    for client, future in futures:
+        assert future.result(5) == (b"from %d" % client.address)[::-1]
+    assert all(client.messages_sent == 3 for client in clients)
+    assert server.messages_received == 9
+    assert bus.collisions == 0
+
+
+def test_nodes_ignore_frames_for_others(bus_nodes):
+    bus = SimulatedBus(RATE)
+    ring = [SERVER_ADDRESS, 1, 2]
+    received = []
+    server, one, two = bus_nodes(
+        BusNode(bus.port(), SERVER_ADDRESS, ring,
+                handler=lambda message, source: received.append(source) or b"ok"),
+        *(BusNode(bus.port(), address, ring) for address in ring[1:]))
+    assert one.send_message(b"hello", timeout=5) == b"ok"
+    assert two.send_message(b"hello", timeout=5) == b"ok"
+    # Every node hears every frame, but only the addressee takes it in
+    assert received == [1, 2]
+    assert (one.messages_received, two.messages_received) == (1, 1)
+
+    # Frames for another address are dropped; broadcasts are taken in
+    to_two = one._frame(2, LAST, b"not for one")
+    assert one._handle(to_two.payload) is False
+    assert one._inbox == {}
+    token = server._frame(BROADCAST, TOKEN)
+    assert one._handle(token.payload) is True
+
+
+def test_server_regenerates_lost_token(bus_nodes, capsys):
+    bus = SimulatedBus(RATE)
+    ring = [SERVER_ADDRESS, 1, 2]
+    # Node 1 is in the ring but unplugged: the token given to it is lost
+    bus.port()
+    server, two = bus_nodes(
+        BusNode(bus.port(), SERVER_ADDRESS, ring, handler=lambda message, source: b"ok",
+                token_timeout=0.2),
+        BusNode(bus.port(), 2, ring))
+    for _ in range(3):
+        assert two.send_message(b"ping", timeout=5) == b"ok"
+    assert "token lost" in capsys.readouterr().out
+    assert bus.collisions == 0
@@ -0,0 +1,59 @@
+import pytest
+
+from cache import (LRUCache, apply_merge_patch, etag_matches, make_etag, make_merge_patch,
+                   patch_body)
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_bytes=10)
+    cache.put("a", b"xxxx")
+    cache.put("b", b"xxxx")
+    assert cache.get("a") == b"xxxx"   # Now b is the oldest
+    cache.put("c", b"xxxx")
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.stats == {'entries': 2, 'bytes': 8, 'hits': 1, 'misses': 0, 'evictions': 1}
+    assert cache.get("b") is None
+    assert cache.misses == 1
+
+
+def test_lru_replaces_and_skips_oversized():
+    cache = LRUCache(max_bytes=10)
+    cache.put("a", b"xx")
+    cache.put("a", b"xxxxxx")
+    assert cache.bytes == 6
+    cache.put("big", b"x" * 11)
+    assert "big" not in cache and len(cache) == 1
+    cache.remove_if(lambda key: key == "a")
+    assert cache.bytes == 0 and len(cache) == 0
+
+
+def test_etags():
+    assert make_etag(b"hello") == make_etag([b"he", b"llo"])
+    assert make_etag(b"hello") != make_etag(b"hello!")
+    etag = make_etag(b"hello")
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"other"', etag)
+
+
+@pytest.mark.parametrize("old, new", [
+    ({"a": 1, "b": {"c": 2, "d": 3}}, {"a": 1, "b": {"c": 5}, "e": [1, 2]}),
+    ({"a": 1}, {}),
+    ({}, {"a": {"b": "c"}}),
+])
+def test_merge_patch_round_trip(old, new):
+    patch = make_merge_patch(old, new)
+    assert apply_merge_patch(old, patch) == new
+
+
+def test_no_patch_for_nulls_or_non_objects():
+    assert make_merge_patch({"a": 1}, {"a": None}) is None
+    assert make_merge_patch({"a": 1}, {"a": {"b": None}}) is None
+    assert make_merge_patch([1], [2]) is None
+
+
+def test_patch_body():
+    assert patch_body('{"a": 1, "b": 2}', '{"b": null, "c": 3}') == '{"a": 1, "c": 3}'
+    with pytest.raises(ValueError):
+        patch_body('{spoilt', '{"a": 1}')
@@ -0,0 +1,138 @@
+import json
+import threading
+
+import pytest
+
+from cache import CachedResponse, make_etag
+from client import Client, get_request, post_request
+from comm import Comm
+from messages import BINARY, TEXT, Response
+from server import Server
+from transport import PipeTransport
+
+
+def test_failed_patch_in_batch_keeps_tables_in_step():
+    client_end, server_end = PipeTransport.pair()
+    server = Server(transport=server_end, framed=True, response_cache_bytes=0)
+    client = Client(transport=client_end, framed=True, encoding=BINARY)
+    tag = "shared-tag-value"
+    server.router.add("GET", "/tag/{n}", lambda request, n: Response(200, n, {"X-Tag": tag}))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    old = {"items": list(range(300)), "version": 1}
+    client.post("/data/a", old)
+    client.post("/data/a", dict(old, version=2))
+    # A cached copy of the old version that is spoilt, so the server's 226
+    # patch cannot be applied and the client fetches the whole value mid-batch
+    client.cache.put("/data/a", CachedResponse(make_etag(json.dumps(old).encode()),
+                                               {"status_code": 200, "headers": {},
+                                                "body": "{spoilt"}))
+
+    responses = client.batch([get_request("/data/a"), get_request("/tag/1"),
+                              get_request("/tag/2")])
+    assert [r["status_code"] for r in responses] == [200, 200, 200]
+    assert json.loads(responses[0]["body"])["version"] == 2
+    # The second X-Tag is an index into the table the first one filled
+    assert [r["headers"].get("X-Tag") for r in responses[1:]] == [tag, tag]
+    assert client.rx_table.entries == server.tables[None][1].entries
+    assert client.get("/tag/3")["headers"]["X-Tag"] == tag
+    client_end.close()
+    thread.join(5)
+
+
+def test_text_fallback_starts_with_fresh_tables():
+    client_end, server_end = PipeTransport.pair()
+    client = Client(transport=client_end, framed=True, encoding=BINARY)
+
+    def text_only_server():
+        # Answers anything in text, like a server without the binary encoding
+        peer = Comm(transport=server_end, framed=True)
+        for _ in range(2):
+            peer.receive_frame(5)
+            peer.send_frame(peer._next_frame(b"HTTP/1.1 200 OK\r\n\r\nok"))
+
+    thread = threading.Thread(target=text_only_server, daemon=True)
+    thread.start()
+    response = client.request(post_request("/data/x", {"a": 1}, {"X-Sensor": "x"}))
+    thread.join(5)
+    assert response["status_code"] == 200
+    assert client.encoding == TEXT
+    assert client.tx_table.entries == [] and client.rx_table.entries == []
+
+
+@pytest.fixture(params=[TEXT, BINARY])
+def link(request):
+    """A caching Client and a Server answering on a thread, over framed
+    pipes. server.statuses lists the status of every answer it sends."""
+    client_end, server_end = PipeTransport.pair()
+    server = Server(transport=server_end, framed=True)
+    client = Client(transport=client_end, framed=True, encoding=request.param)
+    server.statuses = []
+    handle_request = server.handle_request
+
+    def recording(exchange):
+        exchange = handle_request(exchange)
+        server.statuses.append(exchange.response.status if exchange.response else "cached")
+        return exchange
+
+    server.handle_request = recording
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    yield server, client
+    client_end.close()
+    thread.join(5)
+
+
+def test_polling_unchanged_value_hits_server_cache(link):
+    server, client = link
+    client.post("/data/a", {"value": 21.5})
+    server.statuses.clear()
+    bodies = [client.get("/data/a")["body"] for _ in range(4)]
+    assert bodies == ['{"value": 21.5}'] * 4
+    # One full answer, then revalidations: a 304 built once and reused
+    assert server.statuses == [200, 304, 304, 304]
+    assert server.response_cache.hits == 2
+    if client.encoding == BINARY:
+        assert client.rx_table.entries == server.tables[None][1].entries
+
+
+def test_post_replaces_cached_304(link):
+    server, client = link
+    client.post("/data/a", {"value": 1})
+    client.get("/data/a")
+    client.get("/data/a")
+    client.post("/data/a", {"value": 2})
+    assert json.loads(client.get("/data/a")["body"]) == {"value": 2}
+
+
+def test_changed_value_arrives_as_merge_patch(link):
+    server, client = link
+    old = {"items": list(range(100)), "version": 1}
+    client.post("/data/a", old)
+    client.get("/data/a")
+    client.post("/data/a", dict(old, version=2))
+    server.statuses.clear()
+    response = client.get("/data/a")
+    assert server.statuses == [226]
+    assert response["status_code"] == 200
+    assert json.loads(response["body"]) == dict(old, version=2)
+    assert "IM" not in response["headers"]
+    # The next poll revalidates against the patched copy
+    assert client.get("/data/a")["body"] == response["body"]
+    assert server.statuses == [226, 304]
+
+
+def test_patch_that_does_not_apply_refetches(link):
+    server, client = link
+    old = {"items": list(range(100)), "version": 1}
+    client.post("/data/a", old)
+    client.post("/data/a", dict(old, version=2))
+    client.cache.put("/data/a", CachedResponse(make_etag(json.dumps(old).encode()),
+                                               {"status_code": 200, "headers": {},
+                                                "body": "{spoilt"}))
+    server.statuses.clear()
+    response = client.get("/data/a")
+    assert server.statuses == [226, 200]
+    assert json.loads(response["body"]) == dict(old, version=2)
+    assert client.cache.get("/data/a").response["body"] == response["body"]
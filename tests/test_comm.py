@@ -0,0 +1,57 @@
+import pigpio
+import pytest
+
+import comm
+from comm import Comm
+
+DATA, CLOCK = 23, 24
+
+
+def calls_between(pi, first, last):
+    names = [name for name, _ in pi.calls]
+    start = names.index(first)
+    return pi.calls[start:names.index(last, start) + 1]
+
+
+def test_starts_released(fake_pi):
+    Comm(DATA, CLOCK, waveform=True)
+    assert fake_pi.modes[DATA] == pigpio.INPUT
+    assert fake_pi.modes[CLOCK] == pigpio.INPUT
+
+
+def test_send_takes_line_then_releases_it(fake_pi):
+    link = Comm(DATA, CLOCK, waveform=True)
+    fake_pi.calls.clear()
+    link.send_raw(b"\x81")
+
+    # Pins only become outputs, driven LOW, before the wave goes out
+    before = calls_between(fake_pi, "write", "wave_chain")
+    assert ("set_mode", (DATA, pigpio.OUTPUT)) in before
+    assert ("set_mode", (CLOCK, pigpio.OUTPUT)) in before
+    for gpio in (DATA, CLOCK):
+        assert before.index(("write", (gpio, 0))) < before.index(("set_mode", (gpio, pigpio.OUTPUT)))
+
+    # After the wave: driven LOW, then released as pulled-down inputs
+    after = fake_pi.calls[[name for name, _ in fake_pi.calls].index("wave_chain"):]
+    for gpio in (DATA, CLOCK):
+        assert after.index(("write", (gpio, 0))) < after.index(("set_mode", (gpio, pigpio.INPUT)))
+        assert ("set_pull_up_down", (gpio, pigpio.PUD_DOWN)) in after
+    assert link.direction == comm.LINK_RX
+    assert link.turnaround_stats()["turnarounds"] == 2
+
+
+def test_turnaround_waits_for_peer_to_release_clock(fake_pi, monkeypatch):
+    monkeypatch.setattr(comm, "TURNAROUND_TIMEOUT", 0.05)
+    link = Comm(DATA, CLOCK, waveform=True)
+    fake_pi.levels[CLOCK] = 1   # Peer still driving
+    with pytest.raises(RuntimeError, match="did not release"):
+        link.send_raw(b"x")
+    assert fake_pi.chains == []
+
+
+def test_receive_byte_times_out_on_stuck_clock(fake_pi):
+    link = Comm(DATA, CLOCK)
+    link._set_direction = lambda direction: None   # Line already ours to listen on
+    fake_pi.levels[CLOCK] = 1
+    with pytest.raises(TimeoutError, match="stuck high"):
+        link.receive_byte(timeout=0.05)
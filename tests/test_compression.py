@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from compression import (ACCEPT, DEFLATE, DICT_ENCODING, JSON_DICTIONARY, MIN_SIZE,
+                         choose_encoding, compress, decompress)
+from messages import Request, encode_request
+from server import Server
+from transport import PipeTransport
+
+BODY = json.dumps({"id": 7, "name": "sensor", "type": "temperature", "value": 21.5,
+                   "unit": "C", "timestamp": 1700000000}).encode()
+
+
+@pytest.mark.parametrize("accept", [ACCEPT, DEFLATE, "gzip, deflate;q=0.5"])
+def test_round_trip(accept):
+    packed, encoding = compress(BODY, accept)
+    assert encoding == choose_encoding(accept)
+    assert len(packed) < len(BODY)
+    assert decompress(packed, encoding) == BODY
+
+
+def test_dictionary_helps_short_json():
+    with_dict, _ = compress(BODY, DICT_ENCODING)
+    plain, _ = compress(BODY, DEFLATE)
+    assert len(with_dict) < len(plain)
+    assert len(JSON_DICTIONARY) <= 1024
+
+
+def test_small_or_incompressible_bodies_go_as_they_are():
+    assert compress(b"x" * (MIN_SIZE - 1), ACCEPT) == (b"x" * (MIN_SIZE - 1), None)
+    noise = bytes(range(256))
+    assert compress(noise, DEFLATE) == (noise, None)
+
+
+def test_unknown_coding():
+    assert choose_encoding("gzip, br") is None
+    assert choose_encoding("") is None
+    assert compress(BODY, "gzip") == (BODY, None)
+    assert decompress(BODY, None) == BODY
+    with pytest.raises(ValueError, match="Unsupported Content-Encoding: gzip"):
+        decompress(BODY, "gzip")
+
+
+def test_server_rejects_unknown_coding():
+    server = Server(transport=PipeTransport.pair()[0])
+    request = Request("POST", "/data", {"Content-Encoding": "br"}, BODY)
+    exchange = server.decode_message(encode_request(request))
+    assert exchange.response.status == 400
+    assert b"Unsupported Content-Encoding" in exchange.response.body
@@ -0,0 +1,156 @@
+import queue
+import threading
+
+import pigpio
+import pytest
+
+import duplex
+from client import Client
+from conftest import FakePi
+from duplex import FullDuplexComm, FullDuplexTransport, RemoteError
+from messages import Response
+from notify import ClockedDecoder, pack_reports
+from server import Server
+
+TX, RX, TX_CLOCK, RX_CLOCK = 23, 24, 17, 27
+
+
+class FakeNotify:
+    """NotifyReceiver fed with the reports a peer's waves would produce."""
+
+    def __init__(self, pi, data_pin, clock_pin, lanes=None, ddr=False, decoder=None):
+        self.decoder = decoder or ClockedDecoder(data_pin, clock_pin, lanes, ddr)
+        self.reports = queue.Queue()
+        self.fail = None
+        pi.notify = self
+
+    def begin(self):
+        self.decoder.reset(0)
+
+    def pause(self):
+        pass
+
+    def read(self, timeout=None):
+        if self.fail is not None:
+            raise self.fail
+        try:
+            return self.decoder.feed(self.reports.get(timeout=timeout))
+        except queue.Empty:
+            return b""
+
+    def close(self):
+        pass
+
+
+class WiredPi(FakePi):
+    """FakePi whose wave chains are replayed into the peer's notify pipe.
+    Both sides use the same pins, our TX pins wired to the peer's RX pins."""
+
+    def __init__(self):
+        super().__init__()
+        self.peer = None
+        self.tick = 0
+
+    def wave_chain(self, wave_ids):
+        super().wave_chain(wave_ids)
+        samples, level = [], 0
+        for pulse in self.chains[-1]:
+            new = (level | pulse.gpio_on) & ~pulse.gpio_off
+            if new != level:
+                samples.append((self.tick, self._peer_level(new)))
+            level = new
+            self.tick += pulse.delay
+        self.peer.notify.reports.put(pack_reports(samples))
+        return 0
+
+    def _peer_level(self, level):
+        return sum(1 << rx for tx, rx in ((TX, RX), (TX_CLOCK, RX_CLOCK)) if level >> tx & 1)
+
+
+@pytest.fixture
+def wired(monkeypatch):
+    """The next two pigpio.pi()s are wired to each other."""
+    pis = [WiredPi(), WiredPi()]
+    pis[0].peer, pis[1].peer = pis[1], pis[0]
+    new_pis = iter(pis)
+    monkeypatch.setattr(pigpio, "pi", lambda *args, **kwargs: next(new_pis))
+    monkeypatch.setattr(duplex, "NotifyReceiver", FakeNotify)
+    return pis
+
+
+@pytest.fixture(params=["clocked", "manchester"])
+def pair(request, wired):
+    """Two FullDuplexComms wired to each other."""
+    clocked = request.param == "clocked"
+    clocks = (TX_CLOCK, RX_CLOCK) if clocked else (None, None)
+    a = FullDuplexComm(TX, RX, *clocks)
+    b = FullDuplexComm(TX, RX, *clocks)
+    yield a, b
+    a.cleanup()
+    b.cleanup()
+
+
+def serve(comm, count):
+    thread = threading.Thread(target=lambda: [comm.receive_message(5) for _ in range(count)],
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+def test_requests_in_flight_round_trip(pair):
+    a, b = pair
+    server = serve(b, 3)
+    futures = [a.submit(b"request %d" % i) for i in range(3)]
+    assert [f.result(5) for f in futures] == [b"Received: request %d" % i for i in range(3)]
+    server.join(5)
+    assert b.frames_received == 3
+
+
+def test_failing_handler_fails_the_request(pair, capsys):
+    a, b = pair
+
+    def process_message(message):
+        raise ValueError("no such key")
+
+    b.process_message = process_message
+    server = serve(b, 1)
+    with pytest.raises(RemoteError, match="no such key"):
+        a.send_message(b"get", timeout=5)
+    server.join(5)
+    assert "no such key" in capsys.readouterr().out
+
+
+def test_receive_error_reaches_callers(pair):
+    a, b = pair
+    future = a.submit(b"never answered")
+    a.transport.notify.fail = OSError("notify pipe gone")
+    with pytest.raises(ConnectionError):
+        future.result(5)
+    with pytest.raises(ConnectionError, match="notify pipe gone"):
+        a.receive_frame(5)
+    with pytest.raises(ConnectionError):
+        a.submit(b"again")
+
+
+def test_seq_wraparound_skips_pending(pair):
+    a, _ = pair
+    first = a.submit(b"still waiting")
+    a.tx_seq = duplex.MAX_SEQ
+    a.submit(b"last seq")
+    a.submit(b"after the wrap")
+    assert a.tx_seq == 2
+    assert a._pending[0] is first
+
+
+def test_client_and_server_over_full_duplex_transport(wired):
+    server_end = FullDuplexTransport(TX, RX, TX_CLOCK, RX_CLOCK)
+    client_end = FullDuplexTransport(TX, RX, TX_CLOCK, RX_CLOCK)
+    server = Server(transport=server_end, framed=True)
+    server.router.add("GET", "/hello", lambda request: Response(200, "hello"))
+    client = Client(transport=client_end, framed=True)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    assert client.get("/hello")["body"] == "hello"
+    server_end.notify.fail = ConnectionError("peer gone")
+    thread.join(5)
+    assert not thread.is_alive()
@@ -0,0 +1,119 @@
+import random
+
+import numpy as np
+import pytest
+
+from fec import RS_N, FecCodec, ReedSolomon, deinterleave, interleave
+
+
+def flip_bits(data, positions):
+    data = bytearray(data)
+    for position in positions:
+        data[position // 8] ^= 0x80 >> position % 8
+    return bytes(data)
+
+
+def payload(size, seed=1):
+    return random.Random(seed).randbytes(size)
+
+
+def test_interleave_round_trip():
+    codewords = np.arange(5 * 4, dtype=np.uint8).reshape(5, 4)
+    symbols = interleave(codewords, 2)
+    assert symbols.shape == (6, 4)   # Padded to whole groups of depth
+    assert list(symbols.ravel()[:4]) == [0, 4, 1, 5]
+    assert (deinterleave(symbols.ravel(), 2, 4)[:5] == codewords).all()
+
+
+@pytest.mark.parametrize("scheme", ["secded", "rs"])
+def test_empty_input(scheme):
+    codec = FecCodec(scheme)
+    assert codec.decode(codec.encode(b"")) == b""
+    assert codec.decode(b"") == b""
+    assert codec.stats.uncorrectable == 0
+
+
+@pytest.mark.parametrize("scheme", ["secded", "rs"])
+def test_clean_round_trip(scheme):
+    codec = FecCodec(scheme)
+    data = payload(1000)
+    assert codec.decode(codec.encode(data)) == data
+    assert codec.stats.corrected == 0
+
+
+def test_secded_corrects_one_bit_per_codeword():
+    codec = FecCodec("secded", depth=1)
+    data = payload(300)
+    encoded = codec.encode(data)
+    # One random bit in every codeword byte
+    rng = random.Random(2)
+    damaged = flip_bits(encoded, [8 * i + rng.randrange(8) for i in range(len(encoded))])
+    assert codec.decode(damaged) == data
+    assert codec.stats.corrected == len(encoded)
+    assert codec.stats.uncorrectable == 0
+
+
+def test_secded_interleaving_spreads_a_burst():
+    data = payload(300)
+    burst = range(100, 102)   # Two bits of one codeword byte
+    codec = FecCodec("secded", depth=8)
+    assert codec.decode(flip_bits(codec.encode(data), burst)) == data
+    assert codec.stats.corrected == 2
+    plain = FecCodec("secded", depth=1)
+    plain.decode(flip_bits(plain.encode(data), burst))
+    assert plain.stats.uncorrectable == 1
+
+
+def test_secded_detects_a_double_error():
+    codec = FecCodec("secded", depth=1)
+    encoded = codec.encode(payload(50))
+    codec.decode(flip_bits(encoded, [8 * 20 + 1, 8 * 20 + 6]))
+    assert codec.stats.uncorrectable == 1
+
+
+def test_rs_corrects_random_byte_errors():
+    codec = FecCodec("rs")
+    data = payload(2000)
+    encoded = bytearray(codec.encode(data))
+    rng = random.Random(3)
+    # 16 codewords of 255, each takes 16 wrong bytes; these are spread out
+    for position in rng.sample(range(len(encoded)), 60):
+        encoded[position] ^= rng.randrange(1, 256)
+    assert codec.decode(encoded) == data
+    assert codec.stats.corrected == 60
+    assert codec.stats.uncorrectable == 0
+
+
+def test_rs_interleaving_corrects_a_burst():
+    data = payload(2000)
+    burst = range(8 * 300, 8 * 420)   # 120 bytes in a row, all in the second codeword
+    codec = FecCodec("rs", depth=8)
+    assert codec.decode(flip_bits(codec.encode(data), burst)) == data
+    assert codec.stats.corrected == 120
+    # The same burst in one codeword is more than nsym / 2 = 16 bytes
+    plain = FecCodec("rs", depth=1)
+    assert plain.decode(flip_bits(plain.encode(data), burst)) != data
+    assert plain.stats.uncorrectable == 1
+
+
+def test_rs_flags_an_uncorrectable_block():
+    rs = ReedSolomon(nsym=8)
+    codewords = rs.encode(payload(RS_N - 8))
+    damaged = codewords.copy()
+    rng = random.Random(4)
+    # 6 wrong bytes, 4 correctable. Far more can land near another codeword
+    # and be "corrected" into it; no code detects everything.
+    for position in rng.sample(range(RS_N), 6):
+        damaged[0, position] ^= rng.randrange(1, 256)
+    assert rs._correct(damaged[0].tolist(), [0] + rs.syndromes(damaged)[0].tolist()) is None
+    fixed = codewords.copy()
+    fixed[0, [3, 90, 200]] ^= 0x5A
+    assert rs._correct(fixed[0].tolist(), [0] + rs.syndromes(fixed)[0].tolist()) \
+        == codewords[0].tolist()
+
+
+def test_unknown_scheme():
+    with pytest.raises(ValueError):
+        FecCodec("ldpc")
+    with pytest.raises(ValueError):
+        ReedSolomon(nsym=3)
@@ -0,0 +1,72 @@
+import pigpio
+
+from linecode import PREAMBLE, ManchesterDecoder, ManchesterSender
+
+DATA = 23
+MASK = 1 << DATA
+
+
+def edges(pulses, scale=1.0):
+    """(tick, level) of every level change in a pulse train, with the
+    sender's clock running scale times slower than nominal."""
+    samples, level, tick = [], 0, 1000
+    for pulse in pulses:
+        new = (level | pulse.gpio_on) & ~pulse.gpio_off
+        if new != level:
+            samples.append((round(tick), new))
+        level = new
+        tick += pulse.delay * scale
+    return samples
+
+
+def sent_pulses(pi, message, bit_period_us=100):
+    pi.chains.clear()
+    ManchesterSender(pi, DATA, bit_period_us).send(message)
+    return [pulse for chain in pi.chains for pulse in chain]
+
+
+def decode(samples, bit_period_us=100):
+    decoder = ManchesterDecoder(DATA, bit_period_us)
+    ticks, levels = zip(*samples)
+    return decoder, decoder.feed_edges(ticks, levels)
+
+
+def test_round_trip(fake_pi):
+    message = bytes(range(256))
+    decoder, out = decode(edges(sent_pulses(fake_pi, message)))
+    assert out == message
+    assert decoder.code_errors == 0
+    assert decoder.bursts == 1
+
+
+def test_round_trip_with_clock_drift(fake_pi):
+    message = b"\x00\xff drifting clock \xa5\x5a"
+    pulses = sent_pulses(fake_pi, message)
+    for scale in (0.9, 1.12):
+        decoder, out = decode(edges(pulses, scale))
+        assert out == message
+        # The half-bit estimate moved towards the sender's real clock
+        assert abs(decoder.half_us - 50 * scale) < abs(50 - 50 * scale)
+
+
+def test_bursts_split_across_reads(fake_pi):
+    message = b"one burst" * 3
+    idle = [pigpio.pulse(0, 0, 1000)]   # Line idle between two sends
+    samples = edges(sent_pulses(fake_pi, message) + idle + sent_pulses(fake_pi, b"two"))
+    decoder = ManchesterDecoder(DATA, 100)
+    out = b""
+    for i in range(0, len(samples), 7):
+        ticks, levels = zip(*samples[i:i + 7])
+        out += decoder.feed_edges(ticks, levels)
+    assert out == message + b"two"
+    assert decoder.bursts == 2
+
+
+def test_invalid_symbol_pair_is_flagged(fake_pi):
+    pulses = sent_pulses(fake_pi, b"\x68")   # 0110 1000
+    # Bit 2 is a 1 (LOW, HIGH) between a 1 and a 0; make it LOW, LOW
+    second_half = (len(PREAMBLE) + 1) * 16 + 2 * 2 + 1
+    pulses[second_half] = pigpio.pulse(0, MASK, pulses[second_half].delay)
+    decoder, out = decode(edges(pulses))
+    assert decoder.code_errors == 1
+    assert out == b"\x48"   # Read as a 0, so the byte cannot pass for valid
@@ -0,0 +1,92 @@
+import pytest
+
+from messages import (BINARY, INDEXED, DynamicTable, MessageError, Request, Response,
+                      decode_request, decode_response, decode_varint, encode_request,
+                      encode_response, encode_varint)
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 300, 2**32])
+def test_varint_round_trip(value):
+    encoded = encode_varint(value)
+    assert decode_varint(encoded + b"rest", 0) == (value, len(encoded))
+
+
+def test_truncated_varint():
+    with pytest.raises(MessageError):
+        decode_varint(b"\x80", 0)
+
+
+@pytest.mark.parametrize("encoding", ["text", BINARY])
+def test_request_round_trip(encoding):
+    request = Request("POST", "/data/temperature", {"Content-Type": "application/json",
+                                                    "X-Sensor": "kitchen"}, b'{"value": 21.5}')
+    decoded = decode_request(encode_request(request, encoding))
+    assert (decoded.method, decoded.path, bytes(decoded.body)) == \
+        (request.method, request.path, request.body)
+    assert decoded.headers["X-Sensor"] == "kitchen"
+
+
+def test_binary_response_round_trip():
+    response = Response(404, b"Path not found", {"ETag": '"0000abcd"'})
+    decoded = decode_response(encode_response(response, BINARY))
+    assert decoded.status == 404
+    assert bytes(decoded.body) == b"Path not found"
+    assert decoded.headers == {"ETag": '"0000abcd"'}
+
+
+def test_tables_stay_in_step():
+    tx, rx = DynamicTable(), DynamicTable()
+    sizes = []
+    for n in range(4):
+        request = Request("GET", "/data/temperature",
+                          {"X-Sensor": "kitchen", "X-Count": str(1000 + n)})
+        message = encode_request(request, BINARY, tx)
+        decoded = decode_request(message, rx)
+        assert (decoded.path, decoded.headers) == (request.path, request.headers)
+        assert rx.entries == tx.entries
+        sizes.append(len(message))
+    # From the second message on, path and X-Sensor are one byte each
+    assert sizes[1] < sizes[0] - len("/data/temperature")
+    assert sizes[2] == sizes[1]
+
+
+def test_table_size_is_bounded():
+    tx, rx = DynamicTable(size=2), DynamicTable(size=2)
+    for n in range(5):
+        decode_request(encode_request(Request("GET", f"/path/{n}"), BINARY, tx), rx)
+    assert rx.entries == tx.entries
+    assert len(rx.entries) == 2
+    with pytest.raises(MessageError, match="Unknown dynamic table index 2"):
+        rx.get(2)
+
+
+def test_entry_added_and_used_in_one_message():
+    tx, rx = DynamicTable(), DynamicTable()
+    # Header names match case-insensitively, so the second is INDEXED 0
+    message = encode_request(Request("GET", "/", {"X-Tag": "abc", "x-tag": "abc"}), BINARY, tx)
+    assert message[-1] == INDEXED
+    decoded = decode_request(message, rx)
+    assert decoded.headers == {"X-Tag": "abc"}   # The entry keeps the first spelling
+    assert rx.entries == tx.entries
+
+
+def test_failed_decode_leaves_table_alone():
+    tx, rx = DynamicTable(), DynamicTable()
+    decode_request(encode_request(Request("GET", "/first"), BINARY, tx), rx)
+    before = list(rx.entries)
+    message = encode_request(Request("GET", "/second", {"X-Sensor": "kitchen",
+                                                        "X-Room": "living"}), BINARY, tx)
+    # Path and X-Sensor decode fine, X-Room is cut short
+    with pytest.raises(MessageError):
+        decode_request(message[:-2], rx)
+    assert rx.entries == before
+    decode_request(message, rx)
+    assert rx.entries == tx.entries
+
+
+def test_indexed_header_needs_a_table():
+    tx = DynamicTable()
+    encode_request(Request("GET", "/", {"X-Sensor": "kitchen"}), BINARY, tx)
+    message = encode_request(Request("GET", "/", {"X-Sensor": "kitchen"}), BINARY, tx)
+    with pytest.raises(MessageError):
+        decode_request(message)
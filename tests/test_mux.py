@@ -0,0 +1,90 @@
+import queue
+
+import pytest
+
+import mux
+from mux import BULK, Mux
+
+
+class FrameLink:
+    """One end of an in-memory frame link."""
+
+    def __init__(self):
+        self.inbox = queue.Queue()
+        self.peer = None
+        self.broken = False
+
+    @classmethod
+    def pair(cls):
+        a, b = cls(), cls()
+        a.peer, b.peer = b, a
+        return a, b
+
+    def send_frames(self, frames):
+        if self.broken:
+            raise ConnectionError("Link down")
+        for frame in frames:
+            self.peer.inbox.put(frame)
+
+    def receive_frame(self, timeout=None):
+        try:
+            return self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Timed out waiting for a frame") from None
+
+
+@pytest.fixture
+def muxes():
+    def make(handler):
+        a, b = FrameLink.pair()
+        client = Mux(a, initiator=True).start()
+        server = Mux(b, initiator=False, handler=handler).start()
+        made.append((client, server))
+        return client, server, a
+    made = []
+    yield make
+    for client, server in made:
+        client.stop()
+        server.stop()
+
+
+def test_requests_share_the_link(muxes):
+    client, _, _ = muxes(lambda message: message.upper())
+    bulk = client.request(b"x" * 100000, BULK)
+    small = client.request(b"ping")
+    assert small.result(5) == b"PING"
+    assert bulk.result(5) == b"X" * 100000
+
+
+def test_stream_ids_wrap_past_open_streams(muxes):
+    client, _, _ = muxes(lambda message: message)
+    client._next_id = mux.MAX_STREAM_ID - 2
+    client._streams[1] = mux.MuxStream(1, BULK, client.window)   # Still open
+    client._streams[1].end_sent = True
+    ids = []
+    open_stream = client._open
+    client._open = lambda stream_id, priority: ids.append(stream_id) or open_stream(stream_id, priority)
+    for i in range(3):
+        assert client.send_message(b"%d" % i, timeout=5) == b"%d" % i
+    assert ids == [mux.MAX_STREAM_ID - 2, mux.MAX_STREAM_ID, 3]
+    assert client.error is None
+
+
+def test_handler_failure_still_answers(muxes):
+    def handler(message):
+        if message == b"bad":
+            raise ValueError("bad request")
+        return b"ok"
+    client, _, _ = muxes(handler)
+    assert client.send_message(b"bad", timeout=5) == b""
+    assert client.send_message(b"good", timeout=5) == b"ok"
+
+
+def test_link_failure_fails_waiting_requests(muxes):
+    client, _, link = muxes(lambda message: message)
+    link.broken = True
+    future = client.request(b"lost")
+    with pytest.raises(ConnectionError):
+        future.result(5)
+    with pytest.raises(ConnectionError):
+        client.request(b"after")
@@ -0,0 +1,83 @@
+import numpy as np
+
+from lanes import LaneMap
+from notify import REPORT_SIZE, ClockedDecoder, pack_reports, parse_reports
+
+DATA, CLOCK = 23, 24
+
+
+def edge_samples(message, data_pins=(DATA,), clock=CLOCK, ddr=False, period=100):
+    """(tick, level) reports a sender clocking message out would produce:
+    data set while the clock is low, sampled on the rising edge (and on the
+    falling edge too with ddr)."""
+    lanes = LaneMap(list(data_pins))
+    samples, tick = [], 0
+    for byte in message:
+        symbols = lanes.symbols(byte)
+        for i, symbol in enumerate(symbols):
+            high = 1 << clock if ddr and i % 2 else 0
+            samples.append((tick, symbol | high))
+            tick += period // 2
+            samples.append((tick, symbol | (high ^ 1 << clock)))
+            tick += period // 2
+            if not ddr:
+                samples.append((tick, symbol))
+    samples.append((tick, 0))
+    return samples
+
+
+def test_pack_reports_round_trip():
+    buf = pack_reports([(10, 1 << CLOCK), (20, 0)], seqno=0xFFFF)
+    assert len(buf) == 2 * REPORT_SIZE
+    ticks, levels = parse_reports(buf)
+    assert list(ticks) == [10, 20]
+    assert list(levels) == [1 << CLOCK, 0]
+
+
+def test_decodes_whole_buffer():
+    message = b"\x00\xffHello\xa5"
+    decoder = ClockedDecoder(DATA, CLOCK)
+    assert decoder.feed(pack_reports(edge_samples(message))) == message
+
+
+def test_byte_split_across_reads():
+    message = b"\xa5\x5a"
+    buf = pack_reports(edge_samples(message))
+    decoder = ClockedDecoder(DATA, CLOCK)
+    # First read ends mid-report, four bits into the first byte
+    cut = 4 * 3 * REPORT_SIZE + 5
+    assert decoder.feed(buf[:cut]) == b""
+    assert decoder.feed(buf[cut:cut + 7]) == b""
+    assert decoder.feed(buf[cut + 7:]) == message
+
+
+def test_byte_at_a_time_reads():
+    message = b"split"
+    buf = pack_reports(edge_samples(message))
+    decoder = ClockedDecoder(DATA, CLOCK)
+    out = b"".join(decoder.feed(buf[i:i + 1]) for i in range(len(buf)))
+    assert out == message
+
+
+def test_ignores_non_level_reports():
+    buf = bytearray(pack_reports(edge_samples(b"\x81")))
+    # Turn the first report into a watchdog report carrying a stray level
+    watchdog = bytearray(pack_reports([(0, 1 << CLOCK | 1 << DATA)]))
+    watchdog[2] = 0x20
+    decoder = ClockedDecoder(DATA, CLOCK)
+    assert decoder.feed(bytes(watchdog) + bytes(buf)) == b"\x81"
+
+
+def test_multi_lane_and_ddr():
+    pins = [DATA, 22, 27, 17]
+    message = bytes(np.arange(0, 256, 17, dtype=np.uint8))
+    decoder = ClockedDecoder(DATA, CLOCK, LaneMap(pins), ddr=True)
+    assert decoder.feed(pack_reports(edge_samples(message, pins, ddr=True))) == message
+
+
+def test_reset_drops_partial_byte():
+    buf = pack_reports(edge_samples(b"\xff\x0f"))
+    decoder = ClockedDecoder(DATA, CLOCK)
+    decoder.feed(buf[:3 * 3 * REPORT_SIZE + 1])
+    decoder.reset()
+    assert decoder.feed(buf[8 * 3 * REPORT_SIZE:]) == b"\x0f"
@@ -0,0 +1,76 @@
+import pytest
+
+from routing import RouteError, Router, split_query
+
+
+def handler(name):
+    return lambda request, **params: (name, params)
+
+
+@pytest.fixture
+def router():
+    router = Router()
+    router.add("GET", "/", handler("root"))
+    router.add("GET", "/sensors/{id}", handler("sensor"))
+    router.add("GET", "/sensors/{id}/history", handler("history"))
+    router.add("GET", "/sensors/latest", handler("latest"))
+    router.add("GET", "/files/{rest:path}", handler("files"))
+    router.add("GET", "/{key:path}", handler("any"))
+    router.add("post", "/{key:path}", handler("store"))
+    return router
+
+
+def route(router, method, path):
+    found, params = router.match(method, path)
+    return found(None, **params)
+
+
+@pytest.mark.parametrize("method, path, expected", [
+    ("GET", "/", ("root", {})),
+    ("GET", "/sensors/7", ("sensor", {"id": "7"})),
+    ("GET", "/sensors/7/history", ("history", {"id": "7"})),
+    ("GET", "/sensors/latest", ("latest", {})),           # Static beats {id}
+    ("GET", "/files/a/b/c.txt", ("files", {"rest": "a/b/c.txt"})),
+    ("GET", "/sensors/7/other", ("any", {"key": "sensors/7/other"})),
+    ("POST", "/data/a", ("store", {"key": "data/a"})),   # Methods are case-insensitive
+])
+def test_patterns(router, method, path, expected):
+    assert route(router, method, path) == expected
+
+
+def test_segment_parameter_stops_at_slash():
+    router = Router()
+    router.add("GET", "/sensors/{id}", handler("sensor"))
+    with pytest.raises(RouteError, match="Path not found: /sensors/7/x"):
+        router.match("GET", "/sensors/7/x")
+    with pytest.raises(RouteError, match="Path not found"):
+        router.match("GET", "/sensors/")
+
+
+def test_more_literal_text_wins_regardless_of_order():
+    router = Router()
+    router.add("GET", "/{a}/{b}", handler("loose"))
+    router.add("GET", "/data/{b}", handler("data"))
+    assert route(router, "GET", "/data/x") == ("data", {"b": "x"})
+    assert route(router, "GET", "/other/x") == ("loose", {"a": "other", "b": "x"})
+
+
+def test_unsupported_method(router):
+    with pytest.raises(RouteError, match="Unsupported method: DELETE"):
+        router.match("DELETE", "/data/a")
+
+
+def test_decorator():
+    router = Router()
+
+    @router.route("GET", "/hello/{name}")
+    def hello(request, name):
+        return name
+
+    assert route(router, "GET", "/hello/pi") == "pi"
+
+
+def test_split_query():
+    assert split_query("/a/b?list&limit=10&limit=20") == ("/a/b", {"list": "", "limit": "20"})
+    assert split_query("/a/b") == ("/a/b", {})
+    assert split_query("/?after=/x%2Fy") == ("/", {"after": "/x/y"})
@@ -0,0 +1,123 @@
+import json
+import threading
+
+import pytest
+
+from client import Client
+from comm import StreamAborted
+from messages import Response, read_body
+from server import Server
+from transport import PipeTransport
+
+
+@pytest.fixture(params=[False, True], ids=["unframed", "framed"])
+def link(request):
+    """A Server answering on a thread and a Client talking to it over pipes."""
+    client_end, server_end = PipeTransport.pair()
+    server = Server(transport=server_end, framed=request.param)
+    client = Client(transport=client_end, framed=request.param)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    yield server, client
+    client_end.close()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_str_body_is_sent_whole(link):
+    server, client = link
+    server.router.add("GET", "/hello", lambda request: Response(200, "hello"))
+    assert Response(200, "hello").body == b"hello"
+    assert client.get("/hello")["body"] == "hello"
+
+
+def test_streamed_response(link):
+    server, client = link
+    server.router.add("GET", "/count", lambda request: Response(200, (b"%d," % i for i in range(5))))
+    assert b"".join(client.get_stream("/count")["body"]) == b"0,1,2,3,4,"
+
+
+def test_failing_stream_keeps_server_running(link):
+    server, client = link
+
+    def chunks():
+        yield b"partial"
+        raise RuntimeError("sensor went away")
+
+    server.router.add("GET", "/broken", lambda request: Response(200, chunks()))
+    response = client.get_stream("/broken")
+    if server.framed:
+        # The head went out as 200; the cut-off body must not pass for a whole one
+        assert response["status_code"] == 200
+        body = response["body"]
+        assert next(body) == b"partial"
+        with pytest.raises(StreamAborted, match="sensor went away"):
+            next(body)
+    else:
+        assert response["status_code"] == 400
+    assert client.get("/")["status_code"] == 200
+
+
+def test_aborted_request_stream_gets_an_error(link):
+    server, client = link
+    if not server.framed:
+        pytest.skip("Streams need framed=True")
+
+    def chunks():
+        yield b'{"a": '
+        raise RuntimeError("upload source failed")
+
+    server.router.add("POST", "/upload", lambda request: Response(200, read_body(request.body)))
+    response = client.post_stream("/upload", chunks())
+    assert response["status_code"] == 400
+    assert "upload source failed" in response["body"]
+    assert client.get("/")["status_code"] == 200
+
+
+def test_malformed_request_is_dropped_as_it_arrives():
+    client_end, server_end = PipeTransport.pair()
+    server = Server(transport=server_end)
+    body = b"x" * 200000
+    sender = threading.Thread(target=client_end.send, daemon=True,
+                              args=(b"GET /data HTTP/1.1\nnot a header\n\n" + body + b"\x00"
+                                    + b"GET / HTTP/1.1\n\n\x00",))
+    sender.start()
+    message = server._receive_until_terminator()
+    # Only the head up to the bad line was kept, not the body behind it
+    assert message.startswith(b"GET /data") and len(message) < 1000
+    assert b"Malformed header line" in server.process_message(message)
+    assert server._receive_until_terminator() == b"GET / HTTP/1.1\n\n"
+    sender.join(5)
+
+
+def test_list_pages_through_keys(link):
+    server, client = link
+    for n in range(5):
+        client.post(f"/data/{n}", {"n": n})
+    client.post("/other", {"n": -1})
+    pages, after = [], None
+    while True:
+        page = json.loads(client.list("/data/", limit=2, after=after)["body"])
+        pages.append(page["keys"])
+        after = page["next"]
+        if after is None:
+            break
+    assert pages == [["/data/0", "/data/1"], ["/data/2", "/data/3"], ["/data/4"]]
+    # A page that ends exactly on the last key has no next
+    assert json.loads(client.list("/data/", limit=5)["body"]) == \
+        {"keys": [f"/data/{n}" for n in range(5)], "next": None}
+
+
+def test_list_with_empty_prefix_and_values(link):
+    server, client = link
+    client.post("/b", {"n": 2})
+    client.post("/a", {"n": 1})
+    assert json.loads(client.list("/", values=True)["body"]) == \
+        {"values": {"/a": {"n": 1}, "/b": {"n": 2}}, "next": None}
+    assert json.loads(client.list("/", after="/a")["body"]) == {"keys": ["/b"], "next": None}
+
+
+def test_list_rejects_bad_limits(link):
+    server, client = link
+    assert client.list("/", limit=0)["status_code"] == 400
+    assert client.list("/", limit="many")["status_code"] == 400
@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from storage import WRITTEN, KeyIndex, LogStorage, MemoryStorage
+
+
+def test_reads_during_snapshots(tmp_path):
+    store = LogStorage(str(tmp_path), durability=WRITTEN, snapshot_records=20, lazy_bytes=16)
+    values = {f"/k{i}": {"value": "x" * 40, "i": i} for i in range(50)}
+    for key, value in values.items():
+        store[key] = value
+
+    errors = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            for key, value in values.items():
+                try:
+                    assert store[key] == value
+                except Exception as e:
+                    errors.append(e)
+                    return
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        # Every 20 writes compact the log into a new snapshot under the readers
+        for _ in range(10):
+            for key, value in values.items():
+                store[key] = value
+    finally:
+        done.set()
+        for reader in readers:
+            reader.join()
+        store.close()
+    assert errors == []
+
+    reopened = LogStorage(str(tmp_path))
+    assert {key: reopened[key] for key in reopened} == values
+    reopened.close()
+
+
+KEYS = ["/a/1", "/a/2", "/a/3", "/ab", "/b/1", "/b/2"]
+
+
+def test_prefix_scan():
+    index = KeyIndex(reversed(KEYS))
+    assert index.scan("/a/") == ["/a/1", "/a/2", "/a/3"]
+    assert index.scan("/a") == ["/a/1", "/a/2", "/a/3", "/ab"]
+    assert index.scan("/c") == []
+    assert index.scan("") == KEYS
+    index.add("/a/0")
+    index.add("/a/1")
+    index.discard("/a/3")
+    index.discard("/missing")
+    assert index.scan("/a/") == ["/a/0", "/a/1", "/a/2"]
+
+
+@pytest.mark.parametrize("after, limit, expected", [
+    (None, 2, ["/a/1", "/a/2"]),
+    ("/a/2", 2, ["/a/3"]),            # Last page is short
+    ("/a/3", 2, []),                  # Nothing after the last key
+    ("/a/1x", None, ["/a/2", "/a/3"]),  # after need not be a key
+    ("/", None, ["/a/1", "/a/2", "/a/3"]),  # after sorts before the prefix
+    ("/a/", 0, []),
+])
+def test_scan_paging(after, limit, expected):
+    assert KeyIndex(KEYS).scan("/a/", after, limit) == expected
+
+
+@pytest.mark.parametrize("storage", ["memory", "log"])
+def test_storage_scan(storage, tmp_path):
+    store = MemoryStorage() if storage == "memory" else LogStorage(str(tmp_path))
+    for key in KEYS:
+        store[key] = {"key": key}
+    del store["/a/2"]
+    assert store.scan("/a/", limit=5) == ["/a/1", "/a/3"]
+    store.close()
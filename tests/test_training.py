@@ -0,0 +1,71 @@
+import math
+import threading
+
+import pytest
+
+from comm import Comm
+from connection import FrameDecoder
+from server import Server
+from training import CTRL_RATE, LinkTrainer, control_type, estimate_ber
+from transport import PipeTransport
+
+BAD_BELOW_US = 64   # The fake wiring garbles anything faster
+
+
+class WiringPipe(PipeTransport):
+    """Pipe that flips bits once its Comm runs faster than the wiring allows."""
+    comm = None
+
+    def send(self, data, release=True):
+        self.bit_error_rate = 0.01 if self.comm.bit_period_us < BAD_BELOW_US else 0.0
+        super().send(data, release)
+
+
+def test_estimate_ber():
+    assert estimate_ber(16, 16, 1000) == 0.0
+    assert estimate_ber(0, 16, 1000) == 0.5
+    # Half the frames lost: a 1000 bit frame survives with exp(-ber * 1000) = 0.5
+    assert math.exp(-estimate_ber(8, 16, 1000) * 1000) == pytest.approx(0.5)
+
+
+def test_training_settles_on_the_fastest_clean_period():
+    client_end, server_end = WiringPipe.pair(seed=1)
+    client = Comm(transport=client_end, framed=True)
+    server = Server(transport=server_end, framed=True)
+    client_end.comm, server_end.comm = client, server
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    agreed = client.trainer.train()
+    assert agreed == 80    # 64us with the safety margin
+    assert [r.period_us for r in client.trainer.history] == [1000, 500, 250, 128, 64, 32]
+    assert client.trainer.history[-1].received < client.trainer.history[-1].expected
+    client_end.close()
+    thread.join(5)
+    assert server.bit_period_us == 80
+
+
+class SilentPeer:
+    """Framed link whose peer never answers."""
+
+    def __init__(self):
+        self.bit_period_us = 1000
+        self.frames_received = 0
+        self.frame_decoder = FrameDecoder()
+        self.sent = []
+
+    def send_frame(self, frame):
+        self.sent.append(frame)
+
+    def receive_frame(self, timeout=None):
+        raise TimeoutError("Timed out waiting for a frame")
+
+    def set_bit_period(self, bit_period_us):
+        self.bit_period_us = bit_period_us
+
+
+def test_rate_is_kept_without_rate_ack():
+    link = SilentPeer()
+    trainer = LinkTrainer(link)
+    assert not trainer._agree(100)
+    assert link.bit_period_us == 1000
+    assert [control_type(frame) for frame in link.sent] == [CTRL_RATE] * 3
@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from connection import Frame, FrameDecoder, FrameHeader
+from fec import FecCodec
+from transport import PipeTransport, SocketTransport, Transport
+
+BER = 1e-3
+SEED = 42
+
+
+def carry(data, **options):
+    """Send data one way over a new pipe; return what arrived and the sending end."""
+    a, b = PipeTransport.pair(**options)
+    a.send(data)
+    received = bytearray()
+    while len(received) < len(data):
+        received += b.receive(1.0)
+    a.close()
+    b.close()
+    return bytes(received), a
+
+
+def bit_differences(x, y):
+    return sum(bin(p ^ q).count("1") for p, q in zip(x, y))
+
+
+def test_transport_is_abstract():
+    with pytest.raises(TypeError):
+        Transport()
+
+    class SendOnly(Transport):
+        def send(self, data, release=True):
+            pass
+
+    with pytest.raises(TypeError):
+        SendOnly()
+
+
+@pytest.mark.parametrize("kind", [PipeTransport, SocketTransport])
+def test_clean_link(kind):
+    a, b = kind.pair()
+    a.send(b"hello")
+    assert b.receive(1.0) == b"hello"
+    assert b.receive(0.01) == b""
+    a.close()
+    with pytest.raises(ConnectionError):
+        b.receive(1.0)
+    b.close()
+
+
+def test_bit_errors_are_seeded():
+    data = random.Random(1).randbytes(10_000)
+    first, sender = carry(data, bit_error_rate=BER, seed=SEED)
+    again, _ = carry(data, bit_error_rate=BER, seed=SEED)
+    assert first == again
+    assert bit_differences(data, first) == sender.bit_errors
+    # 80000 bits at 1e-3: 80 expected, well inside these bounds
+    assert 40 < sender.bit_errors < 120
+
+
+def test_rejects_bad_rate():
+    with pytest.raises(ValueError):
+        PipeTransport.pair(bit_error_rate=1.0)
+
+
+def test_frame_crcs_catch_every_damaged_frame():
+    payloads = [random.Random(n).randbytes(200) for n in range(100)]
+    wire = b"".join(Frame(FrameHeader(seq=n), p).encode() for n, p in enumerate(payloads))
+    received, sender = carry(wire, bit_error_rate=BER, seed=SEED)
+    decoder = FrameDecoder()
+    frames = decoder.feed(received)
+    assert sender.bit_errors > 0
+    assert decoder.crc_errors + decoder.header_errors > 0
+    assert 0 < len(frames) < len(payloads)
+    # Whatever got through is exactly what was sent
+    for frame in frames:
+        assert frame.payload == payloads[frame.header.seq]
+
+
+@pytest.mark.parametrize("scheme", ["secded", "rs"])
+def test_fec_repairs_the_damage(scheme):
+    data = random.Random(2).randbytes(4000)
+    codec = FecCodec(scheme)
+    received, sender = carry(codec.encode(data), bit_error_rate=BER, seed=SEED)
+    assert sender.bit_errors > 0
+    assert codec.decode(received) == data
+    assert codec.stats.corrected > 0
+    assert codec.stats.uncorrectable == 0
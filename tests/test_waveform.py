@@ -0,0 +1,75 @@
+import pigpio
+import pytest
+
+from conftest import replay
+from lanes import LaneMap
+from notify import ClockedDecoder
+from waveform import WaveformSender, byte_pulses
+
+DATA, CLOCK, LATCH = 23, 24, 25
+
+
+def sampled_bits(pulses, data_pins=(DATA,), clock=CLOCK, ddr=False):
+    """Data bits on the clock edges a receiver samples on."""
+    decoder = ClockedDecoder(data_pins[0], clock, LaneMap(list(data_pins)), ddr)
+    mask = LaneMap(list(data_pins)).mask | (1 << clock)
+    return decoder.feed_levels(replay(pulses, mask))
+
+
+def test_byte_pulses_shift_out_msb_first():
+    lanes = LaneMap([DATA])
+    pulses = byte_pulses(lanes.symbols(0xA5), lanes.mask, 1 << CLOCK, bit_period_us=100)
+    assert sampled_bits(pulses) == b"\xa5"
+    # Two pulses per bit plus the return to LOW, a full period per bit
+    assert len(pulses) == 17
+    assert sum(p.delay for p in pulses[:16]) == 8 * 100
+    assert pulses[-1].gpio_off == (1 << CLOCK) | (1 << DATA)
+
+
+def test_byte_pulses_pulse_latch_after_byte():
+    lanes = LaneMap([DATA])
+    pulses = byte_pulses(lanes.symbols(0x01), lanes.mask, 1 << CLOCK, 1 << LATCH, 100)
+    assert pulses[-2].gpio_on == 1 << LATCH
+    assert pulses[-1].gpio_off == 1 << LATCH
+    held = byte_pulses(lanes.symbols(0x01), lanes.mask, 1 << CLOCK, 1 << LATCH, 100,
+                       hold_latch=True)
+    assert held[-1].gpio_on == 1 << LATCH
+
+
+def test_byte_pulses_ddr_uses_both_edges():
+    lanes = LaneMap([DATA])
+    pulses = byte_pulses(lanes.symbols(0x3C), lanes.mask, 1 << CLOCK, bit_period_us=100,
+                         ddr=True)
+    assert sampled_bits(pulses, ddr=True) == b"\x3c"
+    assert sum(p.delay for p in pulses[:-1]) == 8 * 50
+
+
+def test_sender_chains_message_as_recorded_waves(fake_pi):
+    sender = WaveformSender(fake_pi, DATA, CLOCK, bit_period_us=10, bytes_per_wave=4)
+    message = b"Hello, GPIO!"
+    sender.send(message)
+    assert len(fake_pi.chains) == 1
+    assert [name for name, _ in fake_pi.calls].count("wave_chain") == 1
+    assert sampled_bits(fake_pi.chains[0]) == message
+    assert fake_pi.waves == {}   # Every wave deleted after sending
+
+
+def test_sender_splits_chains_at_pulse_budget(fake_pi):
+    fake_pi.wave_get_max_pulses = lambda: 200
+    sender = WaveformSender(fake_pi, DATA, CLOCK, bit_period_us=10, bytes_per_wave=2)
+    message = bytes(range(20))
+    sender.send(message)
+    assert len(fake_pi.chains) > 1
+    assert sampled_bits([p for chain in fake_pi.chains for p in chain]) == message
+
+
+def test_sender_multi_lane(fake_pi):
+    pins = [DATA, 22, 27, 17]
+    sender = WaveformSender(fake_pi, DATA, CLOCK, bit_period_us=10, lanes=LaneMap(pins))
+    sender.send(b"\x5a\xff\x00")
+    assert sampled_bits(fake_pi.chains[0], pins) == b"\x5a\xff\x00"
+
+
+def test_sender_rejects_tiny_bit_period(fake_pi):
+    with pytest.raises(ValueError):
+        WaveformSender(fake_pi, DATA, CLOCK, bit_period_us=1)
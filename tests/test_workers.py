@@ -0,0 +1,67 @@
+import threading
+import time
+
+from workers import WorkerPool
+
+
+def test_runs_keys_side_by_side_and_each_key_in_order():
+    seen = []
+
+    def handler(message):
+        key, i = message
+        time.sleep(0.01)
+        seen.append(message)
+        return i
+
+    pool = WorkerPool(handler, workers=4)
+    started = time.perf_counter()
+    futures = [pool.submit(key, (key, i)) for i in range(5) for key in "abcd"]
+    assert [future.result(5) for future in futures] == [i for i in range(5) for _ in "abcd"]
+    elapsed = time.perf_counter() - started
+    pool.close()
+    for key in "abcd":
+        assert [i for k, i in seen if k == key] == list(range(5))
+    assert elapsed < 20 * 0.01   # Not one at a time
+    assert pool.stats['handled'] == 20
+
+
+def test_decode_and_encode_follow_wire_order():
+    decoded, encoded = [], []
+    submitter = threading.current_thread()
+
+    def decode(message, key):
+        assert threading.current_thread() is submitter
+        decoded.append((key, message))
+        return message
+
+    def handler(message):
+        # Later requests finish first if handlers run side by side
+        time.sleep(0.02 / (1 + message % 4))
+        return message
+
+    def encode(response, key):
+        encoded.append((key, response))
+        return response
+
+    pool = WorkerPool(handler, workers=4, decode=decode, encode=encode)
+    futures = [pool.submit(i % 2, i) for i in range(12)]
+    assert [future.result(5) for future in futures] == list(range(12))
+    pool.close()
+    assert decoded == [(i % 2, i) for i in range(12)]
+    for key in (0, 1):
+        assert [i for k, i in encoded if k == key] == list(range(key, 12, 2))
+
+
+def test_failed_handler_fails_its_future_only():
+    def handler(message):
+        if message == "bad":
+            raise ValueError("bad")
+        return message
+
+    pool = WorkerPool(handler, workers=2)
+    bad = pool.submit(None, "bad")
+    good = pool.submit(None, "good")
+    assert isinstance(bad.exception(5), ValueError)
+    assert good.result(5) == "good"
+    pool.close()
+    assert pool.stats['errors'] == 1